@@ -0,0 +1,375 @@
+# ai.py
+# Gomoku search engine for the built-in AI opponent.
+# - negamax alpha-beta with iterative deepening under a wall-clock budget
+# - candidate moves are empty cells near existing stones, ordered by how much they gain for either side
+# - threat pruning: an immediate win is taken at once, and if the opponent threatens to win on the
+#   next move only the blocking cells are searched
+# - Zobrist hashing with a fixed-size transposition table shared across the engine's searches
+# Evaluation counts every `win`-long window on a line: a window holding n stones of one side and none
+# of the other is worth WINDOW_BASE ** (n - 1) to that side. The score is updated incrementally on
+# every move, and the children of a depth-1 node are scored straight from the gain without playing them.
+import random
+import time
+
+# player numbers used inside the engine
+X, O = 1, 2
+OFF_BOARD = 3
+SYMBOL_PLAYER = {'X': X, 'O': O}
+PLAYER_SYMBOL = {X: 'X', O: 'O'}
+
+WIN_SCORE = 1 << 40
+WINDOW_BASE = 8
+DIRS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
+# TT entry flags
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# pattern table entries: gain in the low 31 bits, "wins here" in the top bit
+GAIN_MASK = (1 << 31) - 1
+
+class SearchTimeout(Exception):
+    pass
+
+class Zobrist:
+    # lazily generated random keys, so unbounded boards get keys only for cells that are used
+    def __init__(self, seed=0x5EED):
+        self.rng = random.Random(seed)
+        self.keys = {}
+        self.side = self.rng.getrandbits(64)
+
+    def key(self, x, y, player):
+        k = (x, y, player)
+        v = self.keys.get(k)
+        if v is None:
+            v = self.keys[k] = self.rng.getrandbits(64)
+        return v
+
+def line_gain(line, win, s):
+    # gains of an X / O stone on the empty centre of `line` (2*win-1 cell values), counted over the
+    # win windows through it, and whether it completes a row for X / O
+    g1 = g2 = 0
+    w1 = w2 = False
+    counts = [0, 0, 0, 0]
+    for v in line[:win]:
+        counts[v] += 1
+    start = 0
+    while True:
+        if not counts[OFF_BOARD]:
+            c1, c2 = counts[X], counts[O]
+            if not c2:
+                g1 += s[c1 + 1] - s[c1]
+                g2 += s[c1]
+                if c1 == win - 1:
+                    w1 = True
+            if not c1:
+                g2 += s[c2 + 1] - s[c2]
+                g1 += s[c2]
+                if c2 == win - 1:
+                    w2 = True
+        if start == win - 1:
+            break
+        counts[line[start]] -= 1
+        counts[line[start + win]] += 1
+        start += 1
+    return g1, g2, w1, w2
+
+def window_scores(win):
+    return [WINDOW_BASE ** (n - 1) if n else 0 for n in range(win + 1)]
+
+def line_offsets(win):
+    # per direction, the 2*(win-1) neighbour offsets in pattern-code order (most significant first)
+    return [[(k * dx, k * dy) for k in range(1 - win, win) if k] for dx, dy in DIRS]
+
+class Position:
+    def __init__(self, size, win, zobrist, near_radius=2, table=None):
+        self.size = size          # 0 = unbounded
+        self.win = win
+        self.zobrist = zobrist
+        self.cells = {}           # (x, y) -> X / O
+        self.near = {}            # (x, y) -> number of stones within near_radius (candidate cells)
+        self.hash = 0
+        self.score = 0            # evaluation from X's point of view
+        self.history = []         # (x, y, score delta)
+        self.scores = window_scores(win)
+        self.table = table        # pattern table for this win length, or None to count windows directly
+        self.line_offsets = line_offsets(win)
+        self.offsets = [(dx, dy) for dx in range(-near_radius, near_radius + 1)
+                        for dy in range(-near_radius, near_radius + 1) if dx or dy]
+
+    def inside(self, x, y):
+        return not self.size or (0 <= x < self.size and 0 <= y < self.size)
+
+    def scan(self, x, y):
+        # for a stone on empty (x, y): (gain for X, gain for O, X wins there, O wins there)
+        if self.table is not None:
+            return self.scan_table(x, y)
+        cells = self.cells
+        size = self.size
+        win = self.win
+        s = self.scores
+        g1 = g2 = 0
+        w1 = w2 = False
+        for dx, dy in DIRS:
+            line = []
+            for k in range(1 - win, win):
+                if k == 0:
+                    line.append(0)
+                    continue
+                cx, cy = x + k * dx, y + k * dy
+                if size and not (0 <= cx < size and 0 <= cy < size):
+                    line.append(OFF_BOARD)
+                else:
+                    line.append(cells.get((cx, cy), 0))
+            a1, a2, b1, b2 = line_gain(line, win, s)
+            g1 += a1
+            g2 += a2
+            w1 = w1 or b1
+            w2 = w2 or b2
+        return g1, g2, w1, w2
+
+    def scan_table(self, x, y):
+        # same as scan(), with each direction's neighbour cells encoded base 4 and looked up in the
+        # precomputed pattern table (patterns.py)
+        cells = self.cells
+        size = self.size
+        table = self.table
+        g1 = g2 = 0
+        w1 = w2 = 0
+        for offsets in self.line_offsets:
+            code = 0
+            for dx, dy in offsets:
+                cx, cy = x + dx, y + dy
+                if size and not (0 <= cx < size and 0 <= cy < size):
+                    code = code * 4 + OFF_BOARD
+                else:
+                    code = code * 4 + cells.get((cx, cy), 0)
+            a = table[2 * code]
+            b = table[2 * code + 1]
+            g1 += a & GAIN_MASK
+            g2 += b & GAIN_MASK
+            w1 |= a
+            w2 |= b
+        return g1, g2, w1 > GAIN_MASK, w2 > GAIN_MASK
+
+    def play(self, x, y, player, gain=None):
+        if gain is None:
+            g1, g2, _, _ = self.scan(x, y)
+            gain = g1 if player == X else g2
+        delta = gain if player == X else -gain
+        self.score += delta
+        self.cells[(x, y)] = player
+        self.hash ^= self.zobrist.key(x, y, player)
+        self.history.append((x, y, delta))
+        near = self.near
+        for dx, dy in self.offsets:
+            c = (x + dx, y + dy)
+            near[c] = near.get(c, 0) + 1
+
+    def undo(self):
+        x, y, delta = self.history.pop()
+        player = self.cells.pop((x, y))
+        self.score -= delta
+        self.hash ^= self.zobrist.key(x, y, player)
+        near = self.near
+        for dx, dy in self.offsets:
+            c = (x + dx, y + dy)
+            n = near[c] - 1
+            if n:
+                near[c] = n
+            else:
+                del near[c]
+
+    def candidates(self, player):
+        # ([(priority, x, y, gain for player)], winning cell or None, opponent's winning cells)
+        cells = self.cells
+        moves = []
+        threats = []
+        for (x, y) in self.near:
+            if (x, y) in cells or not self.inside(x, y):
+                continue
+            g1, g2, w1, w2 = self.scan(x, y)
+            if player == X:
+                mine, theirs, win_here, lose_here = g1, g2, w1, w2
+            else:
+                mine, theirs, win_here, lose_here = g2, g1, w2, w1
+            if win_here:
+                return moves, (x, y), threats
+            if lose_here:
+                threats.append((x, y))
+            moves.append((mine + theirs, x, y, mine))
+        moves.sort(reverse=True)
+        return moves, None, threats
+
+class TranspositionTable:
+    # fixed number of slots indexed by the low hash bits; a newer or deeper entry replaces the old one
+    def __init__(self, bits=18):
+        self.mask = (1 << bits) - 1
+        self.slots = [None] * (1 << bits)
+
+    def get(self, key):
+        e = self.slots[key & self.mask]
+        if e is not None and e[0] == key:
+            return e
+        return None
+
+    def put(self, key, depth, flag, value, move):
+        i = key & self.mask
+        e = self.slots[i]
+        if e is None or e[0] != key or depth >= e[1]:
+            self.slots[i] = (key, depth, flag, value, move)
+
+    def clear(self):
+        self.slots = [None] * len(self.slots)
+
+class Engine:
+    # use_tables: evaluate with the precomputed pattern table (patterns.py) where one exists;
+    # use_book: answer early positions from the opening book (opening.py) without searching.
+    # Both are loaded on the first search that needs them.
+    def __init__(self, tt_bits=18, max_branch=12, near_radius=2, use_tables=True, use_book=True):
+        self.zobrist = Zobrist()
+        self.use_tables = use_tables
+        self.use_book = use_book
+        self.tt = TranspositionTable(tt_bits)
+        self.max_branch = max_branch
+        self.near_radius = near_radius
+        self.nodes = 0      # positions evaluated, including depth-1 leaves scored without playing them
+        self.visits = 0     # negamax calls, used to pace the clock checks
+        self.deadline = None
+        self.should_stop = None
+        self.depth_reached = 0
+
+    def position(self, size, win, stones):
+        # build a Position from (x, y, 'X'/'O') tuples
+        table = None
+        if self.use_tables:
+            import patterns
+            table = patterns.get_table(win)
+        pos = Position(size, win, self.zobrist, self.near_radius, table)
+        for x, y, sym in stones:
+            pos.play(x, y, SYMBOL_PLAYER[sym])
+        return pos
+
+    def best_move(self, size, win, stones, sym, time_budget=1.0, max_depth=8, should_stop=None):
+        # best (x, y) for `sym` within roughly `time_budget` seconds, searching at most max_depth plies
+        if self.use_book:
+            import opening
+            move = opening.lookup(size, win, stones, sym)
+            if move is not None and all((x, y) != move[:2] for x, y, _ in stones):
+                self.nodes = 0
+                self.depth_reached = 0
+                return move
+        pos = self.position(size, win, stones)
+        return self.search_position(pos, SYMBOL_PLAYER[sym], time_budget, max_depth, should_stop)
+
+    def search_position(self, pos, player, time_budget=1.0, max_depth=8, should_stop=None):
+        self.nodes = 0
+        self.visits = 0
+        self.depth_reached = 0
+        self.should_stop = should_stop
+        self.deadline = time.perf_counter() + time_budget if time_budget else None
+        if not pos.cells:
+            c = pos.size // 2 if pos.size else 0
+            return (c, c)
+        moves, winning, threats = pos.candidates(player)
+        if winning:
+            return winning
+        if len(threats) == 1:
+            return threats[0]
+        if not moves:
+            return None
+        best = (moves[0][1], moves[0][2])
+        for depth in range(1, max_depth + 1):
+            try:
+                value, move = self.root(pos, player, depth, best)
+            except SearchTimeout:
+                break
+            if move:
+                best = move
+            self.depth_reached = depth
+            if abs(value) >= WIN_SCORE // 2:
+                break
+        return best
+
+    def root(self, pos, player, depth, first):
+        moves, _, threats = pos.candidates(player)
+        if threats:
+            moves = [m for m in moves if (m[1], m[2]) in threats]
+        moves = moves[:self.max_branch]
+        # search the previous iteration's best move first
+        moves.sort(key=lambda m: (m[1], m[2]) != first)
+        alpha, beta = -WIN_SCORE, WIN_SCORE
+        best_move = None
+        for _, x, y, gain in moves:
+            pos.play(x, y, player, gain)
+            try:
+                value = -self.negamax(pos, 3 - player, depth - 1, -beta, -alpha, 1)
+            finally:
+                pos.undo()
+            if best_move is None or value > alpha:
+                alpha = value
+                best_move = (x, y)
+        return alpha, best_move
+
+    def negamax(self, pos, player, depth, alpha, beta, ply):
+        self.nodes += 1
+        self.visits += 1
+        if not self.visits & 15:
+            if self.deadline and time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+            if self.should_stop and self.should_stop():
+                raise SearchTimeout()
+        base = pos.score if player == X else -pos.score
+        if depth == 0:
+            return base
+        key = pos.hash ^ (self.zobrist.side if player == O else 0)
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            _, e_depth, flag, value, tt_move = entry
+            if e_depth >= depth:
+                if flag == EXACT:
+                    return value
+                if flag == LOWER and value >= beta:
+                    return value
+                if flag == UPPER and value <= alpha:
+                    return value
+        moves, winning, threats = pos.candidates(player)
+        if winning:
+            return WIN_SCORE - ply
+        if not moves:
+            return 0
+        if threats:
+            # the opponent wins next move unless one of these cells is taken
+            moves = [m for m in moves if (m[1], m[2]) in threats] or moves[:1]
+        if depth == 1:
+            # leaf children: the incremental score after each move, without playing it
+            self.nodes += len(moves)
+            if threats and len(threats) > 1:
+                return -(WIN_SCORE - ply - 1)
+            return base + max(m[3] for m in moves)
+        moves = moves[:self.max_branch]
+        if tt_move is not None:
+            moves.sort(key=lambda m: (m[1], m[2]) != tt_move)
+        orig_alpha = alpha
+        best = -WIN_SCORE
+        best_move = None
+        for _, x, y, gain in moves:
+            pos.play(x, y, player, gain)
+            try:
+                value = -self.negamax(pos, 3 - player, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                pos.undo()
+            if value > best:
+                best = value
+                best_move = (x, y)
+            if value > alpha:
+                alpha = value
+            if alpha >= beta:
+                break
+        flag = EXACT
+        if best <= orig_alpha:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        self.tt.put(key, depth, flag, best, best_move)
+        return best
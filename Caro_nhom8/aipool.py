@@ -0,0 +1,139 @@
+# aipool.py
+# Process pool for AI searches. A search is CPU-bound Python, so on a thread it would hold the GIL
+# against every connection thread (or the asyncio loop) and slow down moves in human rooms.
+# Each search process owns an ai.Engine and is sent one request at a time over a pipe as a packed
+# position (header + int16 coordinates, X stones then O stones).
+# Deadlines: the child searches within the request's budget; the parent waits at most
+# budget + HARD_GRACE and kills and respawns a child that overruns.
+# Cancellation: when should_stop() turns true (the bot's room was left, closed or restarted) the
+# parent writes the job id into a shared counter that the child's search polls, then discards the reply.
+import itertools
+import multiprocessing
+import os
+import queue
+import struct
+import threading
+import time
+from array import array
+import logger
+from ai import PLAYER_SYMBOL, SYMBOL_PLAYER, Engine
+
+# search processes; 0 runs searches on the calling thread instead
+AI_PROCESSES = os.cpu_count() or 1
+HARD_GRACE = 0.5       # seconds past the budget before a search process is killed
+POLL_INTERVAL = 0.02   # how often a waiting request checks should_stop()
+
+# job id, size, win, side to move, max depth, time budget, number of X stones
+_REQUEST = struct.Struct('=IBBBBfH')
+# job id, move found, x, y, nodes, depth reached
+_REPLY = struct.Struct('=IBhhIB')
+
+def pack_request(job_id, size, win, stones, sym, budget, max_depth):
+    xs = array('h')
+    os_ = array('h')
+    for x, y, s in stones:
+        (xs if s == 'X' else os_).extend((x, y))
+    header = _REQUEST.pack(job_id, size, win, SYMBOL_PLAYER[sym], max_depth, budget, len(xs) // 2)
+    return header + xs.tobytes() + os_.tobytes()
+
+def unpack_request(data):
+    job_id, size, win, player, max_depth, budget, n_x = _REQUEST.unpack_from(data)
+    coords = array('h')
+    coords.frombytes(data[_REQUEST.size:])
+    stones = [(coords[i], coords[i + 1], 'X' if i < 2 * n_x else 'O') for i in range(0, len(coords), 2)]
+    return job_id, size, win, stones, PLAYER_SYMBOL[player], budget, max_depth
+
+def worker_main(conn, cancel):
+    # search process: one request at a time until the pipe closes
+    engine = Engine()
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except (EOFError, OSError):
+            return
+        job_id, size, win, stones, sym, budget, max_depth = unpack_request(data)
+        move = engine.best_move(size, win, stones, sym, budget, max_depth,
+                                should_stop=lambda: cancel.value == job_id)
+        x, y = move or (0, 0)
+        conn.send_bytes(_REPLY.pack(job_id, move is not None, x, y, engine.nodes, engine.depth_reached))
+
+class SearchProcess:
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.job_ids = itertools.count(1)
+        self.start()
+
+    def start(self):
+        self.conn, child = self.ctx.Pipe()
+        self.cancel = self.ctx.RawValue('I', 0)
+        self.proc = self.ctx.Process(target=worker_main, args=(child, self.cancel), daemon=True)
+        self.proc.start()
+        child.close()
+
+    def restart(self):
+        self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+        self.start()
+
+    def search(self, size, win, stones, sym, budget, max_depth, should_stop=None):
+        job_id = next(self.job_ids) & 0xFFFFFFFF
+        now = time.monotonic()
+        deadline = now + budget + HARD_GRACE if budget else None
+        cancelled = False
+        try:
+            self.conn.send_bytes(pack_request(job_id, size, win, stones, sym, budget, max_depth))
+            while not self.conn.poll(POLL_INTERVAL):
+                now = time.monotonic()
+                if not cancelled and should_stop and should_stop():
+                    self.cancel.value = job_id
+                    cancelled = True
+                    deadline = min(deadline or now + HARD_GRACE, now + HARD_GRACE)
+                if deadline and now > deadline:
+                    logger.warning("ai_process_restarted", pid=self.proc.pid, reason="deadline")
+                    self.restart()
+                    return None
+            _, found, x, y, _, _ = _REPLY.unpack(self.conn.recv_bytes())
+        except (EOFError, OSError):
+            logger.warning("ai_process_restarted", pid=self.proc.pid, reason="died")
+            self.restart()
+            return None
+        if cancelled or (should_stop and should_stop()) or not found:
+            return None
+        return x, y
+
+class SearchPool:
+    # requests wait for an idle process; each process handles one search at a time
+    def __init__(self, processes=AI_PROCESSES):
+        ctx = multiprocessing.get_context('spawn')
+        self.processes = [SearchProcess(ctx) for _ in range(processes)]
+        self.idle = queue.Queue()
+        for p in self.processes:
+            self.idle.put(p)
+
+    def search(self, size, win, stones, sym, budget, max_depth, should_stop=None):
+        # best (x, y) for `sym`, or None if cancelled or the search process failed
+        proc = self.idle.get()
+        try:
+            if should_stop and should_stop():
+                return None
+            return proc.search(size, win, stones, sym, budget, max_depth, should_stop)
+        finally:
+            self.idle.put(proc)
+
+    def close(self):
+        for p in self.processes:
+            p.proc.kill()
+            p.proc.join()
+            p.conn.close()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    # the shared pool, started on first use; None when AI_PROCESSES is 0
+    global _pool
+    with _pool_lock:
+        if _pool is None and AI_PROCESSES:
+            _pool = SearchPool(AI_PROCESSES)
+        return _pool
@@ -0,0 +1,192 @@
+# analyze.py
+# Command-line tool for game records files (records.py, written by `main.py server --records FILE`).
+#   python analyze.py stats FILE [--workers N] [--json]   replay every game, report aggregate stats
+#   python analyze.py export FILE                          records -> JSON lines on stdout
+#   python analyze.py import JSONL FILE                    JSON lines -> records appended to FILE
+# stats maps the file and never loads it whole: the main process only walks record lengths to cut the
+# file into chunks, and worker processes map it themselves and replay their chunks' moves through the
+# server's win detection (board.py), so the recorded result of every game is checked as well.
+# Games lost on time or forfeited count as decided by their recorded winner; their moves must hold no win.
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+from collections import Counter
+import records
+from board import make_board
+
+CHUNK_BYTES = 4 * 1024 * 1024   # records file bytes per worker job
+LENGTH_BUCKET = 10              # game length histogram bucket, in moves
+
+# replayed outcomes, relative to the first mover
+NO_WINNER, FIRST_WINS, SECOND_WINS, INVALID = 0, 1, 2, 3
+
+def usage():
+    print("Usage: python analyze.py stats FILE [--workers N] [--json]")
+    print("       python analyze.py export FILE > games.jsonl")
+    print("       python analyze.py import games.jsonl FILE")
+
+def replay_game(size, win, moves):
+    # outcome of a flat x0, y0, x1, y1, ... move list; INVALID for an illegal move or a move after the win
+    board = make_board(size, win)
+    n = len(moves)
+    for i in range(0, n, 2):
+        x, y = moves[i], moves[i + 1]
+        if not board.contains(x, y) or not board.is_empty(x, y):
+            return INVALID
+        first = i % 4 == 0
+        if board.place(x, y, 'X' if first else 'O'):
+            if i + 2 != n:
+                return INVALID
+            return FIRST_WINS if first else SECOND_WINS
+    return NO_WINNER
+
+def new_stats():
+    return {'games': 0, 'first_wins': 0, 'second_wins': 0, 'draws': 0, 'invalid': 0, 'mismatched': 0,
+            'timeouts': 0, 'forfeits': 0, 'moves': 0, 'with_bot': 0, 'lengths': Counter()}
+
+def merge(total, part):
+    for key, value in part.items():
+        total[key] += value
+
+def replay_chunk(job):
+    # worker: replay the records starting in [start, end) of the file
+    path, start, end = job
+    stats = new_stats()
+    lengths = stats['lengths']
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        dropped = start
+        try:
+            for pos in records.offsets(mm, start):
+                if pos >= end:
+                    break
+                _, _, size, win, bots, first, result, _, _, count = records.decode_header(mm, pos)
+                moves = records.moves_view(view, pos, count)
+                outcome = replay_game(size, win, moves)
+                moves.release()
+                if pos - dropped >= CHUNK_BYTES // 4:
+                    drop_pages(mm, dropped, pos)
+                    dropped = pos
+                stats['games'] += 1
+                stats['moves'] += count
+                lengths[count // LENGTH_BUCKET * LENGTH_BUCKET] += 1
+                if bots:
+                    stats['with_bot'] += 1
+                if outcome == INVALID:
+                    stats['invalid'] += 1
+                    continue
+                winner = records.winner(result)
+                if winner == records.DRAW:
+                    recorded = NO_WINNER
+                else:
+                    recorded = FIRST_WINS if winner == first else SECOND_WINS
+                if result & (records.TIMEOUT | records.FORFEIT):
+                    # won on time or by forfeit: the moves end without a winner, the record says who won
+                    stats['timeouts' if result & records.TIMEOUT else 'forfeits'] += 1
+                    if outcome != NO_WINNER:
+                        stats['mismatched'] += 1
+                    outcome = recorded
+                elif recorded != outcome:
+                    stats['mismatched'] += 1
+                if outcome == FIRST_WINS:
+                    stats['first_wins'] += 1
+                elif outcome == SECOND_WINS:
+                    stats['second_wins'] += 1
+                else:
+                    stats['draws'] += 1
+        finally:
+            view.release()
+    return stats
+
+def drop_pages(mm, start, end):
+    # let the kernel take back mapped pages already read, so resident memory stays flat over a huge file
+    if hasattr(mm, 'madvise'):
+        start -= start % mmap.PAGESIZE
+        if end > start:
+            mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+def chunks(path):
+    # (path, start, end) jobs of about CHUNK_BYTES each, cut at record boundaries
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = records.check_magic(mm)
+        for pos in records.offsets(mm):
+            if pos - start >= CHUNK_BYTES:
+                yield path, start, pos
+                drop_pages(mm, start, pos)
+                start = pos
+        yield path, start, len(mm)
+
+def stats(path, workers=None):
+    total = new_stats()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for job in chunks(path):
+            merge(total, replay_chunk(job))
+        return total
+    with multiprocessing.Pool(workers) as pool:
+        for part in pool.imap_unordered(replay_chunk, chunks(path)):
+            merge(total, part)
+    return total
+
+def summary(total):
+    decided = total['first_wins'] + total['second_wins']
+    return {
+        'games': total['games'],
+        'first_mover_win_rate': round(total['first_wins'] / decided, 4) if decided else None,
+        'first_wins': total['first_wins'], 'second_wins': total['second_wins'], 'draws': total['draws'],
+        'timeouts': total['timeouts'], 'forfeits': total['forfeits'],
+        'invalid': total['invalid'], 'result_mismatches': total['mismatched'], 'with_bot': total['with_bot'],
+        'avg_moves': round(total['moves'] / total['games'], 1) if total['games'] else None,
+        'length_histogram': {f"{b}-{b + LENGTH_BUCKET - 1}": n for b, n in sorted(total['lengths'].items())},
+    }
+
+def print_summary(s):
+    print(f"Games: {s['games']}  (with a bot: {s['with_bot']}, average {s['avg_moves']} moves)")
+    print(f"First mover wins: {s['first_wins']}  second mover wins: {s['second_wins']}  draws: {s['draws']}")
+    print(f"First mover win rate (decided games): {s['first_mover_win_rate']}")
+    if s['timeouts'] or s['forfeits']:
+        print(f"Won on time: {s['timeouts']}  by forfeit: {s['forfeits']}")
+    if s['invalid'] or s['result_mismatches']:
+        print(f"Invalid games: {s['invalid']}  recorded result differs from replay: {s['result_mismatches']}")
+    print("Game length (moves):")
+    widest = max(s['length_histogram'].values(), default=0)
+    for bucket, n in s['length_histogram'].items():
+        bar = '#' * (40 * n // widest) if widest else ''
+        print(f"  {bucket:>9} {n:>9} {bar}")
+
+def export(path, out=sys.stdout):
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for pos in records.offsets(mm):
+            out.write(json.dumps(records.to_dict(mm, pos)) + "\n")
+
+def import_(jsonl, path):
+    writer = records.RecordWriter(path).start()
+    with open(jsonl, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                writer.append(records.from_dict(json.loads(line)))
+    writer.close()
+    return writer.records
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] not in {"stats", "export", "import"}:
+        usage()
+        sys.exit(1)
+    if args[0] == "stats" and len(args) >= 2:
+        workers = int(args[args.index("--workers") + 1]) if "--workers" in args else None
+        result = summary(stats(args[1], workers))
+        if "--json" in args:
+            print(json.dumps(result))
+        else:
+            print_summary(result)
+    elif args[0] == "export" and len(args) == 2:
+        export(args[1])
+    elif args[0] == "import" and len(args) == 3:
+        print(f"Imported {import_(args[1], args[2])} games into {args[2]}")
+    else:
+        usage()
+        sys.exit(1)
@@ -0,0 +1,194 @@
+# aserver.py
+# asyncio server mode: every connection is a task on one event loop instead of one OS thread.
+# The room/match logic is the same as server.py; only the transport differs.
+import asyncio
+import socket
+import logger
+import server
+from codec import decode_frame
+from common import async_recv_frame
+from journal import FLUSH_INTERVAL
+from metrics import BYTES_IN, CONNECTIONS_TOTAL
+from outbound import STALL_CHECK, WaterMarks, limit_send_buffer
+
+# live connections, for the connection gauges
+connections = set()
+# the server's background tasks (lobby and timer tickers): the loop keeps only weak references
+tasks = set()
+
+class StreamSock:
+    # socket-like adapter so the handlers in server.py can write to an asyncio stream.
+    # write() only buffers in the transport (which coalesces pending frames into one send), so it
+    # never blocks the event loop; the transport buffer is held to the same water marks as the
+    # threaded server's OutboundQueue, looked at on every write and every STALL_CHECK while over them.
+    def __init__(self, writer: asyncio.StreamWriter, marks=None):
+        self.writer = writer
+        self.marks = marks or WaterMarks()
+        self.moving = False   # being handed to another worker: nothing more is written here
+        self.loop = asyncio.get_running_loop()
+        self.timer = None     # the next water-mark check, while the buffer is over the high mark
+        writer.transport.set_write_buffer_limits(high=self.marks.high_water, low=self.marks.low_water)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            limit_send_buffer(sock)
+
+    def sendall(self, data):
+        if self.moving or self.writer.is_closing():
+            return
+        self.writer.write(data)
+        self.check_marks()
+
+    def check_marks(self, timer=False):
+        # also run by a timer while the buffer is over the high mark: a client that stops reading
+        # after the last frame sent to it is still evicted in time
+        if timer:
+            self.timer = None
+        if self.moving or self.writer.is_closing():
+            return
+        if self.marks.should_evict(self.writer.transport.get_write_buffer_size()):
+            # drop the backlog; the reader task then sees the connection go away and disconnects it
+            logger.warning("slow_client_evicted", addr=self.writer.get_extra_info('peername'))
+            self.writer.transport.abort()
+        elif self.marks.over_since is not None and self.timer is None:
+            self.timer = self.loop.call_later(STALL_CHECK, self.check_marks, True)
+
+    def close(self):
+        self.writer.close()
+
+    def shutdown(self, how=None):
+        # like socket.shutdown on a blocked reader: the reader task sees the connection end
+        self.writer.transport.abort()
+
+async def handle_client(reader, writer, moved_in=None):
+    # moved_in: the state of a connection handed over by another worker (see adopt)
+    if moved_in:
+        addr = tuple(moved_in['addr'])
+    else:
+        addr = writer.get_extra_info('peername')
+        CONNECTIONS_TOTAL.inc()
+        logger.info("client_connected", addr=addr)
+    conn = server.Connection(StreamSock(writer), addr)
+    connections.add(conn)
+    server.watch_connection(conn)
+    try:
+        if moved_in:
+            server.arrive(conn, moved_in)
+        while True:
+            body = await async_recv_frame(reader)
+            if body is None:
+                logger.info("client_disconnected", addr=addr)
+                server.handle_disconnect(conn)
+                break
+            BYTES_IN.inc(4 + len(body))
+            conn.last_seen = server.wheel.tick
+            msg = decode_frame(body)
+            try:
+                server.dispatch(conn, msg)
+            except server.Moved as moved:
+                if await move_connection(conn, reader, writer, msg, moved.shard):
+                    return
+            # backpressure on this connection only: stop reading while its replies are unsent
+            await writer.drain()
+    except Exception as e:
+        logger.error("client_handler_error", addr=addr, error=e)
+        server.handle_disconnect(conn)
+    finally:
+        connections.discard(conn)
+        server.unsubscribe_lobby(conn)
+        conn.last_seen = None
+        try:
+            writer.close()
+        except:
+            pass
+
+async def move_connection(conn, reader, writer, msg, shard):
+    # hand the connection to worker `shard` (server.move_connection for the threaded server): stop
+    # reading, let the transport send everything buffered, pass the socket with what the reader
+    # holds unhandled, then drop it here without closing the connection
+    state = server.detach(conn, msg)
+    sock = conn.sock
+    transport = writer.transport
+    transport.pause_reading()
+    sock.moving = True
+    transport.set_write_buffer_limits(high=0)
+    try:
+        await asyncio.wait_for(writer.drain(), server.HANDOFF_TIMEOUT)
+        pending = bytes(reader._buffer)
+        fd = transport.get_extra_info('socket').fileno()
+        # a blocking send on the cluster's control socket; keep it off the loop
+        moved = await asyncio.get_running_loop().run_in_executor(None, server.hand_off, shard, fd, state, pending)
+    except (asyncio.TimeoutError, ConnectionError):
+        moved = False
+    if moved:
+        logger.info("client_moved", addr=conn.addr, shard=shard)
+        transport.abort()
+        return True
+    sock.moving = False
+    transport.set_write_buffer_limits(high=sock.marks.high_water, low=sock.marks.low_water)
+    transport.resume_reading()
+    server.undo_detach(conn, state)
+    return False
+
+async def adopt_connection(fd, state, pending):
+    # serve a connection handed over by another worker, starting with the bytes its reader there had
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    reader.feed_data(pending)
+    protocol = asyncio.StreamReaderProtocol(reader)
+    transport, _ = await loop.connect_accepted_socket(lambda: protocol, socket.socket(fileno=fd))
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    await handle_client(reader, writer, state)
+
+async def lobby_ticker():
+    while True:
+        await asyncio.sleep(server.LOBBY_TICK)
+        try:
+            server.flush_lobby()
+        except Exception as e:
+            logger.error("lobby_update_error", error=e)
+
+async def timer_ticker():
+    # the timeouts run on the loop, like every other handler
+    while True:
+        await asyncio.sleep(server.TIMER_TICK)
+        server.run_timers()
+
+async def serve(host, port, journal_dir=None, flush_interval=FLUSH_INTERVAL, records_path=None, reuse_port=False,
+                ratings_path=None):
+    # in-process peers (AI opponents) act from their own threads; run their handlers on the loop
+    loop = asyncio.get_running_loop()
+    server.call_soon = loop.call_soon_threadsafe
+    # connections handed over by other workers arrive on the cluster's threads, too
+    server.adopt = lambda fd, state, pending: asyncio.run_coroutine_threadsafe(
+        adopt_connection(fd, state, pending), loop)
+    # spectator fan-out runs as its own loop callback, after the handler that queued it
+    server.defer = loop.call_soon
+    if ratings_path:
+        server.start_ratings(ratings_path)
+    if journal_dir:
+        # recovered AI opponents start thinking straight away, so the hooks above come first
+        server.start_journal(journal_dir, flush_interval)
+    if records_path:
+        server.start_records(records_path)
+    srv = await asyncio.start_server(handle_client, host, port, reuse_address=True, reuse_port=reuse_port or None,
+                                     backlog=1024)
+    for ticker in (lobby_ticker(), timer_ticker()):
+        tasks.add(asyncio.create_task(ticker))
+    server.register_connection_gauges(
+        lambda: len(connections),
+        lambda: sum(c.sock.writer.transport.get_write_buffer_size() for c in list(connections)))
+    logger.info("listening", host=host, port=port, mode="asyncio")
+    try:
+        async with srv:
+            await srv.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+        tasks.clear()
+
+def async_server_handler(host="127.0.0.1", port=5000, journal_dir=None, flush_interval=FLUSH_INTERVAL,
+                         records_path=None, reuse_port=False, ratings_path=None):
+    try:
+        asyncio.run(serve(host, port, journal_dir, flush_interval, records_path, reuse_port, ratings_path))
+    except KeyboardInterrupt:
+        pass
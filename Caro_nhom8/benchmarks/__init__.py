@@ -0,0 +1 @@
+# benchmarks package: run from the Caro_nhom8 folder, e.g. `python -m benchmarks.server_modes`
@@ -0,0 +1,84 @@
+# benchmarks/_util.py
+# shared helpers for the benchmark scripts
+import os
+import socket
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def start_server(mode, port, extra_args=()):
+    # launch `python main.py <mode> 127.0.0.1 <port>` and wait until it accepts connections
+    proc = subprocess.Popen([sys.executable, "main.py", mode, "127.0.0.1", str(port), *extra_args],
+                            cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"server mode {mode!r} did not start on port {port}")
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def proc_stats(pid):
+    # resident memory (KiB), thread count and CPU seconds of a process, from /proc (Linux only)
+    stats = {'rss_kb': None, 'threads': None, 'cpu_s': None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    stats['rss_kb'] = int(line.split()[1])
+                elif line.startswith("Threads:"):
+                    stats['threads'] = int(line.split()[1])
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+            stats['cpu_s'] = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        pass
+    return stats
+
+def children(pid):
+    # process ids of a process's children (the workers of `main.py --workers N`), from /proc (Linux only)
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(c) for c in f.read().split()]
+    except OSError:
+        return []
+
+def non_winning_moves(size=10, count=40):
+    # alternating X/O moves on a size x size board where nobody ever gets 5 in a row,
+    # so a benchmark game can run `count` moves without the match finishing
+    x_cells = [(x, y) for y in range(size) for x in range(size) if ((x // 2) + y) % 2 == 0]
+    o_cells = [(x, y) for y in range(size) for x in range(size) if ((x // 2) + y) % 2 == 1]
+    seq = []
+    for a, b in zip(x_cells, o_cells):
+        seq.append(a)
+        seq.append(b)
+    return seq[:count]
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[k]
+
+def report(title, rows):
+    print(title)
+    for row in rows:
+        print("  " + "  ".join(f"{k}={v}" for k, v in row.items()))
@@ -0,0 +1,41 @@
+# benchmarks/ai.py
+# AI search speed: nodes/sec and time-to-move at fixed depths (no clock) on a few positions,
+# then the depth reached within the bot's per-move budget. The opening book is off throughout.
+#   python -m benchmarks.ai [max_depth]
+import sys
+import time
+from ai import Engine
+from bot import MOVE_TIME
+from benchmarks._util import report
+
+# (name, size, win, stones, side to move)
+POSITIONS = [
+    ('opening', 15, 5, [(7, 7, 'X'), (8, 8, 'O'), (8, 6, 'X')], 'O'),
+    ('midgame', 15, 5, [(7, 7, 'X'), (8, 8, 'O'), (8, 6, 'X'), (6, 8, 'O'), (9, 5, 'X'), (10, 4, 'O'),
+                        (7, 6, 'X'), (7, 8, 'O'), (9, 8, 'X'), (6, 6, 'O'), (8, 7, 'X'), (5, 9, 'O')], 'X'),
+    ('unbounded', 0, 5, [(0, 0, 'X'), (1, 1, 'O'), (1, 0, 'X'), (-1, 0, 'O'), (0, 1, 'X'), (2, 2, 'O')], 'X'),
+]
+
+def main():
+    max_depth = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    rows = []
+    for name, size, win, stones, sym in POSITIONS:
+        for depth in range(2, max_depth + 1, 2):
+            engine = Engine(use_book=False)
+            t0 = time.perf_counter()
+            move = engine.best_move(size, win, stones, sym, time_budget=0, max_depth=depth)
+            elapsed = time.perf_counter() - t0
+            rows.append({'position': name, 'depth': depth, 'move': f"{move[0]},{move[1]}", 'nodes': engine.nodes,
+                         'nodes_per_s': round(engine.nodes / elapsed), 'ms_to_move': round(elapsed * 1000, 1)})
+    report("ai: fixed-depth search from an empty transposition table", rows)
+    rows = []
+    for name, size, win, stones, sym in POSITIONS:
+        engine = Engine(use_book=False)
+        t0 = time.perf_counter()
+        engine.best_move(size, win, stones, sym, time_budget=MOVE_TIME, max_depth=20)
+        rows.append({'position': name, 'budget_s': MOVE_TIME, 'depth_reached': engine.depth_reached,
+                     'nodes': engine.nodes, 'ms_to_move': round((time.perf_counter() - t0) * 1000, 1)})
+    report("ai: iterative deepening under the per-move budget", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/ai_pool.py
+# Concurrent bot-vs-bot games, searching on threads (one GIL) vs in aipool search processes with
+# 1..N processes. Reports AI moves/sec, and how late a 1 ms "connection thread" tick runs while the
+# games are searching (what a human room would feel).
+#   python -m benchmarks.ai_pool [games] [seconds] [depth]
+import os
+import sys
+import threading
+import time
+import aipool
+from ai import Engine
+from board import make_board
+from benchmarks._util import percentile, report
+
+OPENING = [(7, 7, 'X'), (8, 8, 'O')]
+
+def play_games(search, deadline, counter):
+    # one bot-vs-bot game after another on a 15x15 board until the deadline
+    while time.perf_counter() < deadline:
+        board = make_board(15, 5)
+        stones = list(OPENING)
+        for x, y, sym in stones:
+            board.place(x, y, sym)
+        while time.perf_counter() < deadline and len(stones) < 60:
+            sym = 'X' if len(stones) % 2 == 0 else 'O'
+            move = search(stones, sym)
+            if move is None or not board.is_empty(*move):
+                break
+            stones.append((move[0], move[1], sym))
+            counter[0] += 1
+            if board.place(move[0], move[1], sym):
+                break
+
+def ticker(deadline, lateness):
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        time.sleep(0.001)
+        lateness.append((time.perf_counter() - t0 - 0.001) * 1000)
+
+def run(n_games, seconds, depth, processes):
+    pool = aipool.SearchPool(processes) if processes else None
+    counters = [[0] for _ in range(n_games)]
+    lateness = []
+
+    def searcher():
+        if pool:
+            return lambda stones, sym: pool.search(15, 5, stones, sym, 0, depth)
+        engine = Engine()
+        return lambda stones, sym: engine.best_move(15, 5, stones, sym, 0, depth)
+
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=play_games, args=(searcher(), deadline, c)) for c in counters]
+    threads.append(threading.Thread(target=ticker, args=(deadline, lateness)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if pool:
+        pool.close()
+    lateness.sort()
+    moves = sum(c[0] for c in counters)
+    return {'search': f"{processes}_processes" if processes else "threads", 'games': n_games,
+            'ai_moves_per_s': round(moves / seconds, 1),
+            'tick_late_p50_ms': round(percentile(lateness, 50), 2), 'tick_late_p99_ms': round(percentile(lateness, 99), 2)}
+
+def main():
+    n_games = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    depth = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    cores = os.cpu_count() or 1
+    counts = [0]
+    p = 1
+    while p <= cores:
+        counts.append(p)
+        p *= 2
+    if counts[-1] != cores:
+        counts.append(cores)
+    rows = [run(n_games, seconds, depth, processes) for processes in counts]
+    report(f"ai_pool: {n_games} concurrent bot games, depth {depth}, {seconds}s each, {cores} cores", rows)
+
+if __name__ == "__main__":
+    main()
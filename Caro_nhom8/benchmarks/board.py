@@ -0,0 +1,155 @@
+# benchmarks/board.py
+# Bitboard Board vs the original list-of-lists board with a cell-by-cell win walk: moves/sec
+# (place + win check) and bytes of board state per room, over two kinds of 10x10 games:
+# - random: stones anywhere, so most lines through a move are empty and the walk stops at once
+# - clustered: each move next to one of the last few stones, as in real play; runs are longer
+#   there, which makes the walk longer but not the bitboard check
+# Best of three runs, alternating, as the machine's noise is of the order of the difference.
+#   python -m benchmarks.board [games]
+import random
+import sys
+import time
+from board import Board, SparseBoard, make_board
+from benchmarks._util import report
+
+def legacy_new_board():
+    return [['' for _ in range(10)] for __ in range(10)]
+
+def legacy_check_winner(board, x, y, sym):
+    # the original server.check_winner, kept here as the baseline
+    directions = [(1, 0), (0, 1), (1, 1), (1, -1)]
+    for dx, dy in directions:
+        cnt = 1
+        nx, ny = x + dx, y + dy
+        while 0 <= nx < 10 and 0 <= ny < 10 and board[ny][nx] == sym:
+            cnt += 1
+            nx += dx; ny += dy
+        nx, ny = x - dx, y - dy
+        while 0 <= nx < 10 and 0 <= ny < 10 and board[ny][nx] == sym:
+            cnt += 1
+            nx -= dx; ny -= dy
+        if cnt >= 5:
+            return True
+    return False
+
+def random_games(n, seed=1):
+    rng = random.Random(seed)
+    cells = [(x, y) for y in range(10) for x in range(10)]
+    games = []
+    for _ in range(n):
+        rng.shuffle(cells)
+        games.append(list(cells))
+    return games
+
+def clustered_games(n, seed=2):
+    # each move on a free cell around one of the last 6 stones (anywhere free if there is none)
+    rng = random.Random(seed)
+    games = []
+    for _ in range(n):
+        game = [(5, 5)]
+        taken = set(game)
+        while len(game) < 100:
+            x, y = rng.choice(game[-6:])
+            free = [(x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                    if 0 <= x + dx < 10 and 0 <= y + dy < 10 and (x + dx, y + dy) not in taken]
+            if not free:
+                free = [(cx, cy) for cy in range(10) for cx in range(10) if (cx, cy) not in taken]
+            cell = rng.choice(free)
+            taken.add(cell)
+            game.append(cell)
+        games.append(game)
+    return games
+
+def play_legacy(games):
+    moves = 0
+    for game in games:
+        board = legacy_new_board()
+        for i, (x, y) in enumerate(game):
+            sym = 'X' if i % 2 == 0 else 'O'
+            board[y][x] = sym
+            moves += 1
+            if legacy_check_winner(board, x, y, sym):
+                break
+    return moves
+
+def play_bitboard(games):
+    moves = 0
+    for game in games:
+        board = Board()
+        for i, (x, y) in enumerate(game):
+            moves += 1
+            if board.place(x, y, 'X' if i % 2 == 0 else 'O'):
+                break
+    return moves
+
+def board_bytes(board):
+    if isinstance(board, Board):
+        # the Shape table is shared by every board of the same size, so it is not counted
+        return sys.getsizeof(board) + sys.getsizeof(board.x) + sys.getsizeof(board.o)
+    if isinstance(board, SparseBoard):
+        return sys.getsizeof(board) + sys.getsizeof(board.cells) + sum(sys.getsizeof(k) for k in board.cells)
+    return sys.getsizeof(board) + sum(sys.getsizeof(row) for row in board)
+
+def by_size(n_games, stones=60):
+    # random games of `stones` moves on each board kind; an unbounded game is spread over a 2000x2000 area
+    rows = []
+    for size in (10, 15, 19, 99, 0):
+        span = size or 2000
+        rng = random.Random(size)
+        games = []
+        for _ in range(n_games):
+            cells = set()
+            while len(cells) < min(stones, span * span):
+                cells.add((rng.randrange(span) - (0 if size else span // 2), rng.randrange(span) - (0 if size else span // 2)))
+            games.append(list(cells))
+        moves = 0
+        t0 = time.perf_counter()
+        for game in games:
+            board = make_board(size, 5)
+            for i, (x, y) in enumerate(game):
+                moves += 1
+                if board.place(x, y, 'X' if i % 2 == 0 else 'O'):
+                    break
+        elapsed = time.perf_counter() - t0
+        board = make_board(size, 5)
+        for i, (x, y) in enumerate(games[0][:stones]):
+            board.place(x, y, 'X' if i % 2 == 0 else 'O')
+        rows.append({'size': size or 'unbounded', 'board': type(board).__name__, 'ns_per_move': round(elapsed / moves * 1e9),
+                     f'bytes_with_{board.count()}_stones': board_bytes(board)})
+    return rows
+
+def full_board(kind):
+    # a 10x10 board with every cell taken, half X half O
+    board = Board() if kind == "bitboard" else legacy_new_board()
+    for y in range(10):
+        for x in range(10):
+            sym = 'XO'[(x + y) % 2]
+            if isinstance(board, Board):
+                if sym == 'X':
+                    board.x |= 1 << (y * 10 + x)
+                else:
+                    board.o |= 1 << (y * 10 + x)
+            else:
+                board[y][x] = sym
+    return board
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rows = []
+    for workload, games in (("random", random_games(n)), ("clustered", clustered_games(n))):
+        # both implementations must end every game on the same move
+        assert play_legacy(games[:500]) == play_bitboard(games[:500])
+        best = {}
+        for _ in range(3):
+            for name, fn in (("list+walk", play_legacy), ("bitboard", play_bitboard)):
+                t0 = time.perf_counter()
+                moves = fn(games)
+                best[name] = min(best.get(name, float('inf')), (time.perf_counter() - t0) / moves)
+        for name, per_move in best.items():
+            rows.append({'games': workload, 'board': name, 'moves_per_s': round(1 / per_move),
+                         'ns_per_move': round(per_move * 1e9), 'bytes_per_room_full': board_bytes(full_board(name))})
+    report(f"board: {n} 10x10 games of each kind, place + win check per move", rows)
+    report("board sizes: place + win check per move, memory after 60 stones", by_size(max(1, n // 10)))
+
+if __name__ == "__main__":
+    main()
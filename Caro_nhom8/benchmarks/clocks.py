@@ -0,0 +1,110 @@
+# benchmarks/clocks.py
+# Game clocks at scale, in process on simulated time: N rooms playing with a time control (5 min
+# + 2 s, at most 30 s a move), each with its one flag-fall timer in the server's wheel, started
+# over 20 s so that their deadlines spread as much. Per N:
+# - CPU per tick while no clock runs out, against checking every room's clock each tick instead
+# - CPU per tick while players run out of time, mean and worst (bounded by server.TIMERS_PER_TICK),
+#   and per flag fall (the game ends, both players are told)
+# Then the cost of the clock on a move: a move dispatched with and without a time control.
+#   python -m benchmarks.clocks [N ...]
+import sys
+import time
+import logger
+import server
+from timers import TimerWheel
+from benchmarks._util import report
+from benchmarks.instrumentation import dispatch_moves
+from benchmarks.room_contention import fake_conn
+
+SPREAD = 20.0
+
+class SimTime:
+    # stands in for the time module in server.py: monotonic() is whatever the benchmark says
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+def clocked_rooms(n, sim):
+    # n games started evenly over SPREAD seconds, the wheel ticking meanwhile, so their first
+    # deadlines spread over [MOVE_TIME, MOVE_TIME + SPREAD)
+    rooms = []
+    ticks = round(SPREAD / server.TIMER_TICK)
+    for i in range(n):
+        tick_to(sim, i * ticks // n * server.TIMER_TICK)
+        p1, p2 = fake_conn(("bench", i)), fake_conn(("bench", i))
+        server.handle_join_room(p1, {'action': 'CREATE'})
+        server.handle_join_room(p2, {'action': 'JOIN', 'room_id': p1.seat.room.id})
+        rooms.append(p1.seat.room)
+    tick_to(sim, SPREAD)
+    return rooms
+
+def tick_to(sim, t):
+    # advance simulated time to t, one wheel tick at a time; seconds of CPU per tick
+    times = []
+    while sim.now + 1e-6 < t:
+        sim.now = round(sim.now + server.TIMER_TICK, 6)
+        t0 = time.perf_counter()
+        server.run_timers()
+        times.append(time.perf_counter() - t0)
+    return times
+
+def scan(rooms, now):
+    # what one tick costs if every room's clock is looked at instead
+    t0 = time.perf_counter()
+    for room in rooms:
+        with room.lock:
+            clock = room.clock
+            if clock is not None and not room.finished:
+                clock.expired(room.turn.num, now)
+    return time.perf_counter() - t0
+
+def bench(n, sim):
+    sim.now = 0.0
+    server.wheel = TimerWheel(server.TIMER_TICK, 0.0)
+    rooms = clocked_rooms(n, sim)
+    # includes the tick at which the wheel moves the next 25.6 s of deadlines down a level
+    quiet = tick_to(sim, server.MOVE_TIME - server.TIMER_TICK)
+    scan_s = scan(rooms, sim.now)
+    flags = tick_to(sim, server.MOVE_TIME + SPREAD + 1.0)
+    fell = sum(1 for room in rooms if room.result and 'timeout' in room.result)
+    for room in rooms:
+        for slot in room.seats:
+            if slot.conn is not None:
+                server.handle_leave_room(slot.conn, {})
+    return {'rooms': n, 'quiet_tick_us': round(sum(quiet) / len(quiet) * 1e6, 1),
+            'quiet_tick_max_us': round(max(quiet) * 1e6, 1),
+            'scan_tick_us': round(scan_s * 1e6, 1),
+            'flag_tick_us': round(sum(flags) / len(flags) * 1e6, 1), 'flag_tick_max_us': round(max(flags) * 1e6, 1),
+            'flag_us': round(sum(flags) / max(fell, 1) * 1e6, 2), 'flags': fell}
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 50000]
+    logger.configure("warning")
+    server.ROOM_IDLE_TIMEOUT = 0
+    server.CLOCK_BASE, server.CLOCK_INCREMENT, server.MOVE_TIME = 300.0, 2.0, 30.0
+    sim = SimTime()
+    real = server.time
+    server.time = sim
+    try:
+        rows = [bench(n, sim) for n in sizes]
+    finally:
+        server.time = real
+    report(f"clocks: rooms with a running clock, deadlines over {SPREAD:g}s, tick {server.TIMER_TICK}s", rows)
+    server.wheel = TimerWheel(server.TIMER_TICK, time.monotonic())
+    # best of a few, alternating, as the two differ by less than the run-to-run noise
+    with_clock, without = [], []
+    for _ in range(3):
+        server.CLOCK_BASE, server.CLOCK_INCREMENT, server.MOVE_TIME = 300.0, 2.0, 30.0
+        with_clock.append(dispatch_moves(20000))
+        server.CLOCK_BASE = server.CLOCK_INCREMENT = server.MOVE_TIME = 0.0
+        without.append(dispatch_moves(20000))
+    report("clocks: one move dispatched", [{'clock': '300+2, 30 s/move', 'ns_per_move': round(min(with_clock))},
+                                           {'clock': 'none', 'ns_per_move': round(min(without))}])
+
+if __name__ == "__main__":
+    main()
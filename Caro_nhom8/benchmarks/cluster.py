@@ -0,0 +1,110 @@
+# benchmarks/cluster.py
+# Throughput of cluster mode (main.py --workers N) as workers are added: the same pairs load, driven by
+# several loadgen processes at once so the load generator is not the bottleneck, against 1, 2, 4 and 8
+# workers. Reports moves per second, move round trip p99, the workers' CPU per move, and how many
+# connections were handed between workers (pairs join by room code, so about half the joiners land
+# on the wrong worker at first).
+#   python -m benchmarks.cluster [--workers 1,2,4,8] [--mode aserver] [--players 2000] [--seconds 10]
+#       [--drivers N]
+# Scaling needs free cores for the workers and the drivers alike: on a machine with fewer cores than
+# workers + drivers, the extra workers only share the same CPUs and the curve stays flat.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from cluster import RELINK_INTERVAL
+from benchmarks._util import HERE, children, free_port, proc_stats, report, start_server, stop_server
+
+# then until the workers have linked up and exchanged their lobbies
+RELINK_WAIT = RELINK_INTERVAL + 0.5
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.cluster")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--mode", choices=("server", "aserver"), default="aserver")
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--drivers", type=int, default=min(os.cpu_count() or 1, 4),
+                        help="loadgen processes sharing the players")
+    return parser.parse_args(argv)
+
+def handoffs(port, workers):
+    # connections handed in, summed over the workers' metrics endpoints
+    total = 0
+    for i in range(workers):
+        try:
+            body = urllib.request.urlopen(f"http://127.0.0.1:{port + i}/metrics", timeout=2).read().decode()
+        except OSError:
+            continue
+        for line in body.splitlines():
+            if line.startswith('caro_handoffs_total{result="in"}'):
+                total += int(float(line.split()[1]))
+    return total
+
+def wait_ready(metrics_port, workers, timeout=10.0):
+    # every worker answering on its metrics port (a worker that failed to start is restarted later)
+    deadline = time.time() + timeout
+    for i in range(workers):
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{metrics_port + i}/metrics", timeout=1).read()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError(f"worker {i} did not start")
+                time.sleep(0.1)
+    time.sleep(RELINK_WAIT)
+
+def drive(args, port):
+    # run the drivers side by side; their --json results
+    players = args.players // args.drivers // 2 * 2
+    with tempfile.TemporaryDirectory() as tmp:
+        procs = []
+        for i in range(args.drivers):
+            out = os.path.join(tmp, f"driver-{i}.json")
+            procs.append((out, subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.loadgen", "--port", str(port), "--players", str(players),
+                 "--seconds", str(args.seconds), "--match", "pairs", "--json", out],
+                cwd=HERE, stdout=subprocess.DEVNULL)))
+        runs = []
+        for out, proc in procs:
+            proc.wait()
+            with open(out, encoding="utf-8") as f:
+                runs.append(json.load(f)['runs'][0])
+    return runs
+
+def measure(args, workers):
+    port = free_port()
+    metrics_port = free_port() + 100
+    proc = start_server(args.mode, port, ["--workers", str(workers), "--metrics", str(metrics_port),
+                                          "--log-level", "warning"])
+    try:
+        wait_ready(metrics_port, workers)
+        pids = children(proc.pid) or [proc.pid]   # --workers 1 is a single server process
+        cpu0 = sum(proc_stats(pid)['cpu_s'] or 0 for pid in pids)
+        runs = drive(args, port)
+        cpu = sum(proc_stats(pid)['cpu_s'] or 0 for pid in pids) - cpu0
+        moved = handoffs(metrics_port, workers)
+    finally:
+        stop_server(proc)
+    moves = sum(r['moves'] for r in runs)
+    return {'workers': workers, 'players': sum(r['players'] for r in runs), 'games': sum(r['games'] for r in runs),
+            'errors': sum(r['errors'] for r in runs), 'moves_per_s': sum(r['moves_per_s'] for r in runs),
+            'rtt_p99_ms': max(r['rtt_p99_ms'] for r in runs),
+            'cpu_us_per_move': round(cpu / moves * 1e6, 1) if moves else None, 'handoffs': moved}
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    rows = [measure(args, int(n)) for n in args.workers.split(",")]
+    base = rows[0]['moves_per_s'] or 1
+    for row in rows:
+        row['speedup'] = round(row['moves_per_s'] / base, 2)
+    report(f"cluster: {args.mode}, {args.players} players in pairs, {args.drivers} drivers, {args.seconds:g}s, "
+           f"{os.cpu_count()} CPUs", rows)
+
+if __name__ == "__main__":
+    main()
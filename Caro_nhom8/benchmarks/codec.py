@@ -0,0 +1,42 @@
+# benchmarks/codec.py
+# JSON vs binary frames: bytes on the wire and encode/decode ns per message.
+#   python -m benchmarks.codec [iterations]
+import sys
+import time
+from common import Code
+from codec import PROTOCOL_BINARY, PROTOCOL_JSON, decode_frame, encode_frame
+from benchmarks._util import report
+
+SAMPLES = {
+    'move request': {'code': Code.MATCH_MOVE, 'payload': {'x': 4, 'y': 7}},
+    'move event': {'code': Code.MATCH_MOVE, 'payload': {'x': 4, 'y': 7, 'symbol': 'X', 'by': 'Player 1', 'winner': False}},
+    'match start': {'code': Code.MATCH_START, 'payload': {'you': 'Player 2', 'opponent': 'Player 1', 'symbol': 'O',
+                                                          'room_id': '3f9a1c', 'first_turn': 'Player 1', 'size': 15, 'win': 5}},
+    'chat': {'code': Code.MESSAGE_CODE, 'payload': {'from': 'Player 1', 'text': 'gg wp'}},
+}
+
+def timed(fn, arg, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn(arg)
+    return (time.perf_counter() - t0) / n * 1e9
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rows = []
+    for name, msg in SAMPLES.items():
+        for proto, label in ((PROTOCOL_JSON, 'json'), (PROTOCOL_BINARY, 'binary')):
+            frame = encode_frame(msg, proto)
+            body = frame[4:]
+            assert decode_frame(body) == msg
+            rows.append({
+                'message': name.replace(' ', '_'),
+                'protocol': label,
+                'bytes': len(frame),
+                'encode_ns': round(timed(lambda m: encode_frame(m, proto), msg, n)),
+                'decode_ns': round(timed(decode_frame, body, n)),
+            })
+    report(f"codec: {n} iterations per message (frame bytes include the 4-byte length prefix)", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# benchmarks/frame_reader.py
+# Small-frame receive throughput: recv_msg (two recv calls per message) vs FrameReader
+# (one recv_into per kernel batch), plus the old `data += chunk` loop on one large frame.
+#   python -m benchmarks.frame_reader [frames]
+import socket
+import sys
+import threading
+import time
+from common import Code, FrameReader, pack_msg, recv_msg, recvn
+from benchmarks._util import report
+
+def legacy_recvn(sock, n):
+    # the original common.recvn, kept here as the baseline
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def feed(sock, blob, chunk):
+    for i in range(0, len(blob), chunk):
+        sock.sendall(blob[i:i + chunk])
+    sock.close()
+
+def small_frames(n):
+    frame = pack_msg({'code': Code.MATCH_MOVE, 'payload': {'x': 3, 'y': 4}})
+    blob = frame * n
+    rows = []
+    for name in ("recv_msg", "FrameReader.messages", "FrameReader.frames"):
+        a, b = socket.socketpair()
+        writer = threading.Thread(target=feed, args=(a, blob, 256 * 1024))
+        writer.start()
+        t0 = time.perf_counter()
+        count = 0
+        if name == "recv_msg":
+            while recv_msg(b) is not None:
+                count += 1
+        elif name == "FrameReader.messages":
+            for _ in FrameReader(b).messages():
+                count += 1
+        else:
+            for _ in FrameReader(b).frames():
+                count += 1
+        elapsed = time.perf_counter() - t0
+        writer.join()
+        b.close()
+        assert count == n, (name, count)
+        rows.append({'reader': name, 'frame_bytes': len(frame), 'frames_per_s': round(n / elapsed),
+                     'ns_per_frame': round(elapsed / n * 1e9)})
+    return rows
+
+def large_frame(size, chunk):
+    rows = []
+    for name, fn in (("legacy bytes +=", legacy_recvn), ("recvn recv_into", recvn)):
+        a, b = socket.socketpair()
+        writer = threading.Thread(target=feed, args=(a, b'x' * size, chunk))
+        writer.start()
+        t0 = time.perf_counter()
+        data = fn(b, size)
+        elapsed = time.perf_counter() - t0
+        writer.join()
+        b.close()
+        assert len(data) == size
+        rows.append({'reader': name, 'frame_bytes': size, 'sender_chunk': chunk, 'ms': round(elapsed * 1000, 2)})
+    return rows
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    report(f"small frames: {n} MATCH_MOVE-sized frames over a socketpair", small_frames(n))
+    report("one large frame sent in small chunks", large_frame(1024 * 1024, 512))
+
+if __name__ == "__main__":
+    main()
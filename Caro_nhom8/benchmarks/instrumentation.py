@@ -0,0 +1,87 @@
+# benchmarks/instrumentation.py
+# What the metrics and the logger cost on the hot path, per call: a counter and a histogram update,
+# a TimedLock against a plain lock, and a log call that is filtered out (next to an empty call, the
+# floor), queued, written by the writer thread, or (as before the logger) a print to a stream. Then
+# the whole dispatch of a move, with everything it records.
+#   python -m benchmarks.instrumentation [calls]
+import io
+import sys
+import threading
+import time
+import logger
+import metrics
+import server
+from benchmarks._util import non_winning_moves, report
+from benchmarks.room_contention import fake_conn
+
+def per_call(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e9
+
+def noop(event, **fields):
+    pass
+
+def written(n):
+    # ns per queued line formatted and written by a flush, the writer thread's share
+    for i in range(n):
+        logger.info("move", room="ab12cd", by=("127.0.0.1", 5000), n=i)
+    t0 = time.perf_counter()
+    logger.flush()
+    return (time.perf_counter() - t0) / n * 1e9
+
+def locked(lock):
+    def fn():
+        with lock:
+            pass
+    return fn
+
+def dispatch_moves(n):
+    # ns per MATCH_MOVE dispatched through server.dispatch, two players on a large board
+    p1, p2 = fake_conn(("bench", 1)), fake_conn(("bench", 2))
+    server.handle_join_room(p1, {'action': 'CREATE', 'size': 0})
+    server.handle_join_room(p2, {'action': 'JOIN', 'room_id': p1.seat.room.id})
+    moves = [(x * 3, y * 3) for x, y in non_winning_moves(count=40)]
+    t0 = time.perf_counter()
+    done = 0
+    while done < n:
+        for k, (x, y) in enumerate(moves):
+            server.dispatch((p1, p2)[k % 2], {'code': 'MATCH_MOVE', 'payload': {'x': x + done, 'y': y}})
+        done += len(moves)
+        server.handle_restart_request(p1, {'agree': True})
+        server.handle_restart_request(p2, {'agree': True})
+    elapsed = time.perf_counter() - t0
+    server.handle_leave_room(p1, {})
+    server.handle_leave_room(p2, {})
+    return elapsed / done * 1e9
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    counter = metrics.Counter("bench_total", "bench")
+    hist = metrics.Histogram()
+    plain = threading.Lock()
+    timed = metrics.TimedLock(metrics.Histogram())
+    sink = io.StringIO()
+    logger.configure(out=sink)
+    rows = [
+        {'op': 'counter inc', 'ns': round(per_call(counter.inc, n))},
+        {'op': 'counter inc (labelled)', 'ns': round(per_call(lambda: counter.inc_label('MATCH_MOVE'), n))},
+        {'op': 'histogram observe', 'ns': round(per_call(lambda: hist.observe(0.00004), n))},
+        {'op': 'with threading.Lock', 'ns': round(per_call(locked(plain), n))},
+        {'op': 'with TimedLock (uncontended)', 'ns': round(per_call(locked(timed), n))},
+    ]
+    logger.configure("warning")
+    rows.append({'op': 'logger.info, filtered out', 'ns': round(per_call(lambda: logger.info("move", room="ab12cd"), n))})
+    rows.append({'op': 'empty call, same arguments', 'ns': round(per_call(lambda: noop("move", room="ab12cd"), n))})
+    logger.configure("info")
+    rows.append({'op': 'logger.info, queued', 'ns': round(per_call(lambda: logger.info("move", room="ab12cd"), n))})
+    logger.flush()
+    rows.append({'op': 'log line written (writer thread)', 'ns': round(written(n // 10))})
+    rows.append({'op': 'print to a stream (before)', 'ns': round(per_call(lambda: print("move in room ab12cd", file=sink), n))})
+    logger.configure("warning")
+    rows.append({'op': 'dispatch one move, all metrics', 'ns': round(dispatch_moves(n // 10))})
+    report(f"instrumentation: ns per call, {n} calls", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/journal.py
+# Cost of the match journal: moves/sec and move latency over real sockets with no journal, with the
+# default group commit, and with a commit (write + fsync) as soon as anything is appended; then how
+# long recovery takes for a journal full of rooms.
+#   python -m benchmarks.journal [pairs] [seconds] [rooms]
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+import journal
+import logger
+import server
+from benchmarks._util import free_port, start_server, stop_server, proc_stats, non_winning_moves, percentile, report
+from benchmarks.room_contention import fake_conn
+from benchmarks.server_modes import make_pair, play_pair
+
+async def run(mode, pairs, seconds, flush_ms):
+    port = free_port()
+    directory = tempfile.mkdtemp() if flush_ms is not None else None
+    extra = ("--journal", directory, "--flush-ms", str(flush_ms)) if directory else ()
+    proc = start_server(mode, port, extra)
+    try:
+        players = await asyncio.gather(*[make_pair(port) for _ in range(pairs)])
+        latencies = []
+        cpu0 = proc_stats(proc.pid)['cpu_s'] or 0.0
+        start = time.perf_counter()
+        counts = await asyncio.gather(*[play_pair(p1, p2, start + seconds, latencies) for p1, p2 in players])
+        elapsed = time.perf_counter() - start
+        cpu1 = proc_stats(proc.pid)['cpu_s'] or 0.0
+        for p1, p2 in players:
+            p1[1].close()
+            p2[1].close()
+    finally:
+        stop_server(proc)
+    total = sum(counts)
+    journal_bytes = 0
+    if directory:
+        journal_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        shutil.rmtree(directory)
+    latencies.sort()
+    return {'mode': mode, 'journal': 'off' if flush_ms is None else f"flush {flush_ms} ms",
+            'moves_per_s': round(total / elapsed), 'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'server_cpu_us_per_move': round((cpu1 - cpu0) / total * 1e6, 1) if total else None,
+            'journal_bytes_per_move': round(journal_bytes / total, 1) if total else None}
+
+def recovery(n_rooms):
+    # a journal of n_rooms mid-game rooms, replayed and rebuilt the way start_journal does it
+    directory = tempfile.mkdtemp()
+    server.start_journal(directory)
+    moves = non_winning_moves()
+    for i in range(n_rooms):
+        p1, p2 = fake_conn(("bench", i)), fake_conn(("bench", i))
+        server.handle_join_room(p1, {'action': 'CREATE'})
+        server.handle_join_room(p2, {'action': 'JOIN', 'room_id': p1.seat.room.id})
+        for k, (x, y) in enumerate(moves[:20]):
+            server.handle_move((p1, p2)[k % 2], {'x': x, 'y': y})
+    server.journal.close()
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    t0 = time.perf_counter()
+    logs, _ = journal.replay(directory)
+    replay_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    restored = [server.restore_room(room_id, log) for room_id, log in logs.items()]
+    restore_s = time.perf_counter() - t0
+    shutil.rmtree(directory)
+    return {'rooms': len(restored), 'journal_kb': round(size / 1024), 'replay_ms': round(replay_s * 1000, 1),
+            'rebuild_ms': round(restore_s * 1000, 1)}
+
+def main():
+    pairs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    n_rooms = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    logger.configure("warning")
+    rows = [asyncio.run(run(mode, pairs, seconds, flush_ms))
+            for mode in ("server", "aserver") for flush_ms in (None, journal.FLUSH_INTERVAL * 1000, 0)]
+    report(f"journal: {pairs} concurrent matches for {seconds}s", rows)
+    report("journal: recovery, rooms 20 moves into a game", [recovery(n_rooms)])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# benchmarks/loadgen.py
+# End-to-end load test: thousands of simulated players (headless.AsyncClient) in this one process,
+# playing through a real server: connect, get into a match (create/join by room code, or QUICK_MATCH),
+# play moves with a little chat, leave, and again, until time is up.
+# Reports connection setup rate, move round trip (send -> own MATCH_MOVE echo) p50/p99/p999, and the
+# server's CPU per move; --json writes the results with the commit they were measured on, and
+# --compare prints the change against an earlier --json file.
+#   python -m benchmarks.loadgen [--players 2000] [--seconds 10] [--modes server,aserver]
+#       [--match pairs|quick] [--moves 40] [--think-ms 0] [--chat-every 10] [--binary]
+#       [--port P [--host H] [--pid PID]]   (an already running server instead of starting one)
+#       [--json FILE] [--compare FILE]
+# This machine runs the players and the server side by side, so on few cores the numbers include the
+# load generator's own CPU; compare runs made on the same machine.
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from collections import Counter
+from common import Code
+from headless import AsyncClient, ServerError
+from benchmarks._util import (HERE, free_port, start_server, stop_server, proc_stats,
+                              non_winning_moves, percentile, report)
+
+CONNECT_BATCH = 500   # connections opened concurrently
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadgen")
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--modes", default="server,aserver")
+    parser.add_argument("--match", choices=("pairs", "quick"), default="pairs")
+    parser.add_argument("--moves", type=int, default=40, help="moves per game (nobody wins within 40)")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pause before each move")
+    parser.add_argument("--chat-every", type=int, default=10, help="chat after every Nth own move; 0 = never")
+    parser.add_argument("--binary", action="store_true", help="negotiate the binary protocol")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="load an already running server")
+    parser.add_argument("--pid", type=int, help="its process id, for CPU per move")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="earlier --json results to compare with")
+    args = parser.parse_args(argv)
+    args.moves = min(args.moves, 40)
+    return args
+
+def new_stats():
+    return {'latencies': [], 'moves': 0, 'games': 0, 'aborted': 0, 'chats': 0, 'errors': 0,
+            'refused': Counter()}
+
+async def connect_all(args, port):
+    clients, failed = [], 0
+    t0 = time.perf_counter()
+    for i in range(0, args.players, CONNECT_BATCH):
+        batch = [AsyncClient().connect(args.host, port, args.binary)
+                 for _ in range(min(CONNECT_BATCH, args.players - i))]
+        for result in await asyncio.gather(*batch, return_exceptions=True):
+            if isinstance(result, Exception):
+                failed += 1
+            else:
+                clients.append(result)
+    return clients, failed, time.perf_counter() - t0
+
+async def get_match(client, index, args, rooms, deadline):
+    # MATCH_START payload of our next game, or None when time is up
+    if args.match == "quick":
+        if time.perf_counter() >= deadline:
+            return None
+        await client.quick_match()
+    elif index % 2 == 0:
+        # the creator hands the room code to its partner, as players would over chat
+        room_id = (await client.create_room())['room_id'] if time.perf_counter() < deadline else None
+        await rooms[index // 2].put(room_id)
+        if room_id is None:
+            return None
+    else:
+        room_id = await rooms[index // 2].get()
+        if room_id is None:
+            return None
+        await client.join_room(room_id)
+    timeout = max(deadline - time.perf_counter(), 0) + client.timeout
+    try:
+        return await client.expect(Code.MATCH_START, timeout=timeout)
+    except asyncio.TimeoutError:
+        # quick match with nobody left to pair with
+        await client.leave()
+        return None
+
+async def play(client, start, args, stats, moves):
+    # one game; False if the opponent left before it was over
+    me = start['you']
+    turn = start['first_turn']
+    mine = lambda p: p.get('by') == me
+    theirs = lambda p: p.get('by') != me
+    own = 0
+    for x, y in moves:
+        if turn == me:
+            if args.think_ms:
+                await asyncio.sleep(args.think_ms / 1000)
+            t0 = time.perf_counter()
+            await client.send(Code.MATCH_MOVE, {'x': x, 'y': y})
+            code, _ = await client.expect_first({Code.MATCH_MOVE: mine, Code.ROOM_LEAVE: None, Code.ERROR: None})
+            if code != Code.MATCH_MOVE:
+                return False
+            stats['latencies'].append(time.perf_counter() - t0)
+            stats['moves'] += 1
+            own += 1
+            if args.chat_every and own % args.chat_every == 0:
+                await client.chat("gg")
+                stats['chats'] += 1
+        else:
+            code, _ = await client.expect_first({Code.MATCH_MOVE: theirs, Code.ROOM_LEAVE: None})
+            if code != Code.MATCH_MOVE:
+                return False
+        turn = start['opponent'] if turn == me else me
+    return True
+
+async def player(client, index, args, stats, rooms, deadline):
+    moves = non_winning_moves(count=args.moves)
+    try:
+        while True:
+            start = await get_match(client, index, args, rooms, deadline)
+            if start is None:
+                return
+            finished = await play(client, start, args, stats, moves)
+            await client.leave()
+            # everything from the old room arrived before ROOM_LEAVE_SUCCESS
+            client.inbox.clear()
+            if start['you'] == start['first_turn']:
+                # counted once per game, by its first mover
+                stats['games' if finished else 'aborted'] += 1
+    except ServerError as e:
+        # the server turned a request down: counted by its reason
+        stats['refused'][str(e.payload)] += 1
+    except (asyncio.TimeoutError, ConnectionError):
+        stats['errors'] += 1
+    finally:
+        if args.match == "pairs" and index % 2 == 0:
+            # don't leave the partner waiting for a room code that will never come
+            rooms[index // 2].put_nowait(None)
+
+async def run(args, mode, port, pid):
+    stats = new_stats()
+    clients, failed, connect_s = await connect_all(args, port)
+    if args.match == "pairs" and len(clients) % 2:
+        await clients.pop().close()
+    rooms = [asyncio.Queue() for _ in range(len(clients) // 2 + 1)]
+    cpu0 = proc_stats(pid)['cpu_s'] if pid else None
+    t0 = time.perf_counter()
+    deadline = t0 + args.seconds
+    await asyncio.gather(*[player(c, i, args, stats, rooms, deadline) for i, c in enumerate(clients)])
+    elapsed = time.perf_counter() - t0
+    server = proc_stats(pid) if pid else {}
+    bytes_io = sum(c.bytes_in + c.bytes_out for c in clients)
+    await asyncio.gather(*[c.close() for c in clients])
+    latencies = sorted(stats['latencies'])
+    moves = stats['moves']
+    ms = lambda p: round(percentile(latencies, p) * 1000, 3)
+    return {
+        'mode': mode, 'players': len(clients), 'connect_failed': failed,
+        'connects_per_s': round(len(clients) / connect_s) if connect_s else None,
+        'games': stats['games'], 'aborted': stats['aborted'], 'errors': stats['errors'],
+        'refused': sum(stats['refused'].values()), 'chats': stats['chats'],
+        'moves': moves, 'moves_per_s': round(moves / elapsed),
+        'rtt_p50_ms': ms(50), 'rtt_p99_ms': ms(99), 'rtt_p999_ms': ms(99.9),
+        'server_cpu_us_per_move': round((server['cpu_s'] - cpu0) / moves * 1e6, 1)
+        if pid and moves and cpu0 is not None else None,
+        'server_rss_mb': round(server['rss_kb'] / 1024, 1) if server.get('rss_kb') else None,
+        'client_bytes_per_move': round(bytes_io / moves) if moves else None,
+        **({'refused_for': "; ".join(f"{reason} x{n}" for reason, n in stats['refused'].most_common())}
+           if stats['refused'] else {}),
+    }
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare(rows, path):
+    # per mode, the change of every numeric result against an earlier run
+    with open(path, encoding="utf-8") as f:
+        old = json.load(f)
+    before = {row['mode']: row for row in old['runs']}
+    print(f"compared with {path} (commit {old.get('commit')})")
+    for row in rows:
+        prev = before.get(row['mode'])
+        if not prev:
+            continue
+        changes = []
+        for key, value in row.items():
+            was = prev.get(key)
+            if isinstance(value, (int, float)) and isinstance(was, (int, float)) and was:
+                changes.append(f"{key}={value} ({(value - was) / was * 100:+.1f}%)")
+        print("  " + row['mode'] + ": " + "  ".join(changes))
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    rows = []
+    if args.port:
+        rows.append(asyncio.run(run(args, "external", args.port, args.pid)))
+    else:
+        for mode in args.modes.split(","):
+            port = free_port()
+            proc = start_server(mode, port)
+            try:
+                rows.append(asyncio.run(run(args, mode, port, proc.pid)))
+            finally:
+                stop_server(proc)
+    report(f"loadgen: {args.players} players, {args.match}, {args.moves} moves/game, {args.seconds:g}s", rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'commit': commit(), 'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       'args': vars(args), 'runs': rows}, f, indent=1)
+    if args.compare:
+        compare(rows, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# benchmarks/lobby.py
+# Room listing and matchmaking against the waiting-room index, with many rooms open: the old full
+# scan of `rooms` vs one indexed page, and QUICK_MATCH pairing time, calling the handlers directly.
+# Then lobby traffic for many subscribers: every user polling the full list once per tick vs one
+# coalesced LOBBY_UPDATE push per tick.
+#   python -m benchmarks.lobby [rooms] [subscribers]
+import sys
+import time
+import logger
+import server
+from codec import PROTOCOL_JSON, encode_frame
+from common import Code
+from benchmarks._util import report
+from benchmarks.room_contention import fake_conn
+
+def legacy_list():
+    # the original send_room_list body: every room checked under ROOMS_LOCK
+    with server.ROOMS_LOCK:
+        return [{'room_id': rid, **r.rules} for rid, r in server.rooms.items() if len(r.seated()) == 1]
+
+def timed_us(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+def push_vs_poll(n_subs, changes_per_tick, ticks=20):
+    subs = [fake_conn(("sub", k)) for k in range(n_subs)]
+    for conn in subs:
+        server.handle_lobby_subscribe(conn, {})
+    server.flush_lobby()   # snapshots
+    for conn in subs:
+        conn.sock.sent = 0
+    flush_s = 0.0
+    poll_bytes = 0
+    i = 0
+    for _ in range(ticks):
+        # a few rooms open and a few fill during the tick
+        for _ in range(changes_per_tick):
+            server.handle_join_room(fake_conn(("bench", i)), {'action': 'CREATE'})
+            i += 1
+        for _ in range(changes_per_tick // 2):
+            server.handle_quick_match(fake_conn(("bench", i)), {})
+            i += 1
+        t0 = time.perf_counter()
+        server.flush_lobby()
+        flush_s += time.perf_counter() - t0
+        # the original protocol: the whole waiting list in one ROOM_LIST per user per poll
+        poll_bytes += len(encode_frame({'code': Code.ROOM_LIST, 'payload': legacy_list()}, PROTOCOL_JSON)) * n_subs
+    push_bytes = sum(conn.sock.sent for conn in subs)
+    for conn in subs:
+        server.unsubscribe_lobby(conn)
+    return {'subscribers': n_subs, 'waiting_rooms': len(server.waiting), 'changes_per_tick': changes_per_tick + changes_per_tick // 2,
+            'poll_kb_per_tick': round(poll_bytes / ticks / 1024), 'push_kb_per_tick': round(push_bytes / ticks / 1024, 1),
+            'push_ms_per_tick': round(flush_s / ticks * 1000, 2)}
+
+def main():
+    n_rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    n_subs = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    logger.configure("warning")   # the handlers log every room
+    for i in range(n_rooms):
+        server.handle_join_room(fake_conn(("bench", i)), {'action': 'CREATE', 'size': 15 if i % 2 else 10})
+    # half the rooms are full, so a scan has to skip them
+    for i, room_id in enumerate(list(server.rooms)):
+        if i % 2 == 0:
+            server.join_room(fake_conn(("bench", i)), room_id)
+    reader = fake_conn(("bench", "reader"))
+    rows = [
+        {'list': 'full_scan', 'us_per_request': round(timed_us(legacy_list, 20), 1)},
+        {'list': 'indexed_page', 'us_per_request': round(timed_us(lambda: server.send_room_list(reader, {}), 2000), 1)},
+        {'list': 'indexed_page_deep_cursor',
+         'us_per_request': round(timed_us(lambda: server.send_room_list(reader, {'cursor': n_rooms}), 2000), 1)},
+    ]
+    n_matches = min(5000, len(server.waiting) // 2)
+    t0 = time.perf_counter()
+    for i in range(n_matches):
+        server.handle_quick_match(fake_conn(("bench", i)), {})
+    quick_us = (time.perf_counter() - t0) / n_matches * 1e6
+    # start from a small lobby, as a polling client would download all of it every tick
+    for room in list(server.rooms.values()):
+        with room.lock:
+            server.close_room(room)
+    server.flush_lobby()
+    for i in range(200):
+        server.handle_join_room(fake_conn(("bench", i)), {'action': 'CREATE'})
+    push_rows = [push_vs_poll(n_subs, changes) for changes in (2, 20)]
+    report(f"lobby: {n_rooms} rooms, half waiting", rows)
+    report("lobby: QUICK_MATCH into the oldest waiting room", [{'matches': n_matches, 'us_per_match': round(quick_us, 1)}])
+    report(f"lobby: polling the full list vs coalesced pushes, per {server.LOBBY_TICK}s tick", push_rows)
+
+if __name__ == "__main__":
+    main()
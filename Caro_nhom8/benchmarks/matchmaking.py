@@ -0,0 +1,163 @@
+# benchmarks/matchmaking.py
+# Rated matchmaking, in process on simulated time:
+# - the queue (matchmaking.py) with N players waiting, ratings spread like a real population and
+#   not yet paired (a burst of arrivals): time to queue a player, take one off, and pair a new
+#   arrival, against a plain list scanned for the nearest acceptable rating; then the sweeps that
+#   pair the burst off, per pair and per sweep (at most server.MATCH_SWEEP pairs)
+# - a simulated population: `players` with a hidden true strength arrive at random, queue, play
+#   (the stronger player wins as often as the Elo formula says), and come back later; ratings move
+#   with ratings.rate. Reports the waits, how far apart the paired players really were (against
+#   pairing in arrival order, as QUICK_MATCH does), and how close the ratings got to the true
+#   strengths
+#   python -m benchmarks.matchmaking [N ...]
+import random
+import sys
+import time
+import ratings
+import server
+from matchmaking import MatchQueue
+from benchmarks._util import percentile, report
+
+def new_queue():
+    return MatchQueue(server.MATCH_WINDOW, server.MATCH_WIDEN, server.MATCH_MAX_WINDOW)
+
+def population(n, rng):
+    return [min(max(rng.gauss(1500, 300), 100), 2900) for _ in range(n)]
+
+def linear_match(waiting, queue, rating, now):
+    # what a queue without an index does: look at everyone
+    best, best_diff = None, queue.window_base
+    for i, (other, since) in enumerate(waiting):
+        diff = abs(other - rating)
+        if diff <= best_diff and diff <= min(queue.window_base + queue.widen * (now - since), queue.max_window):
+            best, best_diff = i, diff
+    return best
+
+def queue_ops(n, rng, calls=2000):
+    # n players queued over the last 30 s, so their windows differ
+    queue = new_queue()
+    now = 30.0
+    ratings_ = population(n, rng)
+    for i, r in enumerate(ratings_):
+        queue.add(i, r, now * i / n)
+    arrivals = population(calls, rng)
+    t0 = time.perf_counter()
+    for k, r in enumerate(arrivals):
+        queue.add(('new', k), r, now)
+    add_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for k in range(calls):
+        queue.discard(('new', k))
+    discard_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    matched = 0
+    for k, r in enumerate(arrivals):
+        queue.add(('new', k), r, now)
+        matched += queue.match(('new', k), now) is not None
+    match_s = time.perf_counter() - t0
+    waiting = [(r, now * i / n) for i, r in enumerate(ratings_)]
+    t0 = time.perf_counter()
+    for r in arrivals[:200]:
+        linear_match(waiting, queue, r, now)
+    linear_s = (time.perf_counter() - t0) / 200
+    buckets = len(queue.buckets)
+    sweeps = []
+    swept = 0
+    while True:
+        t0 = time.perf_counter()
+        pairs = queue.sweep(now, server.MATCH_SWEEP)
+        sweeps.append(time.perf_counter() - t0)
+        swept += len(pairs)
+        if not pairs:
+            break
+    return {'queued': n, 'add_us': round(add_s / calls * 1e6, 2), 'remove_us': round(discard_s / calls * 1e6, 2),
+            'pair_us': round(match_s / calls * 1e6, 2), 'paired': f"{matched}/{calls}",
+            'linear_pair_us': round(linear_s * 1e6, 1), 'buckets': buckets,
+            'sweep_pairs': swept, 'sweep_us_per_pair': round(sum(sweeps) / max(swept, 1) * 1e6, 2),
+            'sweep_max_ms': round(max(sweeps) * 1000, 2), 'left_queued': len(queue)}
+
+class Sim:
+    # `n` players with true strengths; each comes back to the queue `rest` seconds (on average) after
+    # a game of `game` seconds
+    def __init__(self, n, rng, game=120.0, rest=600.0):
+        self.rng = rng
+        self.game = game
+        self.rest = rest
+        self.skill = population(n, rng)
+        self.players = [ratings.Player(str(i), '') for i in range(n)]
+        self.returns = {}        # second -> players coming back to the queue then
+
+    def arrive(self, second, i):
+        self.returns.setdefault(second, []).append(i)
+
+    def play(self, a, b, now):
+        # one game between players a and b, won as the Elo formula says for their true strengths
+        e = 1 / (1 + 10 ** ((self.skill[b] - self.skill[a]) / 400))
+        roll = self.rng.random()
+        score = 0.5 if abs(roll - e) < 0.02 else 1.0 if roll < e else 0.0
+        ratings.rate(self.players[a], self.players[b], score, now)
+        for i in (a, b):
+            self.arrive(int(now + self.game + self.rng.expovariate(1 / self.rest)) + 1, i)
+
+    def error(self):
+        # mean |rating - true strength|, after shifting the ratings to the same mean
+        shift = sum(self.skill) / len(self.skill) - sum(p.rating for p in self.players) / len(self.players)
+        return sum(abs(p.rating + shift - s) for p, s in zip(self.players, self.skill)) / len(self.players)
+
+def simulate(n, seconds, rng, rated=True):
+    sim = Sim(n, rng)
+    queue = new_queue()
+    fifo = []
+    for i in range(n):
+        # everyone shows up once within the first 10 minutes
+        sim.arrive(int(rng.uniform(0, 600)), i)
+    waits, gaps, late, sizes = [], [], [], []
+    cpu = 0.0
+    since = {}
+    for second in range(seconds):
+        now = float(second)
+        t0 = time.perf_counter()
+        pairs = []
+        for i in sim.returns.pop(second, ()):
+            since[i] = now
+            if rated:
+                queue.add(i, sim.players[i].rating, now)
+                other = queue.match(i, now)
+                if other is not None:
+                    pairs.append((other, i))
+            elif fifo:
+                pairs.append((fifo.pop(0), i))
+            else:
+                fifo.append(i)
+        if rated and second % int(server.MATCH_INTERVAL) == 0:
+            pairs.extend(queue.sweep(now, server.MATCH_SWEEP))
+        cpu += time.perf_counter() - t0
+        for a, b in pairs:
+            waits.append(now - since[a])
+            gaps.append(abs(sim.skill[a] - sim.skill[b]))
+            if second >= seconds - 3600:
+                late.append(gaps[-1])
+            sim.play(a, b, now)
+        sizes.append(len(queue) if rated else len(fifo))
+    waits.sort()
+    gaps.sort()
+    late.sort()
+    sizes.sort()
+    return {'pairing': 'rating' if rated else 'arrival', 'players': n, 'games': len(gaps),
+            'queued_p50': percentile(sizes, 50), 'wait_p50_s': percentile(waits, 50),
+            'wait_p95_s': percentile(waits, 95), 'strength_gap_p50': round(percentile(gaps, 50)),
+            'strength_gap_p95': round(percentile(gaps, 95)), 'last_hour_gap_p50': round(percentile(late, 50)),
+            'rating_error': round(sim.error(), 1),
+            'cpu_us_per_s': round(cpu / seconds * 1e6, 1)}
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 50000]
+    rng = random.Random(1)
+    report("matchmaking: queue operations with N players waiting (ratings ~ N(1500, 300))",
+           [queue_ops(n, rng) for n in sizes])
+    seconds = 3 * 3600
+    report(f"matchmaking: simulated population over {seconds // 3600} h (2 min games, ~10 min between)",
+           [simulate(n, seconds, random.Random(2), rated) for n in (2000, 20000) for rated in (True, False)])
+
+if __name__ == "__main__":
+    main()
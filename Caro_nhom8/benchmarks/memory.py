@@ -0,0 +1,45 @@
+# benchmarks/memory.py
+# What an idle room costs the server: N rooms created through the normal CREATE path, each with its
+# one waiting player, then the Python heap (tracemalloc) and resident memory per room and the time
+# to create one. The room-inactivity timer is left out (benchmarks.timers has the wheel's cost).
+# Then a move dispatched in one of the rooms, the per-move lookup cost.
+#   python -m benchmarks.memory [rooms]
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import logger
+import server
+from benchmarks._util import proc_stats, report
+from benchmarks.instrumentation import dispatch_moves
+from benchmarks.room_contention import FakeSock
+
+def idle_rooms(n):
+    server.ROOM_IDLE_TIMEOUT = 0
+    socks = [FakeSock() for _ in range(n)]
+    gc.collect()
+    rss0 = proc_stats(os.getpid())['rss_kb']
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for i, sock in enumerate(socks):
+        server.handle_join_room(server.Connection(sock, ("bench", i)), {'action': 'CREATE'})
+    create_s = time.perf_counter() - t0
+    gc.collect()
+    heap, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss = proc_stats(os.getpid())['rss_kb']
+    return {'rooms': len(server.rooms), 'heap_bytes_per_room': heap // n,
+            'rss_bytes_per_room': (rss - rss0) * 1024 // n if rss and rss0 else None,
+            'create_us': round(create_s / n * 1e6, 1)}
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    # the handlers log every room
+    logger.configure("warning")
+    report(f"memory: {n} idle rooms, one player waiting in each", [idle_rooms(n)])
+    # among the idle rooms, as a busy server would be
+    report("memory: one move dispatched, lookup to broadcast", [{'ns_per_move': round(dispatch_moves(20000))}])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# benchmarks/patterns.py
+# AI evaluation with and without the precomputed tables: cell scans/sec, search nodes/sec at a fixed
+# depth, time to move in the opening with and without the book, and the one-off table load cost.
+#   python -m benchmarks.patterns [rounds] [depth]
+import sys
+import time
+import opening
+import patterns
+from ai import Engine
+from benchmarks.ai import POSITIONS
+from benchmarks._util import report
+
+def scans_per_s(engine, rounds):
+    scans = 0
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for _, size, win, stones, _ in POSITIONS:
+            pos = engine.position(size, win, stones)
+            for x, y in pos.near:
+                if (x, y) not in pos.cells and pos.inside(x, y):
+                    pos.scan(x, y)
+                    scans += 1
+    return scans / (time.perf_counter() - t0)
+
+def search_stats(engine, depth):
+    nodes = 0
+    t0 = time.perf_counter()
+    for _, size, win, stones, sym in POSITIONS:
+        engine.tt.clear()
+        engine.best_move(size, win, stones, sym, 0, depth)
+        nodes += engine.nodes
+    elapsed = time.perf_counter() - t0
+    return nodes / elapsed, elapsed / len(POSITIONS)
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    t0 = time.perf_counter()
+    patterns.build_table(5)
+    build_ms = (time.perf_counter() - t0) * 1000
+    patterns._tables.clear()
+    t0 = time.perf_counter()
+    patterns.get_table(5)
+    load_ms = (time.perf_counter() - t0) * 1000
+    report("patterns: win-5 table", [{'build_ms': round(build_ms, 1), 'lazy_load_ms': round(load_ms, 3),
+                                      'file_bytes': len(patterns.get_table(5)) * 4}])
+    rows = []
+    for use_tables in (False, True):
+        engine = Engine(use_tables=use_tables, use_book=False)
+        nodes_per_s, ms = search_stats(engine, depth)
+        rows.append({'tables': use_tables, 'scans_per_s': round(scans_per_s(engine, rounds)),
+                     f'depth{depth}_nodes_per_s': round(nodes_per_s), f'depth{depth}_ms_to_move': round(ms * 1000, 1)})
+    report(f"patterns: evaluation over {len(POSITIONS)} positions", rows)
+    # book: X opened in the centre, O answered next to it, X to move
+    stones = [(7, 7, 'X'), (8, 7, 'O')]
+    rows = []
+    for use_book in (False, True):
+        engine = Engine(use_book=use_book)
+        t0 = time.perf_counter()
+        move = engine.best_move(15, 5, stones, 'X', 0, depth)
+        rows.append({'book': use_book, 'move': f"{move[0]},{move[1]}", 'ms_to_move': round((time.perf_counter() - t0) * 1000, 2),
+                     'in_book': opening.lookup(15, 5, stones, 'X') is not None})
+    report("patterns: opening move on 15x15", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# benchmarks/profiler.py
+# Overhead of the sampling profiler on the server's own work: moves dispatched through
+# server.dispatch while IDLE threads (standing in for connections blocked in recv) exist, with and
+# without a profile window running on another thread. Cost is the process's CPU time per move, the
+# sampler's included, which is steadier than wall time on a shared machine; runs alternate so drift
+# hits both sides.
+#   python -m benchmarks.profiler [idle threads] [moves per run]
+import statistics
+import sys
+import threading
+import time
+import logger
+import profiler
+from benchmarks._util import report
+from benchmarks.instrumentation import dispatch_moves
+
+RUNS = 7
+
+def park(n):
+    # n threads sitting in a wait, as handle_client threads sit in recv
+    release = threading.Event()
+    for _ in range(n):
+        threading.Thread(target=release.wait, daemon=True).start()
+    return release
+
+def cpu_per_move(moves):
+    c0 = time.process_time()
+    dispatch_moves(moves)
+    return (time.process_time() - c0) / moves * 1e9
+
+def profiled(moves):
+    result = {}
+    sampler = threading.Thread(target=lambda: result.update(profile=profiler.run(600)))
+    sampler.start()
+    c0 = time.process_time()
+    dispatch_moves(moves)
+    profiler.stop()
+    sampler.join()
+    return (time.process_time() - c0) / moves * 1e9, result['profile']
+
+def main():
+    idle = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    moves = int(sys.argv[2]) if len(sys.argv) > 2 else 40000
+    logger.configure("warning")
+    release = park(idle)
+    dispatch_moves(moves // 10)   # warm up
+    plain, sampled, profiles = [], [], []
+    for _ in range(RUNS):
+        plain.append(cpu_per_move(moves))
+        ns, profile = profiled(moves)
+        sampled.append(ns)
+        profiles.append(profile)
+    release.set()
+    off, on = statistics.median(plain), statistics.median(sampled)
+    elapsed = sum(p.elapsed for p in profiles)
+    rows = [
+        {'profiler': 'off', 'cpu_ns_per_move': round(off)},
+        {'profiler': 'on', 'cpu_ns_per_move': round(on), 'overhead_pct': round((on - off) / off * 100, 2),
+         'samples_per_s': round(sum(p.rounds for p in profiles) / elapsed),
+         'sampling_cpu_pct': round(sum(p.cost for p in profiles) / elapsed * 100, 2),
+         'busy_samples': sum(p.busy for p in profiles)},
+    ]
+    report(f"profiler: {idle} idle threads, {moves} moves per run, median of {RUNS}", rows)
+
+if __name__ == "__main__":
+    main()
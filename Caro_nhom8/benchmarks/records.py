@@ -0,0 +1,75 @@
+# benchmarks/records.py
+# Game records at scale: writes `games` synthetic finished games (random playouts to a win, on 10x10,
+# 15x15 and unbounded boards) to a records file, then times analyze.py's stats pass over it with one
+# and with every worker process. The main process's peak RSS shows the file is streamed, not loaded.
+#   python -m benchmarks.records [games]
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import analyze
+import records
+from board import make_board
+from benchmarks._util import report
+
+def playout(rng, size, win):
+    # random moves near earlier ones until somebody wins; a draw when no empty cell is near any of them
+    board = make_board(size, win)
+    moves = []
+    x = y = size // 2
+    for i in range(400):
+        for _ in range(50):
+            nx, ny = x + rng.randint(-2, 2), y + rng.randint(-2, 2)
+            if board.contains(nx, ny) and board.is_empty(nx, ny):
+                break
+            if moves:
+                x, y = rng.choice(moves)
+        else:
+            break
+        x, y = nx, ny
+        moves.append((x, y))
+        if board.place(x, y, 'X' if i % 2 == 0 else 'O'):
+            return moves, records.P1_WINS if i % 2 == 0 else records.P2_WINS
+    return moves, records.DRAW
+
+def write_games(path, n_games, distinct=5000):
+    # `distinct` games, written over and over until the file holds n_games
+    rng = random.Random(1)
+    pool = []
+    for i in range(distinct):
+        size = (10, 15, 0)[i % 3]
+        moves, result = playout(rng, size, 5)
+        pool.append(records.encode(f"{i:06x}", size, 5, 0, 1, result, 0.0, 0.0, moves))
+    with open(path, "wb") as f:
+        f.write(records.MAGIC)
+        for i in range(0, n_games, distinct):
+            f.write(b''.join(pool[:min(distinct, n_games - i)]))
+
+def timed_stats(path, workers):
+    t0 = time.perf_counter()
+    total = analyze.stats(path, workers)
+    elapsed = time.perf_counter() - t0
+    return {'workers': workers, 'games': total['games'], 'moves': total['moves'], 'seconds': round(elapsed, 2),
+            'games_per_s': round(total['games'] / elapsed), 'moves_per_s': round(total['moves'] / elapsed),
+            'mismatches': total['mismatched'] + total['invalid'],
+            'main_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+def main():
+    n_games = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    fd, path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    try:
+        t0 = time.perf_counter()
+        write_games(path, n_games)
+        size = os.path.getsize(path)
+        print(f"wrote {n_games} games, {size / 1e6:.1f} MB ({size / n_games:.0f} bytes/game) "
+              f"in {time.perf_counter() - t0:.1f}s")
+        workers = sorted({1, os.cpu_count() or 1})
+        report(f"records: analyze.py stats over {n_games} games", [timed_stats(path, w) for w in workers])
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
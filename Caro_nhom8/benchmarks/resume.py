@@ -0,0 +1,81 @@
+# benchmarks/resume.py
+# Dropped players coming back: many matches `played` moves in, one player of each drops, the other
+# plays its move, then every dropped player reconnects at once. Compares RESUME (only the
+# moves missed since the client's seq) with a full REJOIN (the whole game), on both server modes:
+# time from opening the new connection to having the reply, and the reply's size.
+#   python -m benchmarks.resume [pairs] [played]
+import asyncio
+import sys
+import time
+from common import Code, async_send_msg, pack_msg
+from benchmarks._util import free_port, start_server, stop_server, non_winning_moves, percentile, report
+from benchmarks.server_modes import recv_code
+
+async def make_game(port, moves):
+    # a match `len(moves)` moves in; returns the room id, then (token, connection) of the player to
+    # move next and of the other one
+    (r1, w1), (r2, w2) = await asyncio.gather(asyncio.open_connection("127.0.0.1", port),
+                                              asyncio.open_connection("127.0.0.1", port))
+    await async_send_msg(w1, {'code': Code.JOIN_ROOM, 'payload': {'action': 'CREATE'}})
+    wait = (await recv_code(r1, Code.JOIN_ROOM))['payload']
+    await async_send_msg(w2, {'code': Code.JOIN_ROOM, 'payload': {'action': 'JOIN', 'room_id': wait['room_id']}})
+    joined = (await recv_code(r2, Code.JOIN_ROOM))['payload']
+    start = (await asyncio.gather(recv_code(r1, Code.MATCH_START), recv_code(r2, Code.MATCH_START)))[0]['payload']
+    seats = [(wait['token'], (r1, w1)), (joined['token'], (r2, w2))]
+    if start['first_turn'] != start['you']:
+        seats.reverse()
+    for i, (x, y) in enumerate(moves):
+        await async_send_msg(seats[i % 2][1][1], {'code': Code.MATCH_MOVE, 'payload': {'x': x, 'y': y}})
+        await asyncio.gather(recv_code(r1, Code.MATCH_MOVE), recv_code(r2, Code.MATCH_MOVE))
+    return wait['room_id'], seats[len(moves) % 2], seats[(len(moves) + 1) % 2]
+
+async def come_back(port, room_id, token, seq, latencies, sizes):
+    t0 = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    if seq is None:
+        await async_send_msg(writer, {'code': Code.JOIN_ROOM,
+                                      'payload': {'action': 'REJOIN', 'room_id': room_id, 'token': token}})
+        msg = await recv_code(reader, Code.JOIN_ROOM)
+    else:
+        await async_send_msg(writer, {'code': Code.RESUME, 'payload': {'room_id': room_id, 'token': token, 'seq': seq}})
+        msg = await recv_code(reader, Code.RESUME)
+    latencies.append(time.perf_counter() - t0)
+    sizes.append(len(pack_msg(msg)))
+    return writer
+
+async def run(mode, pairs, played, full):
+    moves = non_winning_moves(count=played + 1)
+    port = free_port()
+    proc = start_server(mode, port)
+    try:
+        games = await asyncio.gather(*[make_game(port, moves[:played]) for _ in range(pairs)])
+        # the player not on move drops; the other plays on (the dropped seat is held, so that is legal)
+        for _, _, (_, (_, writer)) in games:
+            writer.close()
+        for _, (_, (reader, writer)), _ in games:
+            x, y = moves[played]
+            await async_send_msg(writer, {'code': Code.MATCH_MOVE, 'payload': {'x': x, 'y': y}})
+            await recv_code(reader, Code.MATCH_MOVE)
+        latencies, sizes = [], []
+        writers = await asyncio.gather(*[come_back(port, room_id, token, None if full else played, latencies, sizes)
+                                         for room_id, _, (token, _) in games])
+        for writer in writers:
+            writer.close()
+        for _, (_, (_, writer)), _ in games:
+            writer.close()
+    finally:
+        stop_server(proc)
+    latencies.sort()
+    return {'mode': mode, 'reply': 'REJOIN (full game)' if full else 'RESUME (missed moves)',
+            'rooms': len(latencies), 'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'reply_bytes': round(sum(sizes) / len(sizes)) if sizes else None}
+
+def main():
+    pairs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    played = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    rows = [asyncio.run(run(mode, pairs, played, full)) for mode in ("server", "aserver") for full in (True, False)]
+    report(f"resume: {pairs} dropped players back at once, {played} moves in, 1 missed", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# benchmarks/resync.py
+# Numbered moves, in process (no sockets): a game `played` moves in on an unbounded board, then
+# - what the server spends on one MATCH_MOVE by kind: played, a resend of a move already played
+#   (answered again), a stale one (refused), a pre-move (kept for later), and the bytes the sender
+#   gets back (for a played move: the one MATCH_MOVE each player gets)
+# - a client that missed k moves catching up: SYNC from its seq against the whole game again (the
+#   REJOIN reply), time per request and reply size
+#   python -m benchmarks.resync [played] [calls]
+import sys
+import time
+import logger
+import server
+from benchmarks._util import non_winning_moves, report
+from benchmarks.room_contention import fake_conn
+
+def new_game(played):
+    # two players `played` moves into a game on an unbounded board; returns (player to move, other)
+    p1, p2 = fake_conn(("bench", 1)), fake_conn(("bench", 2))
+    server.handle_join_room(p1, {'action': 'CREATE', 'size': 0})
+    server.handle_join_room(p2, {'action': 'JOIN', 'room_id': p1.seat.room.id})
+    room = p1.seat.room
+    players = (p1, p2) if room.turn is p1.seat else (p2, p1)
+    for i, (x, y) in enumerate(non_winning_moves(size=40, count=played)):
+        server.dispatch(players[i % 2], {'code': 'MATCH_MOVE', 'payload': {'x': x, 'y': y, 'seq': i}})
+    return players[played % 2], players[(played + 1) % 2]
+
+def per_call(conn, payload, n):
+    # ns per dispatch and bytes written back to conn, for a message that leaves the game as it is
+    msg = {'code': 'MATCH_MOVE', 'payload': payload}
+    sent = conn.sock.sent
+    t0 = time.perf_counter()
+    for _ in range(n):
+        server.dispatch(conn, msg)
+    elapsed = time.perf_counter() - t0
+    return round(elapsed / n * 1e9), (conn.sock.sent - sent) // n
+
+def played_move(played, n):
+    # ns per move actually played, the two players taking turns from `played` on; the stones are
+    # spread out far from the others, so the game never ends
+    players = new_game(played)
+    sent = players[0].sock.sent
+    t0 = time.perf_counter()
+    for i in range(n):
+        server.dispatch(players[i % 2], {'code': 'MATCH_MOVE', 'payload': {'x': 1000 + 3 * i, 'y': 1000, 'seq': played + i}})
+    elapsed = time.perf_counter() - t0
+    size = (players[0].sock.sent - sent) // n
+    leave(*players)
+    return {'move': 'played', 'ns': round(elapsed / n * 1e9), 'reply_bytes': size}
+
+def leave(*conns):
+    for conn in conns:
+        server.handle_leave_room(conn, {})
+
+def move_kinds(played, n):
+    rows = [played_move(played, n)]
+    mover, other = new_game(played)
+    room = mover.seat.room
+    with room.lock:
+        _, x, y = room.moves[-1]
+    for kind, conn, payload in (
+            ('resend of a played move', other, {'x': x, 'y': y, 'seq': played - 1}),
+            ('stale seq', mover, {'x': 1000, 'y': 1000, 'seq': played - 2}),
+            ('pre-move (kept)', other, {'x': 1000, 'y': 1000, 'seq': played}),
+            ('not your turn (no seq)', other, {'x': 1000, 'y': 1000})):
+        ns, size = per_call(conn, payload, n)
+        rows.append({'move': kind, 'ns': ns, 'reply_bytes': size})
+    leave(mover, other)
+    return rows
+
+def catch_up(played, missed, n):
+    mover, other = new_game(played)
+    slot = other.seat
+    room = slot.room
+    sent = other.sock.sent
+    t0 = time.perf_counter()
+    for _ in range(n):
+        server.handle_sync(other, {'seq': played - missed})
+    sync_s = time.perf_counter() - t0
+    sync_bytes = (other.sock.sent - sent) // n
+    sent = other.sock.sent
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with room.lock:
+            msg = server.resume_msg(slot)
+        server.send(other, msg)
+    full_s = time.perf_counter() - t0
+    full_bytes = (other.sock.sent - sent) // n
+    leave(mover, other)
+    return [{'reply': f'SYNC ({missed} missed)', 'us': round(sync_s / n * 1e6, 2), 'bytes': sync_bytes},
+            {'reply': f'whole game ({played} moves)', 'us': round(full_s / n * 1e6, 2), 'bytes': full_bytes}]
+
+def main():
+    played = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    logger.configure("warning")
+    report(f"resync: one MATCH_MOVE with seq, {played} moves into a game", move_kinds(played, n))
+    for missed in (1, 5, 20):
+        report(f"resync: catching up after {missed} missed moves", catch_up(played, missed, n // 10))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# benchmarks/room_contention.py
+# Hundreds of rooms played at once from one thread per room, calling the server handlers directly.
+# Run once with every client fast and once with a single stalled client: with per-room locks the
+# stalled socket only slows its own room.
+#   python -m benchmarks.room_contention [rooms] [seconds] [stall_ms]
+import sys
+import threading
+import time
+import logger
+import server
+from benchmarks._util import non_winning_moves, percentile, report
+
+MOVES = non_winning_moves()
+
+class FakeSock:
+    # stands in for a client socket; `stall` simulates a peer whose TCP buffer is full
+    def __init__(self, stall=0.0):
+        self.stall = stall
+        self.sent = 0
+
+    def sendall(self, data):
+        if self.stall:
+            time.sleep(self.stall)
+        self.sent += len(data)
+
+def fake_conn(addr, stall=0.0):
+    # a server.Connection writing to a FakeSock
+    return server.Connection(FakeSock(stall), addr)
+
+def setup_rooms(n, stalled_room=None, stall=0.0):
+    pairs = []
+    for i in range(n):
+        p1 = fake_conn(("bench", i))
+        p2 = fake_conn(("bench", i), stall if i == stalled_room else 0.0)
+        server.handle_join_room(p1, {'action': 'CREATE'})
+        server.handle_join_room(p2, {'action': 'JOIN', 'room_id': p1.seat.room.id})
+        pairs.append((p1, p2))
+    return pairs
+
+def play(p1, p2, deadline, latencies):
+    while True:
+        for i, (x, y) in enumerate(MOVES):
+            t0 = time.perf_counter()
+            if t0 >= deadline:
+                return
+            server.handle_move(p1 if i % 2 == 0 else p2, {'x': x, 'y': y})
+            latencies.append(time.perf_counter() - t0)
+        server.handle_restart_request(p1, {'agree': True})
+        server.handle_restart_request(p2, {'agree': True})
+
+def run(n_rooms, seconds, stalled_room=None, stall=0.0):
+    server.rooms.clear()
+    pairs = setup_rooms(n_rooms, stalled_room, stall)
+    latencies = []
+    per_room = [[] for _ in pairs]
+    start = time.perf_counter()
+    deadline = start + seconds
+    threads = [threading.Thread(target=play, args=(p1, p2, deadline, per_room[i]))
+               for i, (p1, p2) in enumerate(pairs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for i, lat in enumerate(per_room):
+        if i != stalled_room:
+            latencies.extend(lat)
+    latencies.sort()
+    return {
+        'rooms': n_rooms,
+        'stalled_client': 'yes' if stalled_room is not None else 'no',
+        'other_rooms_moves_per_s': round(len(latencies) / seconds),
+        'other_rooms_p50_us': round(percentile(latencies, 50) * 1e6, 1),
+        'other_rooms_p99_us': round(percentile(latencies, 99) * 1e6, 1),
+        'other_rooms_max_ms': round((latencies[-1] if latencies else 0) * 1000, 2),
+    }
+
+def main():
+    n_rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    stall_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 200.0
+    # keep the handlers' info logs out of the output and the measurement
+    logger.configure("warning")
+    rows = [run(n_rooms, seconds), run(n_rooms, seconds, stalled_room=0, stall=stall_ms / 1000)]
+    report(f"room contention: {n_rooms} rooms, one thread per room, {seconds}s", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# benchmarks/server_modes.py
+# Threaded server vs asyncio server: idle connections held and moves/sec over real sockets.
+#   python -m benchmarks.server_modes [connections] [pairs] [seconds]
+import asyncio
+import sys
+import time
+from common import Code, async_send_msg, async_recv_msg
+from benchmarks._util import (free_port, start_server, stop_server, proc_stats,
+                              non_winning_moves, percentile, report)
+
+MOVES = non_winning_moves()
+
+async def open_many(port, n, batch=200):
+    conns = []
+    failed = 0
+    for i in range(0, n, batch):
+        results = await asyncio.gather(*[asyncio.open_connection("127.0.0.1", port)
+                                         for _ in range(min(batch, n - i))], return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception):
+                failed += 1
+            else:
+                conns.append(r)
+    return conns, failed
+
+async def recv_code(reader, code, pred=None):
+    while True:
+        msg = await async_recv_msg(reader)
+        if msg is None:
+            raise ConnectionError("server closed connection")
+        if msg.get('code') == code and (pred is None or pred(msg.get('payload'))):
+            return msg
+
+async def make_pair(port):
+    (r1, w1), (r2, w2) = await asyncio.gather(asyncio.open_connection("127.0.0.1", port),
+                                              asyncio.open_connection("127.0.0.1", port))
+    await async_send_msg(w1, {'code': Code.JOIN_ROOM, 'payload': {'action': 'CREATE'}})
+    room_id = (await recv_code(r1, Code.JOIN_ROOM))['payload']['room_id']
+    await async_send_msg(w2, {'code': Code.JOIN_ROOM, 'payload': {'action': 'JOIN', 'room_id': room_id}})
+    await asyncio.gather(recv_code(r1, Code.MATCH_START), recv_code(r2, Code.MATCH_START))
+    return (r1, w1), (r2, w2)
+
+async def play_pair(p1, p2, deadline, latencies):
+    (r1, w1), (r2, w2) = p1, p2
+    moves = 0
+    while time.perf_counter() < deadline:
+        for i, (x, y) in enumerate(MOVES):
+            writer = w1 if i % 2 == 0 else w2
+            t0 = time.perf_counter()
+            await async_send_msg(writer, {'code': Code.MATCH_MOVE, 'payload': {'x': x, 'y': y}})
+            await asyncio.gather(recv_code(r1, Code.MATCH_MOVE), recv_code(r2, Code.MATCH_MOVE))
+            latencies.append(time.perf_counter() - t0)
+            moves += 1
+        # both agree to a rematch so the pair can keep playing on a fresh board
+        await async_send_msg(w1, {'code': Code.MATCH_RESTART, 'payload': {'agree': True}})
+        await recv_code(r2, Code.MATCH_RESTART)
+        await async_send_msg(w2, {'code': Code.MATCH_RESTART, 'payload': {'agree': True}})
+        await asyncio.gather(recv_code(r1, Code.MATCH_RESTART, lambda p: not p),
+                             recv_code(r2, Code.MATCH_RESTART, lambda p: not p))
+    return moves
+
+async def run_mode(mode, connections, pairs, seconds):
+    port = free_port()
+    proc = start_server(mode, port)
+    try:
+        # 1) idle connections held
+        t0 = time.perf_counter()
+        conns, failed = await open_many(port, connections)
+        setup = time.perf_counter() - t0
+        await asyncio.sleep(0.5)
+        idle = proc_stats(proc.pid)
+        for _, w in conns:
+            w.close()
+        await asyncio.sleep(0.5)
+
+        # 2) moves/sec with `pairs` concurrent matches
+        players = await asyncio.gather(*[make_pair(port) for _ in range(pairs)])
+        latencies = []
+        cpu0 = proc_stats(proc.pid)['cpu_s'] or 0.0
+        start = time.perf_counter()
+        deadline = start + seconds
+        counts = await asyncio.gather(*[play_pair(p1, p2, deadline, latencies) for p1, p2 in players])
+        elapsed = time.perf_counter() - start
+        cpu1 = proc_stats(proc.pid)['cpu_s'] or 0.0
+        for p1, p2 in players:
+            p1[1].close()
+            p2[1].close()
+        latencies.sort()
+        total = sum(counts)
+        return {
+            'mode': mode,
+            'held': len(conns),
+            'failed': failed,
+            'conn_per_s': round(len(conns) / setup) if setup else 0,
+            'idle_rss_mb': round((idle['rss_kb'] or 0) / 1024, 1),
+            'threads': idle['threads'],
+            'moves_per_s': round(total / elapsed),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'server_cpu_us_per_move': round((cpu1 - cpu0) / total * 1e6, 1) if total else None,
+        }
+    finally:
+        stop_server(proc)
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    pairs = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+    rows = [asyncio.run(run_mode(mode, connections, pairs, seconds)) for mode in ("server", "aserver")]
+    report(f"server modes: {connections} idle connections, {pairs} concurrent matches for {seconds}s", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/slow_consumer.py
+# One client stops reading while its opponent floods the room with chat; meanwhile other matches
+# keep playing. Reports how long until the slow client is evicted and the move latency seen by
+# the other matches during the flood. Run twice: flooding throughout, and for BURST seconds only,
+# after which nothing more is written to the slow client and only the server's own water-mark
+# checks can evict it. Either way it should be gone within outbound.STALL_TIMEOUT of falling
+# behind, well inside the run.
+#   python -m benchmarks.slow_consumer [pairs] [seconds]
+import asyncio
+import socket
+import sys
+import time
+import outbound
+from common import Code, async_send_msg
+from benchmarks._util import free_port, start_server, stop_server, percentile, report
+from benchmarks.server_modes import recv_code, make_pair, play_pair
+
+BURST = 1.5
+
+async def flood(w1, stop, until=None):
+    text = 'x' * 1000
+    while not stop.is_set() and (until is None or time.perf_counter() < until):
+        await async_send_msg(w1, {'code': Code.MESSAGE_CODE, 'payload': {'text': text}})
+        await asyncio.sleep(0)
+
+async def run_mode(mode, pairs, seconds, burst=None):
+    port = free_port()
+    proc = start_server(mode, port)
+    try:
+        r1, w1 = await asyncio.open_connection("127.0.0.1", port)
+        # the slow client: tiny receive buffer and never reads
+        s = socket.socket()
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        s.connect(("127.0.0.1", port))
+        s.setblocking(False)
+        r2, w2 = await asyncio.open_connection(sock=s)
+        await async_send_msg(w1, {'code': Code.JOIN_ROOM, 'payload': {'action': 'CREATE'}})
+        room_id = (await recv_code(r1, Code.JOIN_ROOM))['payload']['room_id']
+        await async_send_msg(w2, {'code': Code.JOIN_ROOM, 'payload': {'action': 'JOIN', 'room_id': room_id}})
+        await recv_code(r1, Code.MATCH_START)
+
+        players = await asyncio.gather(*[make_pair(port) for _ in range(pairs)])
+        latencies = []
+        stop = asyncio.Event()
+        start = time.perf_counter()
+        flooder = asyncio.create_task(flood(w1, stop, start + burst if burst else None))
+        games = asyncio.gather(*[play_pair(p1, p2, start + seconds, latencies) for p1, p2 in players])
+        try:
+            await asyncio.wait_for(recv_code(r1, Code.MATCH_LEFT), seconds)
+            evicted_after = round(time.perf_counter() - start, 3)
+        except asyncio.TimeoutError:
+            evicted_after = None
+        stop.set()
+        await flooder
+        counts = await games
+        latencies.sort()
+        for p1, p2 in players:
+            p1[1].close()
+            p2[1].close()
+        w1.close()
+        w2.close()
+        return {
+            'mode': mode,
+            'flood': f"{burst:g}s" if burst else 'whole run',
+            'slow_client_evicted_after_s': evicted_after,
+            'other_moves_per_s': round(sum(counts) / seconds),
+            'other_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'other_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        }
+    finally:
+        stop_server(proc)
+
+def main():
+    pairs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    rows = [asyncio.run(run_mode(mode, pairs, seconds, burst)) for burst in (None, BURST)
+            for mode in ("server", "aserver")]
+    report(f"slow consumer: 1 flooded non-reading client, {pairs} other matches for {seconds}s "
+           f"(evicted after {outbound.STALL_TIMEOUT:g}s over {outbound.HIGH_WATER // 1024} KiB, "
+           f"or at once over {outbound.MAX_QUEUED // 1024} KiB)", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/spectators.py
+# One room watched by many spectators over real sockets, on both server modes: the players' move
+# round trip with and without the crowd, and how long until the last spectator has seen each move.
+# A move is encoded once per protocol and fanned out after the players have been sent it, so the
+# round trip should barely change with the number of spectators.
+# Moves are spaced `gap_ms` apart, as in a real game, so the fan-out of one move is measured rather
+# than a backlog of many.
+#   python -m benchmarks.spectators [spectators] [moves] [gap_ms]
+import asyncio
+import multiprocessing
+import sys
+import time
+from common import Code, async_send_msg, async_recv_msg
+from benchmarks._util import (free_port, start_server, stop_server, proc_stats,
+                              non_winning_moves, percentile, report)
+from benchmarks.server_modes import open_many, recv_code
+
+async def make_room(port):
+    (r1, w1), (r2, w2) = await asyncio.gather(asyncio.open_connection("127.0.0.1", port),
+                                              asyncio.open_connection("127.0.0.1", port))
+    await async_send_msg(w1, {'code': Code.JOIN_ROOM, 'payload': {'action': 'CREATE'}})
+    room_id = (await recv_code(r1, Code.JOIN_ROOM))['payload']['room_id']
+    await async_send_msg(w2, {'code': Code.JOIN_ROOM, 'payload': {'action': 'JOIN', 'room_id': room_id}})
+    await asyncio.gather(recv_code(r1, Code.MATCH_START), recv_code(r2, Code.MATCH_START))
+    return room_id, (r1, w1), (r2, w2)
+
+async def watch(reader, n_moves, arrivals):
+    # latest arrival of each MATCH_MOVE over all spectators; snapshots are skipped
+    seen = 0
+    while seen < n_moves:
+        msg = await async_recv_msg(reader)
+        if msg is None:
+            return
+        if msg.get('code') == Code.MATCH_MOVE:
+            now = time.perf_counter()
+            if now > arrivals[seen]:
+                arrivals[seen] = now
+            seen += 1
+
+async def spectate(port, room_id, n, n_moves, conn):
+    # runs in its own process, so decoding the crowd's traffic does not slow the players' client
+    conns, failed = await open_many(port, n)
+    for _, writer in conns:
+        await async_send_msg(writer, {'code': Code.SPECTATE, 'payload': {'room_id': room_id}})
+    await asyncio.gather(*[recv_code(reader, Code.SPECTATE) for reader, _ in conns])
+    arrivals = [0.0] * n_moves
+    watchers = [asyncio.ensure_future(watch(reader, n_moves, arrivals)) for reader, _ in conns]
+    conn.send((len(conns), failed))
+    await asyncio.wait_for(asyncio.gather(*watchers), 60)
+    conn.send(arrivals)
+    for _, writer in conns:
+        writer.close()
+
+def spectator_process(port, room_id, n, n_moves, conn):
+    asyncio.run(spectate(port, room_id, n, n_moves, conn))
+
+async def run(port, pid, n_spectators, moves, gap):
+    room_id, (r1, w1), (r2, w2) = await make_room(port)
+    watching, failed, child = 0, 0, None
+    if n_spectators:
+        parent, conn = multiprocessing.Pipe()
+        child = multiprocessing.Process(target=spectator_process, args=(port, room_id, n_spectators, len(moves), conn))
+        child.start()
+        watching, failed = await asyncio.get_running_loop().run_in_executor(None, parent.recv)
+    before = proc_stats(pid)
+    sent = []
+    latencies = []
+    for i, (x, y) in enumerate(moves):
+        writer = w1 if i % 2 == 0 else w2
+        t0 = time.perf_counter()
+        sent.append(t0)
+        await async_send_msg(writer, {'code': Code.MATCH_MOVE, 'payload': {'x': x, 'y': y}})
+        await asyncio.gather(recv_code(r1, Code.MATCH_MOVE), recv_code(r2, Code.MATCH_MOVE))
+        latencies.append(time.perf_counter() - t0)
+        await asyncio.sleep(gap)
+    fanout = []
+    if child:
+        # perf_counter is CLOCK_MONOTONIC, shared by both processes
+        arrivals = await asyncio.get_running_loop().run_in_executor(None, parent.recv)
+        child.join()
+        fanout = sorted(a - s for a, s in zip(arrivals, sent))
+    # server CPU for the moves and their fan-out, not for accepting the spectators
+    cpu = (proc_stats(pid)['cpu_s'] or 0) - (before['cpu_s'] or 0)
+    w1.close()
+    w2.close()
+    return sorted(latencies), fanout, cpu, watching, failed
+
+def main():
+    n_spectators = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_moves = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    gap_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 100
+    moves = non_winning_moves(count=n_moves)
+    rows = []
+    for mode in ("server", "aserver"):
+        for n in (0, n_spectators):
+            port = free_port()
+            proc = start_server(mode, port)
+            try:
+                latencies, fanout, cpu, watching, failed = asyncio.run(run(port, proc.pid, n, moves, gap_ms / 1000))
+            finally:
+                stop_server(proc)
+            rows.append({'mode': mode, 'spectators': watching, 'failed': failed,
+                         'move_rtt_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                         'move_rtt_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                         'last_spectator_p50_ms': round(percentile(fanout, 50) * 1000, 2),
+                         'last_spectator_p99_ms': round(percentile(fanout, 99) * 1000, 2),
+                         'server_cpu_ms_per_move': round(cpu / len(moves) * 1000, 2)})
+    report(f"spectators: one room, {len(moves)} moves {gap_ms:g} ms apart", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# board.py
+# Compact game board: one integer bitboard per symbol (bit y*width + x), plus a shape table shared
+# by every board of the same size. Win detection is shift-and-mask over the stones of the newly
+# played symbol, restricted to the win-1 cells either side of the move in each direction, so the
+# check does the same small amount of work on every move; a direction with no stone of the mover
+# next to the move is skipped after one AND.
+# Very large or unbounded boards use SparseBoard instead, whose memory grows with the stones played
+# and whose win check walks at most win-1 cells each way from the move. make_board() picks one.
+
+# step directions; (-1, 1) instead of (1, -1) so every bit shift is positive
+DIRECTIONS = ((1, 0), (0, 1), (1, 1), (-1, 1))
+
+# rule limits accepted from clients; size 0 means an unbounded board
+DEFAULT_SIZE = 10
+DEFAULT_WIN = 5
+MIN_SIZE, MAX_SIZE = 5, 99
+MIN_WIN, MAX_WIN = 3, 9
+# bounded boards up to this many cells use bitboards, bigger ones are stored sparsely
+BITBOARD_MAX_CELLS = 32 * 32
+# unbounded boards accept coordinates in [-COORD_LIMIT, COORD_LIMIT] (fits the binary codec's int16)
+COORD_LIMIT = 32767
+
+def run_shifts(win):
+    # shift multiples for shift-and-mask detection of `win` in a row: after each `bits &= bits >> k*step`,
+    # bit i survives only if the `covered` cells starting at i are all set (5 -> 1, 2, 1)
+    shifts = []
+    covered = 1
+    while covered * 2 <= win:
+        shifts.append(covered)
+        covered *= 2
+    if covered < win:
+        shifts.append(win - covered)
+    return shifts
+
+# every win length's shifts fit in this many, padded with no-op zero shifts so place() runs straight through
+SHIFTS = 4
+
+class Shape:
+    # precomputed per (width, height, win): for each cell, one (neighbour mask, line mask, SHIFTS bit
+    # shifts) per direction
+    def __init__(self, width, height, win):
+        self.width = width
+        self.height = height
+        self.win = win
+        multiples = run_shifts(win)
+        multiples += [0] * (SHIFTS - len(multiples))
+        self.windows = []
+        for y in range(height):
+            for x in range(width):
+                lines = []
+                for dx, dy in DIRECTIONS:
+                    mask = near = 0
+                    for k in range(-(win - 1), win):
+                        nx, ny = x + k * dx, y + k * dy
+                        if 0 <= nx < width and 0 <= ny < height:
+                            mask |= 1 << (ny * width + nx)
+                            if k in (-1, 1):
+                                near |= 1 << (ny * width + nx)
+                    step = dy * width + dx
+                    lines.append((near, mask, *(k * step for k in multiples)))
+                self.windows.append(tuple(lines))
+
+_SHAPES = {}
+
+def get_shape(width=10, height=10, win=5):
+    key = (width, height, win)
+    shape = _SHAPES.get(key)
+    if shape is None:
+        shape = _SHAPES[key] = Shape(width, height, win)
+    return shape
+
+def valid_rules(size, win):
+    # True if a room may be created with these rules
+    if not isinstance(size, int) or not isinstance(win, int) or isinstance(size, bool) or isinstance(win, bool):
+        return False
+    if not MIN_WIN <= win <= MAX_WIN:
+        return False
+    return size == 0 or (MIN_SIZE <= size <= MAX_SIZE and win <= size)
+
+def make_board(size=DEFAULT_SIZE, win=DEFAULT_WIN):
+    # size x size board, or an unbounded one for size 0
+    if size and size * size <= BITBOARD_MAX_CELLS:
+        return Board(size, size, win)
+    return SparseBoard(size or None, size or None, win)
+
+class Board:
+    __slots__ = ('shape', 'x', 'o')
+
+    def __init__(self, width=DEFAULT_SIZE, height=DEFAULT_SIZE, win=DEFAULT_WIN):
+        self.shape = get_shape(width, height, win)
+        self.x = 0  # bitboard of 'X' stones
+        self.o = 0  # bitboard of 'O' stones
+
+    @property
+    def width(self):
+        return self.shape.width
+
+    @property
+    def height(self):
+        return self.shape.height
+
+    @property
+    def win(self):
+        return self.shape.win
+
+    def contains(self, x, y):
+        return 0 <= x < self.shape.width and 0 <= y < self.shape.height
+
+    def get(self, x, y):
+        bit = 1 << (y * self.shape.width + x)
+        if self.x & bit:
+            return 'X'
+        if self.o & bit:
+            return 'O'
+        return ''
+
+    def is_empty(self, x, y):
+        return not ((self.x | self.o) >> (y * self.shape.width + x)) & 1
+
+    def place(self, x, y, sym):
+        # put `sym` on an empty in-bounds cell; returns True if the move makes `win` in a row
+        shape = self.shape
+        cell = y * shape.width + x
+        if sym == 'X':
+            bits = self.x = self.x | 1 << cell
+        else:
+            bits = self.o = self.o | 1 << cell
+        for near, mask, k1, k2, k3, k4 in shape.windows[cell]:
+            if bits & near:
+                b = bits & mask
+                b &= b >> k1
+                b &= b >> k2
+                b &= b >> k3
+                b &= b >> k4
+                if b:
+                    return True
+        return False
+
+    def count(self):
+        return bin(self.x | self.o).count('1')
+
+    def is_full(self):
+        return self.count() == self.shape.width * self.shape.height
+
+    def stones(self):
+        # (x, y, sym) for every stone on the board
+        w = self.shape.width
+        for sym, bits in (('X', self.x), ('O', self.o)):
+            cell = 0
+            while bits:
+                if bits & 1:
+                    yield cell % w, cell // w, sym
+                bits >>= 1
+                cell += 1
+
+    def rows(self):
+        # list-of-lists view ('' / 'X' / 'O'), for display and debugging
+        return [[self.get(x, y) for x in range(self.shape.width)] for y in range(self.shape.height)]
+
+class SparseBoard:
+    # stones kept in a dict keyed by packed coordinates; width/height None means unbounded
+    __slots__ = ('width', 'height', 'win', 'cells')
+
+    # one spare column per row so a walk off either edge never lands on a real cell of the next row
+    SPAN = 2 * COORD_LIMIT + 2
+
+    def __init__(self, width=None, height=None, win=DEFAULT_WIN):
+        self.width = width
+        self.height = height
+        self.win = win
+        self.cells = {}
+
+    def contains(self, x, y):
+        if self.width is None:
+            return -COORD_LIMIT <= x <= COORD_LIMIT and -COORD_LIMIT <= y <= COORD_LIMIT
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def _key(self, x, y):
+        return (y + COORD_LIMIT) * self.SPAN + x + COORD_LIMIT
+
+    def get(self, x, y):
+        return self.cells.get(self._key(x, y), '')
+
+    def is_empty(self, x, y):
+        return self._key(x, y) not in self.cells
+
+    def place(self, x, y, sym):
+        # put `sym` on an empty in-bounds cell; returns True if the move makes `win` in a row
+        cells = self.cells
+        span = self.SPAN
+        key = self._key(x, y)
+        cells[key] = sym
+        win = self.win
+        for dx, dy in DIRECTIONS:
+            step = dy * span + dx
+            run = 1
+            k = key + step
+            while run < win and cells.get(k) == sym:
+                run += 1
+                k += step
+            k = key - step
+            while run < win and cells.get(k) == sym:
+                run += 1
+                k -= step
+            if run >= win:
+                return True
+        return False
+
+    def count(self):
+        return len(self.cells)
+
+    def is_full(self):
+        return self.width is not None and len(self.cells) == self.width * self.height
+
+    def stones(self):
+        span = self.SPAN
+        for key, sym in self.cells.items():
+            y, x = divmod(key, span)
+            yield x - COORD_LIMIT, y - COORD_LIMIT, sym
@@ -0,0 +1,159 @@
+# bot.py
+# Built-in AI opponent. A BotPlayer sits in a room like a client connection (server.LocalPeer): the server sends
+# it the same messages a client gets, and it answers by calling the normal handlers.
+# Bot events are handled on a few dedicated AI threads, never on a connection thread or the event loop;
+# the searches themselves run in the aipool search processes, so they don't hold the server's GIL.
+import itertools
+import queue
+import threading
+import aipool
+import logger
+import server
+from ai import Engine
+from common import Code
+from helper import safe_start_thread
+
+# threads shared by every AI room; they mostly wait on search processes, so two per process
+AI_THREADS = max(2, 2 * aipool.AI_PROCESSES)
+MOVE_TIME = 1.0     # seconds of search per move
+MAX_DEPTH = 8
+
+class AIWorker:
+    # one thread handling the events of the bots assigned to it, in order; the engine is only used
+    # when searches run in-thread (aipool.AI_PROCESSES = 0)
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.pool = aipool.get_pool()
+        self.engine = None if self.pool else Engine()
+        self.thread = safe_start_thread(self.run, ())
+
+    def run(self):
+        while True:
+            bot, msg = self.jobs.get()
+            try:
+                bot.handle(msg, self)
+            except Exception as e:
+                logger.error("ai_worker_error", error=e)
+
+_workers = []
+_workers_lock = threading.Lock()
+_next_worker = itertools.count()
+
+def pick_worker():
+    with _workers_lock:
+        if not _workers:
+            _workers.extend(AIWorker() for _ in range(AI_THREADS))
+        return _workers[next(_next_worker) % len(_workers)]
+
+def think_time(move_time, clock):
+    # seconds of search per move that stay well inside a time control ({'base', 'increment',
+    # 'move_time'} from MATCH_START), at most move_time
+    if clock:
+        if clock.get('move_time'):
+            move_time = min(move_time, clock['move_time'] / 4)
+        if clock.get('base'):
+            move_time = min(move_time, clock['base'] / 60 + clock.get('increment', 0) / 2)
+    return move_time
+
+class BotPlayer(server.LocalPeer):
+    def __init__(self, addr=None, move_time=MOVE_TIME, max_depth=MAX_DEPTH):
+        super().__init__(addr)
+        self.worker = pick_worker()
+        self.move_time = move_time
+        self.think_time = move_time   # search time per move within the game's time control
+        self.max_depth = max_depth
+        self.player_id = None
+        self.symbol = None
+        self.size = 10
+        self.win = 5
+        self.stones = []
+        self.finished = False
+        self.left = False
+        # bumped on restart/leave so that a search still running for an old game stops early
+        self.generation = 0
+
+    def receive(self, msg):
+        # called by server.send() on whatever thread is delivering; just queue it for the AI thread
+        code = msg.get('code')
+        payload = msg.get('payload') or {}
+        if code == Code.MATCH_LEFT and 'grace' in payload:
+            # the opponent dropped but its seat is held: keep playing, it gets our moves when it resumes
+            return
+        if code in (Code.MATCH_LEFT, Code.ROOM_LEAVE, Code.ROOM_LEAVE_SUCCESS, Code.MATCH_TIMEOUT) or (code == Code.MATCH_RESTART and not payload):
+            self.generation += 1
+        self.worker.jobs.put((self, msg))
+
+    def handle(self, msg, worker):
+        # runs on the AI thread
+        if self.left:
+            return
+        code = msg.get('code')
+        payload = msg.get('payload') or {}
+        if code == Code.MATCH_START:
+            self.player_id = payload['you']
+            self.symbol = payload['symbol']
+            self.size = payload.get('size', 10)
+            self.win = payload.get('win', 5)
+            self.think_time = think_time(self.move_time, payload.get('clock'))
+            self.new_game()
+            if payload.get('first_turn') == self.player_id:
+                self.think(worker)
+        elif code == Code.JOIN_ROOM and payload.get('status') == 'REJOINED':
+            # back in a game recovered from the journal; the opponent's seat is held, so play on
+            self.player_id = payload['player_id']
+            self.symbol = payload['symbol']
+            self.size = payload.get('size', 10)
+            self.win = payload.get('win', 5)
+            self.think_time = think_time(self.move_time, payload.get('clock'))
+            self.stones = [tuple(m) for m in payload['moves']]
+            self.finished = payload['finished']
+            if payload['turn'] == self.player_id:
+                self.think(worker)
+        elif code == Code.MATCH_MOVE:
+            self.stones.append((payload['x'], payload['y'], payload['symbol']))
+            if payload.get('winner'):
+                self.finished = True
+            elif payload.get('by') != self.player_id:
+                self.think(worker)
+        elif code == Code.MATCH_RESTART:
+            if 'request_from' in payload:
+                server.call_soon(server.handle_restart_request, self, {'agree': True})
+            else:
+                self.new_game()
+                if self.player_id == "Player 1":
+                    self.think(worker)
+        elif code == Code.MATCH_DRAW_REQUEST:
+            server.call_soon(server.handle_draw_reject, self, {})
+        elif code in (Code.MATCH_DRAW_ACCEPT, Code.MATCH_TIMEOUT):
+            self.finished = True
+        elif code in (Code.MATCH_LEFT, Code.ROOM_LEAVE):
+            # nobody left to play against: leave so the room is deleted
+            self.left = True
+            server.call_soon(server.handle_leave_room, self, {})
+        elif code == Code.ROOM_LEAVE_SUCCESS:
+            # the room was closed for inactivity
+            self.left = True
+
+    def new_game(self):
+        self.stones = []
+        self.finished = False
+
+    def think(self, worker):
+        if self.finished:
+            return
+        generation = self.generation
+        # a room left, closed (handle_leave_room / handle_disconnect) or restarted bumps the generation,
+        # which cancels the search
+        should_stop = lambda: self.generation != generation
+        if worker.pool:
+            move = worker.pool.search(self.size, self.win, self.stones, self.symbol, self.think_time, self.max_depth,
+                                      should_stop)
+        else:
+            move = worker.engine.best_move(self.size, self.win, self.stones, self.symbol, self.think_time,
+                                           self.max_depth, should_stop=should_stop)
+        if move is None and self.generation == generation:
+            # the search process failed or overran; a shallow search here beats stalling the game
+            move = Engine(tt_bits=10).best_move(self.size, self.win, self.stones, self.symbol, 0, 1)
+        if move is None or self.generation != generation:
+            return
+        server.call_soon(server.handle_move, self, {'x': move[0], 'y': move[1]})
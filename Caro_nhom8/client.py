@@ -1,26 +1,90 @@
 # client.py
+import json
+import os
+import random
 import socket
 import threading
+import time
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
-from common import Code, send_msg, recv_msg
+from common import Code, FrameReader
+from codec import PROTOCOL_JSON, SUPPORTED, decode_frame, encode_frame
 from helper import safe_start_thread
 
+# room sizes offered when creating a room; 0 is an unbounded board
+SIZE_CHOICES = {"10x10": 10, "15x15": 15, "19x19": 19, "Vô hạn": 0}
+# boards up to MAX_GRID are shown whole; bigger and unbounded ones through a pannable VIEW_SIZE window
+MAX_GRID = 19
+VIEW_SIZE = 15
+PAN_STEP = 5
+# reconnecting after a dropped connection: exponential backoff with jitter, for about as long as the
+# server holds our seat (server.RESUME_GRACE)
+RECONNECT_DELAY = 0.5
+RECONNECT_MAX_DELAY = 8.0
+RECONNECT_FOR = 30.0
+# how often the game clock on screen is redrawn
+CLOCK_REFRESH_MS = 200
+# our player id and key on the server (IDENTIFY), kept between runs for its rating
+PROFILE_PATH = os.path.join(os.path.expanduser("~"), ".caro_profile.json")
+
+def size_label(size):
+    return f"{size}x{size}" if size else "vô hạn"
+
+def other_player(name):
+    return "Player 2" if name == "Player 1" else "Player 1"
+
+def format_clock(seconds):
+    seconds = max(int(seconds + 0.999), 0)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def load_profile():
+    # {'user', 'key'} saved by an earlier run, or {}
+    try:
+        with open(PROFILE_PATH, encoding='utf-8') as f:
+            profile = json.load(f)
+        return {'user': profile['user'], 'key': profile['key']}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+def save_profile(user, key):
+    try:
+        with open(PROFILE_PATH, "w", encoding='utf-8') as f:
+            json.dump({'user': user, 'key': key}, f)
+    except OSError as e:
+        print("Cannot save profile:", e)
+
 class ClientApp:
     def __init__(self, host, port):
         self.host = host
         self.port = port
         self.sock = None
+        self.protocol = PROTOCOL_JSON
         self.root = tk.Tk()
-        self.root.title("Caro 10x10 - Client")
+        self.root.title("Caro - Client")
         self.player_id = None
         self.opponent_id = None
         self.room_id = None
+        self.token = None        # session token for our seat, to RESUME it after a dropped connection
+        self.closing = False
         self.symbol = None
-        self.board = [['' for _ in range(10)] for __ in range(10)]
+        self.board = {}          # (x, y) -> symbol, for any board size
+        self.size = 10
+        self.win = 5
+        self.origin = (0, 0)     # board coordinates of the top-left visible cell
+        self.room_ids = []       # room ids in the same order as the room listbox
+        self.spectating = None   # room id being watched read-only
         self.turn = None
         self.in_match = False
         self.last_move = None
+        # game clock, with a time control: its settings, seconds left per player as of the start of
+        # the current turn, the player to move and when its turn began (time.monotonic)
+        self.clock = None
+        self.clock_left = {}
+        self.clock_turn = None
+        self.clock_since = 0.0
+        self.queued = False      # waiting for a rated game (MATCHMAKE)
+        # the server turned down our saved player: it stays saved, a stand-in player isn't
+        self.keep_profile = False
 
         # UI status
         self.status_var = tk.StringVar()
@@ -48,23 +112,24 @@ class ClientApp:
         # Player ID label
         self.player_label = tk.Label(right, text="Player: ---")
         self.player_label.pack(pady=(0,5))
+        self.rating_var = tk.StringVar(value="Xếp hạng: ---")
+        tk.Label(right, textvariable=self.rating_var).pack(pady=(0,5))
 
         # Board
         self.cells = []
-        board_frame = tk.Frame(left)
-        board_frame.pack(padx=10, pady=10)
-        for y in range(10):
-            row = []
-            for x in range(10):
-                btn = tk.Button(board_frame, text=" ", width=3, height=1,
-                                command=lambda xx=x, yy=y: self.click_cell(xx, yy))
-                btn.grid(row=y, column=x)
-                row.append(btn)
-            self.cells.append(row)
+        self.board_frame = tk.Frame(left)
+        self.board_frame.pack(padx=10, pady=10)
+        self.pan_frame = tk.Frame(left)
+        for text, dx, dy in (("◀", -1, 0), ("▲", 0, -1), ("▼", 0, 1), ("▶", 1, 0)):
+            tk.Button(self.pan_frame, text=text, width=3, command=lambda ddx=dx, ddy=dy: self.pan(ddx, ddy)).pack(side=tk.LEFT)
+        self.build_board(10)
 
         # Status
         self.status_label = tk.Label(left, textvariable=self.status_var)
         self.status_label.pack(pady=(5,10))
+        self.clock_var = tk.StringVar()
+        tk.Label(left, textvariable=self.clock_var, font=("Courier", 11)).pack()
+        self.root.after(CLOCK_REFRESH_MS, self.show_clock)
 
         # Chat
         chat_label = tk.Label(right, text="Chat")
@@ -81,10 +146,24 @@ class ClientApp:
         # Controls
         ctrl_frame = tk.Frame(right)
         ctrl_frame.pack(fill=tk.X, pady=5)
+        rules_frame = tk.Frame(ctrl_frame)
+        rules_frame.pack(fill=tk.X)
+        tk.Label(rules_frame, text="Bàn:").pack(side=tk.LEFT)
+        self.size_var = tk.StringVar(value="10x10")
+        tk.OptionMenu(rules_frame, self.size_var, *SIZE_CHOICES).pack(side=tk.LEFT)
+        tk.Label(rules_frame, text="Thắng:").pack(side=tk.LEFT)
+        self.win_var = tk.StringVar(value="5")
+        tk.Spinbox(rules_frame, from_=3, to=9, width=3, textvariable=self.win_var).pack(side=tk.LEFT)
         self.btn_create = tk.Button(ctrl_frame, text="Tạo phòng", command=self.create_room)
         self.btn_create.pack(fill=tk.X)
+        self.btn_ai = tk.Button(ctrl_frame, text="Chơi với máy", command=self.create_ai_room)
+        self.btn_ai.pack(fill=tk.X)
         self.btn_list = tk.Button(ctrl_frame, text="Xem danh sách phòng", command=self.request_room_list)
         self.btn_list.pack(fill=tk.X)
+        self.btn_quick = tk.Button(ctrl_frame, text="Ghép trận nhanh", command=self.quick_match)
+        self.btn_quick.pack(fill=tk.X)
+        self.btn_rated = tk.Button(ctrl_frame, text="Đấu xếp hạng", command=self.rated_match)
+        self.btn_rated.pack(fill=tk.X)
         room_id_frame = tk.Frame(right)
         room_id_frame.pack(fill=tk.X, pady=5)
         tk.Label(room_id_frame, text="Nhập mã phòng:").pack()
@@ -92,6 +171,8 @@ class ClientApp:
         self.room_entry.pack(fill=tk.X, padx=5, pady=2)
         join_by_id_btn = tk.Button(room_id_frame, text="Tham gia phòng", command=self.join_room_by_id)
         join_by_id_btn.pack(fill=tk.X, padx=5, pady=2)
+        watch_btn = tk.Button(room_id_frame, text="Xem trận", command=self.spectate_room_by_id)
+        watch_btn.pack(fill=tk.X, padx=5, pady=2)
         self.btn_join = tk.Button(ctrl_frame, text="Vào phòng", command=self.join_selected_room)
         self.btn_join.pack(fill=tk.X)
         self.btn_leave = tk.Button(ctrl_frame, text="Rời phòng", command=self.leave_room)
@@ -106,48 +187,177 @@ class ClientApp:
         self.room_listbox = tk.Listbox(right, width=40, height=8)
         self.room_listbox.pack(padx=5, pady=5)
 
+    # --- board grid ---
+    def build_board(self, size):
+        # (re)create the button grid for a size x size board (0 = unbounded)
+        for row in self.cells:
+            for btn in row:
+                btn.destroy()
+        self.size = size
+        n = size if 0 < size <= MAX_GRID else VIEW_SIZE
+        # an unbounded board starts centred on (0, 0)
+        self.origin = (0, 0) if size else (-(n // 2), -(n // 2))
+        self.cells = []
+        for vy in range(n):
+            row = []
+            for vx in range(n):
+                btn = tk.Button(self.board_frame, text=" ", width=3, height=1,
+                                command=lambda xx=vx, yy=vy: self.click_cell(xx, yy))
+                btn.grid(row=vy, column=vx)
+                row.append(btn)
+            self.cells.append(row)
+        self.default_bg = self.cells[0][0].cget('bg')
+        if n != size:
+            self.pan_frame.pack(after=self.board_frame)
+        else:
+            self.pan_frame.pack_forget()
+
+    def set_all_cells(self, **kw):
+        for row in self.cells:
+            for btn in row:
+                btn.configure(**kw)
+
+    def view_cell(self, x, y):
+        # the button showing board cell (x, y), or None if it is outside the visible window
+        vx, vy = x - self.origin[0], y - self.origin[1]
+        if 0 <= vy < len(self.cells) and 0 <= vx < len(self.cells):
+            return self.cells[vy][vx]
+        return None
+
+    def redraw_board(self):
+        ox, oy = self.origin
+        for vy, row in enumerate(self.cells):
+            for vx, btn in enumerate(row):
+                sym = self.board.get((ox + vx, oy + vy), '')
+                btn.configure(text=sym or " ", state=tk.DISABLED if sym or not self.in_match else tk.NORMAL,
+                              bg=self.default_bg)
+        if self.last_move:
+            self.highlight_last_move(*self.last_move)
+
+    def pan(self, dx, dy):
+        n = len(self.cells)
+        ox, oy = self.origin[0] + dx * PAN_STEP, self.origin[1] + dy * PAN_STEP
+        if self.size:
+            ox = max(0, min(ox, self.size - n))
+            oy = max(0, min(oy, self.size - n))
+        self.origin = (ox, oy)
+        self.redraw_board()
+
+    def center_on(self, x, y):
+        n = len(self.cells)
+        self.origin = (x - n // 2, y - n // 2)
+        self.pan(0, 0)  # clamps to the board edges and redraws
+
     def connect_to_server(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((self.host, self.port))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.connect((self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.protocol = PROTOCOL_JSON
+        # ask for the compact binary protocol; until the server answers, keep talking JSON
+        self.send({'code': Code.HELLO, 'payload': {'versions': list(SUPPORTED)}})
+        # keep the waiting-room list live: a snapshot, then the server pushes only what changed
+        self.send({'code': Code.LOBBY_SUBSCRIBE, 'payload': {'subscribe': True}})
+        # play as our saved player, or get a new one
+        self.send({'code': Code.IDENTIFY, 'payload': load_profile()})
+
+    def send(self, obj):
+        self.sock.sendall(encode_frame(obj, self.protocol))
 
     def receiver_thread(self):
-        try:
-            while True:
-                msg = recv_msg(self.sock)
-                if msg is None:
-                    self.on_server_disconnect()
-                    break
-                code = msg.get('code')
-                payload = msg.get('payload')
-                if code == Code.JOIN_ROOM:
-                    self.handle_join_response(payload)
-                elif code == Code.ROOM_LIST:
-                    self.update_room_list(payload)
-                elif code == Code.MESSAGE_CODE:
-                    self.append_chat(f"[{payload.get('from')}] {payload.get('text')}")
-                elif code == Code.MATCH_START:
-                    self.handle_match_start(payload)
-                elif code == Code.MATCH_MOVE:
-                    self.handle_move(payload)
-                elif code == Code.MATCH_RESTART:
-                    self.handle_restart(payload)
-                elif code == Code.MATCH_LEFT:
-                    self.handle_opponent_left(payload)
-                elif code == Code.ROOM_LEAVE:
-                    self.handle_room_leave(payload)
-                elif code == Code.ROOM_LEAVE_SUCCESS:
-                    self.handle_leave_success(payload)
-                elif code == Code.MATCH_DRAW_REQUEST:
-                    self.handle_draw_request(payload)
-                elif code == Code.MATCH_DRAW_ACCEPT:
-                    self.handle_draw_accept(payload)
-                elif code == Code.MATCH_DRAW_REJECT:
-                    self.handle_draw_reject(payload)
-                elif code == Code.ERROR:
-                    self.append_chat(f"[Server ERROR] {payload}")
-        except Exception as e:
-            print("Receiver thread error:", e)
-            self.on_server_disconnect()
+        while True:
+            try:
+                for body in FrameReader(self.sock).frames():
+                    self.handle_message(decode_frame(body))
+            except Exception as e:
+                if not self.closing:
+                    print("Receiver thread error:", e)
+            if self.closing:
+                return
+            if not self.reconnect():
+                self.on_server_disconnect()
+                return
+            self.resume_session()
+
+    def handle_message(self, msg):
+        code = msg.get('code')
+        payload = msg.get('payload')
+        if code == Code.HELLO:
+            self.protocol = payload.get('version', PROTOCOL_JSON)
+        elif code == Code.PING:
+            # the server checks silent connections; answering keeps ours open
+            self.send({'code': Code.PONG, 'payload': payload})
+        elif code == Code.JOIN_ROOM:
+            self.handle_join_response(payload)
+        elif code == Code.LOBBY_UPDATE:
+            self.apply_lobby_update(payload)
+        elif code == Code.SPECTATE:
+            self.handle_spectate(payload)
+        elif code == Code.MESSAGE_CODE:
+            self.append_chat(f"[{payload.get('from')}] {payload.get('text')}")
+        elif code == Code.MATCH_START:
+            self.handle_match_start(payload)
+        elif code == Code.MATCH_MOVE:
+            self.handle_move(payload)
+        elif code == Code.MATCH_RESTART:
+            self.handle_restart(payload)
+        elif code == Code.MATCH_LEFT:
+            self.handle_opponent_left(payload)
+        elif code == Code.ROOM_LEAVE:
+            self.handle_room_leave(payload)
+        elif code == Code.ROOM_LEAVE_SUCCESS:
+            self.handle_leave_success(payload)
+        elif code == Code.MATCH_DRAW_REQUEST:
+            self.handle_draw_request(payload)
+        elif code == Code.MATCH_DRAW_ACCEPT:
+            self.handle_draw_accept(payload)
+        elif code == Code.MATCH_DRAW_REJECT:
+            self.handle_draw_reject(payload)
+        elif code == Code.RESUME:
+            self.handle_resume(payload)
+        elif code == Code.SYNC:
+            self.handle_sync(payload)
+        elif code == Code.MATCH_TIMEOUT:
+            self.handle_timeout(payload)
+        elif code == Code.IDENTIFY:
+            self.handle_identify(payload)
+        elif code == Code.MATCHMAKE:
+            self.set_queued(payload.get('status') == 'QUEUED')
+            if payload.get('status') == 'LEFT':
+                self.root.after(0, lambda: self.status_var.set("Đã hủy tìm trận xếp hạng"))
+        elif code == Code.RATING:
+            self.handle_rating(payload)
+        elif code == Code.ERROR:
+            if payload == 'Stale move':
+                # our board is behind the room's: fetch the moves we don't have
+                self.request_sync()
+            self.append_chat(f"[Server ERROR] {payload}")
+
+    def reconnect(self):
+        # after a dropped connection: retry with backoff; True once connected again
+        self.root.after(0, lambda: self.status_var.set("Mất kết nối. Đang kết nối lại..."))
+        delay = RECONNECT_DELAY
+        deadline = time.monotonic() + RECONNECT_FOR
+        while time.monotonic() < deadline and not self.closing:
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            try:
+                self.connect_to_server()
+                return True
+            except OSError:
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        return False
+
+    def resume_session(self):
+        # back on a new connection: take our seat again (only the moves we missed are sent), or keep watching
+        self.root.after(0, lambda: self.status_var.set("Đã kết nối lại"))
+        if self.spectating:
+            self.send({'code': Code.SPECTATE, 'payload': {'room_id': self.spectating}})
+        elif self.room_id and self.token:
+            # every stone on our board is one move of the current game
+            self.send({'code': Code.RESUME, 'payload': {'room_id': self.room_id, 'token': self.token, 'seq': len(self.board)}})
 
     def append_chat(self, text):
         def task():
@@ -163,7 +373,14 @@ class ClientApp:
         if not room_id:
             messagebox.showinfo("Thông báo", "Vui lòng nhập mã phòng.")
             return
-        send_msg(self.sock, {'code': Code.JOIN_ROOM, 'payload': {'action': 'JOIN', 'room_id': room_id}})
+        self.send({'code': Code.JOIN_ROOM, 'payload': {'action': 'JOIN', 'room_id': room_id}})
+
+    def spectate_room_by_id(self):
+        room_id = self.room_entry.get().strip()
+        if not room_id:
+            messagebox.showinfo("Thông báo", "Vui lòng nhập mã phòng.")
+            return
+        self.send({'code': Code.SPECTATE, 'payload': {'room_id': room_id}})
 
     def send_chat(self):
         text = self.chat_entry.get().strip()
@@ -171,21 +388,65 @@ class ClientApp:
         if not self.room_id:
             messagebox.showinfo("Thông báo", "Bạn chưa vào phòng.")
             return
-        send_msg(self.sock, {'code': Code.MESSAGE_CODE, 'payload': {'text': text}})
+        self.send({'code': Code.MESSAGE_CODE, 'payload': {'text': text}})
         self.append_chat(f"[You] {text}")
         self.chat_entry.delete(0, tk.END)
 
-    def create_room(self):
-        send_msg(self.sock, {'code': Code.JOIN_ROOM, 'payload': {'action': 'CREATE'}})
+    def picked_rules(self):
+        # {'size', 'win'} from the pickers, or None after telling the user the win length is invalid
+        try:
+            win = int(self.win_var.get())
+        except ValueError:
+            messagebox.showinfo("Thông báo", "Số quân thắng không hợp lệ.")
+            return None
+        return {'size': SIZE_CHOICES[self.size_var.get()], 'win': win}
+
+    def create_room(self, opponent=None):
+        rules = self.picked_rules()
+        if not rules:
+            return
+        payload = {'action': 'CREATE', **rules}
+        if opponent:
+            payload['opponent'] = opponent
+        self.send({'code': Code.JOIN_ROOM, 'payload': payload})
+
+    def create_ai_room(self):
+        self.create_room('ai')
+
+    def quick_match(self):
+        # join the oldest waiting room with the picked rules, or wait in a new one
+        rules = self.picked_rules()
+        if rules:
+            self.send({'code': Code.QUICK_MATCH, 'payload': rules})
+
+    def rated_match(self):
+        # wait for a rated game against a player of about our rating, or stop waiting
+        if self.queued:
+            self.send({'code': Code.MATCHMAKE, 'payload': {'action': 'LEAVE'}})
+            return
+        rules = self.picked_rules()
+        if rules:
+            self.send({'code': Code.MATCHMAKE, 'payload': {'action': 'JOIN', **rules}})
 
     def request_room_list(self):
-        send_msg(self.sock, {'code': Code.ROOM_CODE, 'payload': 'LIST'})
+        # subscribing again brings a fresh snapshot
+        self.send({'code': Code.LOBBY_SUBSCRIBE, 'payload': {'subscribe': True}})
 
-    def update_room_list(self, payload):
+    def apply_lobby_update(self, payload):
+        # edit the listbox in place: drop removed rooms, append added ones (a re-listed room moves to the end)
         def task():
-            self.room_listbox.delete(0, tk.END)
-            for r in payload:
-                self.room_listbox.insert(tk.END, r['room_id'])
+            if payload.get('snapshot'):
+                self.room_listbox.delete(0, tk.END)
+                self.room_ids = []
+            gone = set(payload.get('removed', []))
+            gone.update(r['room_id'] for r in payload.get('added', []))
+            for i in range(len(self.room_ids) - 1, -1, -1):
+                if self.room_ids[i] in gone:
+                    self.room_listbox.delete(i)
+                    del self.room_ids[i]
+            for r in payload.get('added', []):
+                self.room_ids.append(r['room_id'])
+                self.room_listbox.insert(tk.END, f"{r['room_id']}  ({size_label(r.get('size', 10))}, {r.get('win', 5)} quân)")
         self.root.after(0, task)
 
     def join_selected_room(self):
@@ -193,32 +454,40 @@ class ClientApp:
         if not sel:
             messagebox.showinfo("Thông báo", "Chọn phòng để join")
             return
-        room_id = self.room_listbox.get(sel[0])
-        send_msg(self.sock, {'code': Code.JOIN_ROOM, 'payload': {'action': 'JOIN', 'room_id': room_id}})
+        room_id = self.room_ids[sel[0]]
+        self.send({'code': Code.JOIN_ROOM, 'payload': {'action': 'JOIN', 'room_id': room_id}})
 
     def leave_room(self):
+        if self.spectating:
+            self.send({'code': Code.ROOM_LEAVE, 'payload': {}})
+            return
         if not self.room_id:
             messagebox.showinfo("Thông báo", "Bạn đang không ở trong phòng")
             return
-        send_msg(self.sock, {'code': Code.ROOM_LEAVE, 'payload': {}})
+        self.send({'code': Code.ROOM_LEAVE, 'payload': {}})
 
     def request_rematch(self):
         if not self.room_id:
             messagebox.showinfo("Thông báo", "Bạn chưa vào phòng")
             return
-        send_msg(self.sock, {'code': Code.MATCH_RESTART, 'payload': {'agree': True}})
+        self.send({'code': Code.MATCH_RESTART, 'payload': {'agree': True}})
 
     def request_draw(self):
         if not self.room_id:
             messagebox.showinfo("Thông báo", "Bạn chưa vào phòng")
             return
-        send_msg(self.sock, {'code': Code.MATCH_DRAW_REQUEST, 'payload': {}})
+        self.send({'code': Code.MATCH_DRAW_REQUEST, 'payload': {}})
 
     # --- handlers ---
     def handle_join_response(self, payload):
         status = payload.get('status')
         room_id = payload.get('room_id')
-        if status == 'WAIT':
+        self.token = payload.get('token', self.token)
+        if status == 'REJOINED':
+            self.resume_match(payload)
+        elif status == 'JOINED':
+            self.room_id = room_id
+        elif status == 'WAIT':
             self.room_id = room_id
             self.append_chat(f"[System] Tạo phòng thành công: {room_id}. Đang chờ đối thủ...")
             self.status_var.set(f"Đang chờ đối thủ trong phòng {room_id}")
@@ -226,17 +495,26 @@ class ClientApp:
             self.append_chat(f"[System] Join response: {payload}")
 
     def handle_match_start(self, payload):
+        self.set_queued(False)
+        ratings = payload.get('ratings')
+        if ratings:
+            you, opponent = payload.get('you'), payload.get('opponent')
+            self.append_chat(f"[System] Trận xếp hạng: bạn ({ratings.get(you)}) - đối thủ ({ratings.get(opponent)})")
         self.player_id = payload.get('you')
         self.opponent_id = payload.get('opponent')
         self.symbol = payload.get('symbol')
         self.room_id = payload.get('room_id')
-        self.board = [['' for _ in range(10)] for __ in range(10)]
+        size = payload.get('size', 10)
+        self.win = payload.get('win', 5)
+        self.board = {}
+        self.last_move = None
         self.in_match = True
+        self.set_clock(payload.get('clock'), payload.get('first_turn'))
         self.player_label.config(text=f"Player: {self.player_id} ({self.symbol})")
         def task():
-            for y in range(10):
-                for x in range(10):
-                    self.cells[y][x].configure(text=" ", state=tk.NORMAL)
+            self.root.title(f"Caro {size_label(size)} ({self.win} quân) - Client")
+            self.build_board(size)
+            self.redraw_board()
             if self.symbol == 'X':
                 self.status_var.set("Trận đấu bắt đầu. Đến lượt bạn.")
             else:
@@ -244,30 +522,176 @@ class ClientApp:
             messagebox.showinfo("Match start", f"Match started vs {self.opponent_id}. You are '{self.symbol}'")
         self.root.after(0, task)
 
-    def click_cell(self, x, y):
+    def resume_match(self, payload):
+        # back in a match the server recovered after a restart: rebuild the board from its moves
+        self.room_id = payload.get('room_id')
+        self.player_id = payload.get('player_id')
+        self.opponent_id = payload.get('opponent')
+        self.symbol = payload.get('symbol')
+        size = payload.get('size', 10)
+        self.win = payload.get('win', 5)
+        self.board = {(x, y): sym for x, y, sym in payload.get('moves', [])}
+        self.last_move = None
+        self.in_match = not payload.get('finished')
+        self.set_clock(payload.get('clock'), None if payload.get('finished') else payload.get('turn'))
+        self.player_label.config(text=f"Player: {self.player_id} ({self.symbol})")
+        def task():
+            self.root.title(f"Caro {size_label(size)} ({self.win} quân) - Client")
+            self.build_board(size)
+            self.redraw_board()
+            if payload.get('finished'):
+                self.status_var.set("Trận đấu đã kết thúc")
+            elif not payload.get('opponent_present'):
+                self.status_var.set("Đã vào lại phòng. Đang chờ đối thủ quay lại...")
+            elif payload.get('turn') == self.player_id:
+                self.status_var.set("Đến lượt bạn.")
+            else:
+                self.status_var.set("Đối thủ đang đi...")
+        self.root.after(0, task)
+
+    def handle_resume(self, payload):
+        if 'returned' in payload:
+            self.root.after(0, lambda: self.status_var.set("Đối thủ đã kết nối lại"))
+            return
+        if 'error' in payload:
+            # the seat is gone (held too long, or the room closed): back to the lobby
+            def reset():
+                self.append_chat(f"[System] Không thể vào lại phòng {payload.get('room_id')}: {payload['error']}")
+                self.room_id = None
+                self.token = None
+                self.in_match = False
+                self.board = {}
+                self.last_move = None
+                self.set_all_cells(text=" ", state=tk.DISABLED, bg=self.default_bg)
+                self.status_var.set("Chưa vào phòng")
+            self.root.after(0, reset)
+            return
+        # back in our seat: only the moves we missed while away
+        self.apply_missed(payload)
+
+    def request_sync(self):
+        # every stone on our board is one move of the current game
+        self.send({'code': Code.SYNC, 'payload': {'seq': len(self.board)}})
+
+    def handle_sync(self, payload):
+        # moves we missed, a page at a time; 'reset': our board was from another game
+        if payload.get('reset'):
+            self.board = {}
+        self.apply_missed(payload)
+        if payload.get('more'):
+            self.request_sync()
+
+    def apply_missed(self, payload):
+        # put the moves of a RESUME or SYNC reply on the board and show whose turn it is
+        missed = payload.get('moves', [])
+        for x, y, sym in missed:
+            self.board[(x, y)] = sym
+        self.in_match = not payload.get('finished')
+        if 'clock' in payload:
+            self.set_clock(payload['clock'], None if payload.get('finished') else payload.get('turn'))
+        def task():
+            self.redraw_board()
+            if missed:
+                self.last_move = tuple(missed[-1][:2])
+                self.center_on(*self.last_move)
+                self.highlight_last_move(*self.last_move)
+            result = payload.get('result') or {}
+            if result.get('draw'):
+                self.status_var.set("Hòa")
+            elif result.get('winner'):
+                if self.spectating:
+                    self.status_var.set(f"{result['winner']} thắng!")
+                else:
+                    self.status_var.set("Bạn thắng!" if result['winner'] == self.player_id else "Bạn thua!")
+            elif self.spectating:
+                self.status_var.set(f"Đang xem: {payload.get('turn')} đang đi")
+            elif payload.get('turn') == self.player_id:
+                self.status_var.set("Đến lượt bạn.")
+            else:
+                self.status_var.set("Đối thủ đang đi...")
+        self.root.after(0, task)
+
+    def handle_spectate(self, payload):
+        # a full snapshot of the watched room: on start, and whenever its players or match change
+        if not payload.get('closed'):
+            # on the receiver thread, before the moves that follow the snapshot are applied
+            board = {}
+            for sym, flat in (('X', payload.get('x', [])), ('O', payload.get('o', []))):
+                for i in range(0, len(flat), 2):
+                    board[(flat[i], flat[i + 1])] = sym
+            self.board = board
+            self.set_clock(payload.get('clock'), None if payload.get('finished') else payload.get('turn'))
+        def task():
+            if payload.get('closed'):
+                self.spectating = None
+                self.status_var.set("Phòng đã đóng")
+                return
+            self.spectating = payload.get('room_id')
+            self.in_match = False
+            self.player_id = None
+            self.symbol = None
+            size = payload.get('size', 10)
+            self.win = payload.get('win', 5)
+            self.last_move = None
+            self.root.title(f"Caro {size_label(size)} ({self.win} quân) - Xem trận")
+            self.build_board(size)
+            self.redraw_board()
+            players = " vs ".join(payload.get('players', []))
+            self.player_label.config(text=f"Đang xem phòng {self.spectating}")
+            self.status_var.set(f"Đang xem: {players}" if len(payload.get('players', [])) == 2 else "Đang chờ người chơi")
+        self.root.after(0, task)
+
+    def click_cell(self, vx, vy):
         if not self.in_match:
             messagebox.showinfo("Thông báo", "Chưa có trận đấu.")
             return
-        send_msg(self.sock, {'code': Code.MATCH_MOVE, 'payload': {'x': x, 'y': y}})
+        x, y = self.origin[0] + vx, self.origin[1] + vy
+        # seq: the moves we have seen. Sent while the opponent is thinking, the move is kept by the
+        # server and played as soon as the opponent has moved (if the cell is still free then).
+        seq = len(self.board)
+        self.send({'code': Code.MATCH_MOVE, 'payload': {'x': x, 'y': y, 'seq': seq}})
+        if seq % 2 != (0 if self.symbol == 'X' else 1):
+            self.status_var.set(f"Nước đi trước: ({x}, {y})")
 
     def highlight_last_move(self, x, y):
-        for row in self.cells:
-            for btn in row:
-                btn.configure(bg="SystemButtonFace")
-        if self.board[y][x] == self.symbol:
-            self.cells[y][x].configure(bg="lightgreen")
-        else:
-            self.cells[y][x].configure(bg="lightblue")
+        self.set_all_cells(bg=self.default_bg)
         self.last_move = (x, y)
+        btn = self.view_cell(x, y)
+        if btn is None:
+            return
+        if self.board.get((x, y)) == self.symbol:
+            btn.configure(bg="lightgreen")
+        else:
+            btn.configure(bg="lightblue")
 
     def handle_move(self, payload):
         x = payload.get('x'); y = payload.get('y'); sym = payload.get('symbol'); by = payload.get('by')
         winner = payload.get('winner', False)
-        self.board[y][x] = sym
+        seq = payload.get('seq')
+        if seq is not None:
+            if seq <= len(self.board):
+                # already on the board: the answer to a move we sent again
+                return
+            if seq > len(self.board) + 1:
+                # moves went missing in between
+                self.request_sync()
+                return
+        self.board[(x, y)] = sym
+        if self.clock is not None:
+            if 'clock' in payload:
+                self.clock_left[by] = payload['clock'] / 1000
+            self.clock_turn = None if winner else other_player(by)
+            self.clock_since = time.monotonic()
         def task():
-            self.cells[y][x].configure(text=sym, state=tk.DISABLED)
+            if self.view_cell(x, y) is None:
+                # keep the latest move in view on large and unbounded boards
+                self.last_move = (x, y)
+                self.center_on(x, y)
+            self.view_cell(x, y).configure(text=sym, state=tk.DISABLED)
             self.highlight_last_move(x, y)
-            if winner:
+            if self.spectating:
+                self.status_var.set(f"{by} ({sym}) thắng!" if winner else f"{by} ({sym}) vừa đi")
+            elif winner:
                 if by == self.player_id:
                     self.status_var.set("Bạn thắng!")
                     messagebox.showinfo("Kết quả", "Bạn thắng!")
@@ -289,23 +713,102 @@ class ClientApp:
         if 'request_from' in payload:
             from_id = payload['request_from']
             r = messagebox.askyesno("Yêu cầu chơi lại", f"Đối thủ ({from_id}) muốn chơi lại. Đồng ý?")
-            send_msg(self.sock, {'code': Code.MATCH_RESTART, 'payload': {'agree': r}})
+            self.send({'code': Code.MATCH_RESTART, 'payload': {'agree': r}})
         else:
+            # here, not in task: the new game's moves are numbered from an empty board
+            self.board = {}
+            if self.clock is not None:
+                # full clocks again; X moves first
+                x_player = self.player_id if self.symbol == 'X' else self.opponent_id
+                self.set_clock(self.clock, x_player if self.player_id else None)
             def task():
-                self.board = [['' for _ in range(10)] for __ in range(10)]
-                for y in range(10):
-                    for x in range(10):
-                        self.cells[y][x].configure(text=" ", state=tk.NORMAL)
+                self.last_move = None
+                self.in_match = True
+                self.redraw_board()
                 self.status_var.set("Ván mới bắt đầu")
                 messagebox.showinfo("Thông báo", "Ván mới bắt đầu")
             self.root.after(0, task)
 
+    def handle_timeout(self, payload):
+        # the player to move ran out of time
+        self.clock_turn = None
+        def task():
+            self.in_match = False
+            if self.spectating:
+                self.status_var.set(f"{payload.get('loser')} hết giờ, {payload.get('winner')} thắng!")
+                return
+            text = "Hết giờ! Bạn thua!" if payload.get('loser') == self.player_id else "Đối thủ hết giờ. Bạn thắng!"
+            self.status_var.set(text)
+            messagebox.showinfo("Kết quả", text)
+            self.ask_rematch_prompt()
+        self.root.after(0, task)
+
+    def handle_identify(self, payload):
+        if 'error' in payload:
+            # the server doesn't know our saved player (another server, or it is busy): keep it for the
+            # next connection; a rated game here plays as a new player that isn't saved
+            self.keep_profile = True
+            self.root.after(0, lambda: self.rating_var.set("Xếp hạng: không tải được hồ sơ"))
+            return
+        if 'key' in payload and not self.keep_profile:
+            save_profile(payload['user'], payload['key'])
+        self.show_rating(payload.get('rating'), payload.get('rd'))
+
+    def show_rating(self, rating, rd=None):
+        text = f"Xếp hạng: {rating:.0f}" + (f" (±{rd:.0f})" if rd is not None else "")
+        self.root.after(0, lambda: self.rating_var.set(text))
+
+    def set_queued(self, queued):
+        self.queued = queued
+        def task():
+            self.btn_rated.config(text="Hủy tìm trận" if queued else "Đấu xếp hạng")
+            if queued:
+                self.status_var.set("Đang tìm đối thủ cùng trình độ...")
+        self.root.after(0, task)
+
+    def handle_rating(self, payload):
+        # our new rating after a rated game
+        mine = (payload.get('ratings') or {}).get(self.player_id)
+        if mine:
+            self.show_rating(mine['rating'])
+            self.append_chat(f"[System] Điểm xếp hạng: {mine['rating']:.0f} ({mine['change']:+.0f})")
+
+    def set_clock(self, clock, turn):
+        # a game clock from the server ({'base', 'increment', 'move_time'} and maybe 'left'), or None
+        if clock is None:
+            self.clock = None
+        else:
+            self.clock = {k: clock.get(k, 0) for k in ('base', 'increment', 'move_time')}
+            base = self.clock['base']
+            self.clock_left = dict(clock.get('left') or {"Player 1": base, "Player 2": base})
+            self.clock_turn = turn
+            self.clock_since = time.monotonic()
+
+    def show_clock(self):
+        # both players' time, counting down for the player to move; runs on the UI thread
+        clock = self.clock
+        if clock is None:
+            self.clock_var.set("")
+        else:
+            spent = time.monotonic() - self.clock_since
+            parts = []
+            if clock.get('base'):
+                for name in ("Player 1", "Player 2"):
+                    left = self.clock_left.get(name, 0) - (spent if name == self.clock_turn else 0)
+                    parts.append(f"{name}: {format_clock(left)}")
+            if clock.get('move_time') and self.clock_turn:
+                parts.append(f"Nước đi: {format_clock(clock['move_time'] - spent)}")
+            self.clock_var.set("   ".join(parts))
+        self.root.after(CLOCK_REFRESH_MS, self.show_clock)
+
     def handle_opponent_left(self, payload):
+        if 'grace' in payload:
+            # dropped, not gone: the server holds its seat and the game goes on when it resumes
+            self.root.after(0, lambda: self.status_var.set("Đối thủ mất kết nối, đang chờ kết nối lại..."))
+            return
         def task():
             messagebox.showinfo("Thông báo", "Đối thủ đã rời trận. Trận đấu kết thúc.")
-            for y in range(10):
-                for x in range(10):
-                    self.cells[y][x].configure(state=tk.DISABLED)
+            self.set_all_cells(state=tk.DISABLED)
             self.in_match = False
             self.status_var.set("Đối thủ rời phòng")
         self.root.after(0, task)
@@ -315,20 +818,24 @@ class ClientApp:
             messagebox.showinfo("Thông báo", "Phòng đã bị rời. Quay về màn hình chọn phòng.")
             self.room_id = None
             self.in_match = False
-            for y in range(10):
-                for x in range(10):
-                    self.cells[y][x].configure(text=" ", state=tk.DISABLED)
+            self.board = {}
+            self.last_move = None
+            self.set_all_cells(text=" ", state=tk.DISABLED, bg=self.default_bg)
             self.status_var.set("Chưa vào phòng")
         self.root.after(0, task)
 
     def handle_leave_success(self, payload):
         def task():
-            messagebox.showinfo("Thông báo", "Bạn đã rời phòng thành công.")
+            if (payload or {}).get('reason') == 'inactive':
+                messagebox.showinfo("Thông báo", "Phòng đã bị đóng vì lâu không có hoạt động.")
+            else:
+                messagebox.showinfo("Thông báo", "Bạn đã rời phòng thành công.")
             self.room_id = None
+            self.spectating = None
             self.in_match = False
-            for y in range(10):
-                for x in range(10):
-                    self.cells[y][x].configure(text=" ", state=tk.DISABLED)
+            self.board = {}
+            self.last_move = None
+            self.set_all_cells(text=" ", state=tk.DISABLED, bg=self.default_bg)
             self.status_var.set("Chưa vào phòng")
         self.root.after(0, task)
 
@@ -336,17 +843,15 @@ class ClientApp:
         from_id = payload.get('from')
         r = messagebox.askyesno("Yêu cầu hòa", f"Đối thủ ({from_id}) yêu cầu hòa. Chấp nhận?")
         if r:
-            send_msg(self.sock, {'code': Code.MATCH_DRAW_ACCEPT, 'payload': {}})
+            self.send({'code': Code.MATCH_DRAW_ACCEPT, 'payload': {}})
         else:
-            send_msg(self.sock, {'code': Code.MATCH_DRAW_REJECT, 'payload': {}})
+            self.send({'code': Code.MATCH_DRAW_REJECT, 'payload': {}})
 
     def handle_draw_accept(self, payload):
         def task():
             messagebox.showinfo("Hòa", "Đối thủ đồng ý hòa. Trận đấu kết thúc: Hòa.")
             self.in_match = False
-            for y in range(10):
-                for x in range(10):
-                    self.cells[y][x].configure(state=tk.DISABLED)
+            self.set_all_cells(state=tk.DISABLED)
             self.status_var.set("Hòa")
         self.root.after(0, task)
 
@@ -358,7 +863,7 @@ class ClientApp:
     def ask_rematch_prompt(self):
         r = messagebox.askyesno("Chơi lại?", "Bạn có muốn chơi lại?")
         if r:
-            send_msg(self.sock, {'code': Code.MATCH_RESTART, 'payload': {'agree': True}})
+            self.send({'code': Code.MATCH_RESTART, 'payload': {'agree': True}})
 
     def on_server_disconnect(self):
         def task():
@@ -367,6 +872,7 @@ class ClientApp:
         self.root.after(0, task)
 
     def on_close(self):
+        self.closing = True
         try:
             if self.sock:
                 self.sock.close()
@@ -0,0 +1,60 @@
+# clock.py
+# Game clocks (time control). Each game with a time control has a Clock with both players' time:
+# - base: seconds on each player's clock at the start of a game (0: no game clock), plus `increment`
+#   seconds added after each of its moves (Fischer)
+# - per_move: seconds any single move may take (0: no limit), whatever is left on the clock
+# Only the player to move has a running clock, so a Clock keeps what each player had left when its
+# turn began and when the current turn began; nothing counts down in between. A player runs out of
+# time (flag fall) at deadline() seconds into its turn. The server keeps one timer for that per room,
+# in its timer wheel, moved on every move.
+import math
+
+def parse(text):
+    # "BASE+INC" (seconds, e.g. "300+5"), "BASE", or "0" for none -> (base, increment)
+    base, _, inc = str(text).partition('+')
+    base, inc = float(base), float(inc or 0)
+    if base < 0 or inc < 0 or math.isnan(base + inc):
+        raise ValueError(f"bad time control {text!r}")
+    return base, inc
+
+class Clock:
+    __slots__ = ('base', 'increment', 'per_move', 'left', 'since', 'timer')
+
+    def __init__(self, base, increment, per_move, now):
+        self.base = base
+        self.increment = increment
+        self.per_move = per_move
+        self.left = [None, base, base]   # seconds per player number, as of the start of its last turn
+        self.since = now                 # monotonic time the current turn began
+        self.timer = None                # wheel timer of the flag fall of the player to move
+
+    def settings(self):
+        # the time control as sent to clients
+        return {'base': self.base, 'increment': self.increment, 'move_time': self.per_move}
+
+    def deadline(self, num):
+        # seconds into its turn at which player `num` runs out of time
+        limits = []
+        if self.base:
+            limits.append(self.left[num])
+        if self.per_move:
+            limits.append(self.per_move)
+        return min(limits) if limits else math.inf
+
+    def press(self, num, now):
+        # player `num` has moved: stop its clock, add the increment and start the opponent's;
+        # returns the seconds it has left
+        if self.base:
+            self.left[num] = max(self.left[num] - (now - self.since), 0.0) + self.increment
+        self.since = now
+        return self.left[num]
+
+    def expired(self, num, now):
+        return now - self.since >= self.deadline(num)
+
+    def remaining(self, num, moving, now):
+        # seconds player `num` has left right now (its clock is running if `moving`), None without a game clock
+        if not self.base:
+            return None
+        left = self.left[num]
+        return max(left - (now - self.since), 0.0) if moving else left
@@ -0,0 +1,247 @@
+# cluster.py
+# Cluster mode (main.py --workers N, Linux): N forked worker processes, each a whole server (threaded
+# or asyncio) listening on the same port with SO_REUSEPORT, so the kernel spreads new connections
+# over them. A worker owns the rooms it creates, and the first character of a room id names it
+# (server.new_room_id); no room, lock or index is shared between processes:
+# - a connection asking for a room of another worker (JOIN, REJOIN, RESUME or SPECTATE by room id,
+#   or a QUICK_MATCH that finds nobody waiting here but somebody there) is handed to that worker: the
+#   socket itself goes over a Unix socket (SCM_RIGHTS) with the message and whatever the reader had
+#   already received, and the client never notices. Seated players never move, so a game is always
+#   played on one worker and a move never leaves its process.
+# - every lobby tick a worker sends the changes to its own waiting rooms to the others, so ROOM_LIST
+#   and LOBBY_UPDATE list the rooms of every worker
+# - the parent process only forks the workers, starts again one that dies, and stops them all on
+#   Ctrl-C or SIGTERM
+# Control sockets are SOCK_SEQPACKET, one listening socket per worker in a private temp directory and
+# one link to each peer, opened on first use (and again after the peer restarted). A packet is a kind
+# byte and a body:
+#   I {"shard"}                          first on a link: who is talking
+#   L {"added", "removed", "reset"}      lobby changes; a new link starts with the full lobby, reset
+#   H <header length> {state} <pending>  a connection (server.detach), its file descriptor attached
+import json
+import os
+import queue
+import shutil
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import logger
+import server
+from helper import safe_start_thread
+
+MAX_WORKERS = len(server.SHARD_DIGITS)
+MAX_PACKET = 128 * 1024  # within the default socket buffer, which bounds a SOCK_SEQPACKET message
+LOBBY_CHUNK = 500       # lobby entries per packet
+SEND_TIMEOUT = 2.0      # seconds a send to a peer may block before the link is dropped
+RELINK_INTERVAL = 1.0   # seconds between attempts to reach peers that are not linked
+RESTART_DELAY = 1.0     # seconds before a worker that died is started again
+
+_HEADER = struct.Struct('!I')
+
+def supported():
+    return hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT') and hasattr(socket, 'send_fds')
+
+def packet(kind, body):
+    return kind + json.dumps(body, separators=(',', ':')).encode('utf-8')
+
+class Peers:
+    # this worker's side of the control plane: links to the other workers, the listener for theirs
+    def __init__(self, rundir, shard, workers):
+        self.rundir = rundir
+        self.shard = shard
+        self.others = [i for i in range(workers) if i != shard]
+        self.links = {}                                      # shard -> connected socket
+        self.locks = {i: threading.Lock() for i in self.others}
+        self.changes = queue.Queue()                         # (added, removed) from the lobby ticks
+
+    def path(self, shard):
+        return os.path.join(self.rundir, f"shard-{shard}.sock")
+
+    def start(self):
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # left behind by this shard's previous worker, if it died
+        if os.path.exists(self.path(self.shard)):
+            os.unlink(self.path(self.shard))
+        srv.bind(self.path(self.shard))
+        srv.listen(len(self.others) + 1)
+        safe_start_thread(self.accept, (srv,))
+        safe_start_thread(self.publisher)
+        return self
+
+    # outgoing
+    def link(self, shard):
+        # caller holds self.locks[shard]; the link to `shard`, opened and introduced on first use
+        sock = self.links.get(shard)
+        if sock is not None:
+            return sock
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        sock.settimeout(SEND_TIMEOUT)
+        try:
+            sock.connect(self.path(shard))
+            sock.send(packet(b'I', {'shard': self.shard}))
+            # later changes follow on this link in order, so the copy ends up right
+            self.send_lobby(sock, server.local_lobby(), [], reset=True)
+        except OSError:
+            sock.close()
+            raise
+        self.links[shard] = sock
+        logger.info("peer_linked", peer=shard)
+        return sock
+
+    def drop(self, shard):
+        # caller holds self.locks[shard]
+        sock = self.links.pop(shard, None)
+        if sock is not None:
+            sock.close()
+            logger.warning("peer_unlinked", peer=shard)
+
+    def send_lobby(self, sock, added, removed, reset=False):
+        for i in range(0, max(len(added), len(removed), 1), LOBBY_CHUNK):
+            sock.send(packet(b'L', {'added': added[i:i + LOBBY_CHUNK], 'removed': removed[i:i + LOBBY_CHUNK],
+                                    'reset': reset and i == 0}))
+
+    def publish(self, added, removed):
+        # server.publish_lobby, called every lobby tick; the sending is done on the publisher thread
+        if added or removed:
+            self.changes.put((added, removed))
+
+    def publisher(self):
+        while True:
+            try:
+                added, removed = self.changes.get(timeout=RELINK_INTERVAL)
+            except queue.Empty:
+                added = removed = None
+            for shard in self.others:
+                with self.locks[shard]:
+                    try:
+                        fresh = shard not in self.links
+                        sock = self.link(shard)
+                        # a fresh link has just sent the whole lobby
+                        if added is not None and not fresh:
+                            self.send_lobby(sock, added, removed)
+                    except OSError:
+                        # not up (yet), or gone: it gets the whole lobby when it is back
+                        self.drop(shard)
+
+    def hand_off(self, shard, fd, state, pending):
+        # server.hand_off: pass connection `fd` to worker `shard`; True once it is on its way
+        try:
+            header = json.dumps(state, separators=(',', ':')).encode('utf-8')
+        except (TypeError, ValueError):
+            return False
+        data = b'H' + _HEADER.pack(len(header)) + header + pending
+        if len(data) > MAX_PACKET or shard not in self.locks:
+            return False
+        with self.locks[shard]:
+            # a link left over from before the peer restarted fails once; then try a fresh one
+            for _ in range(2):
+                try:
+                    socket.send_fds(self.link(shard), [data], [fd])
+                    return True
+                except OSError as e:
+                    self.drop(shard)
+                    error = e
+        logger.warning("handoff_failed", peer=shard, error=error)
+        return False
+
+    # incoming
+    def accept(self, srv):
+        while True:
+            conn, _ = srv.accept()
+            safe_start_thread(self.receive, (conn,))
+
+    def receive(self, conn):
+        peer = None
+        try:
+            while True:
+                data, fds, _, _ = socket.recv_fds(conn, MAX_PACKET, 1)
+                if not data:
+                    break
+                kind, body = data[:1], data[1:]
+                if kind == b'H' and fds:
+                    n = _HEADER.unpack_from(body)[0]
+                    state = json.loads(body[_HEADER.size:_HEADER.size + n])
+                    server.adopt(fds.pop(), state, body[_HEADER.size + n:])
+                elif kind == b'I':
+                    peer = json.loads(body)['shard']
+                elif kind == b'L' and peer is not None:
+                    msg = json.loads(body)
+                    server.call_soon(server.apply_remote_lobby, peer, msg['added'], msg['removed'], msg['reset'])
+                for fd in fds:
+                    os.close(fd)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("peer_receive_error", peer=peer, error=e)
+        finally:
+            conn.close()
+            if peer is not None:
+                # it stopped (or restarted): its rooms are gone until it links again
+                server.call_soon(server.apply_remote_lobby, peer, [], [], True)
+
+def worker(rundir, shard, workers, serve):
+    server.SHARD = shard
+    server.SHARDS = workers
+    logger.tags['worker'] = shard
+    peers = Peers(rundir, shard, workers).start()
+    server.hand_off = peers.hand_off
+    server.publish_lobby = peers.publish
+    serve(shard)
+
+def run(workers, serve):
+    # fork `workers` processes, each calling serve(shard) with the server set up as that shard, and
+    # keep them running until Ctrl-C or SIGTERM. The parent starts no threads, so forking it again
+    # to replace a worker is safe.
+    rundir = tempfile.mkdtemp(prefix="caro-cluster-")
+    children = {}   # pid -> shard
+
+    def spawn(shard):
+        pid = os.fork()
+        if pid == 0:
+            # a worker stops on SIGTERM like a single server does
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            status = 0
+            try:
+                worker(rundir, shard, workers, serve)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                logger.close()
+                os._exit(status)
+        children[pid] = shard
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for shard in range(workers):
+            spawn(shard)
+        while True:
+            pid, status = os.wait()
+            shard = children.pop(pid, None)
+            if shard is not None:
+                print(f"worker {shard} exited ({status}), restarting", file=sys.stderr)
+                time.sleep(RESTART_DELAY)
+                spawn(shard)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        shutil.rmtree(rundir, ignore_errors=True)
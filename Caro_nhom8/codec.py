@@ -0,0 +1,180 @@
+# codec.py
+# Wire protocol versions. Every frame keeps the 4-byte length prefix from common.py; only the body differs.
+#   PROTOCOL_JSON   (1): UTF-8 JSON {'code': ..., 'payload': ...}; the body always starts with '{'.
+#   PROTOCOL_BINARY (2): first byte is an integer opcode (always below '{'), then
+#       - a fixed struct layout if the opcode has FLAG_PACKED set (hot messages: moves, match start), or
+#       - the payload as JSON for everything else.
+# Connections start in JSON. A client that wants binary sends HELLO {'versions': [2, 1]} and the server
+# answers HELLO {'version': v} (still JSON), then sends protocol v frames from there on. decode_frame()
+# looks at the first byte, so either form is accepted at any time and JSON-only clients are unaffected.
+import json
+import struct
+from common import Code, pack_msg
+
+PROTOCOL_JSON = 1
+PROTOCOL_BINARY = 2
+SUPPORTED = (PROTOCOL_BINARY, PROTOCOL_JSON)  # preference order
+
+# opcode numbers are part of the protocol: append new codes, never renumber
+OPCODES = {
+    Code.JOIN_ROOM: 1,
+    Code.ROOM_CODE: 2,
+    Code.ROOM_LIST: 3,
+    Code.MESSAGE_CODE: 4,
+    Code.MATCH_START: 5,
+    Code.MATCH_MOVE: 6,
+    Code.MATCH_RESTART: 7,
+    Code.MATCH_LEFT: 8,
+    Code.ROOM_LEAVE: 9,
+    Code.ROOM_LEAVE_SUCCESS: 10,
+    Code.MATCH_DRAW_REQUEST: 11,
+    Code.MATCH_DRAW_ACCEPT: 12,
+    Code.MATCH_DRAW_REJECT: 13,
+    Code.ERROR: 14,
+    Code.HELLO: 15,
+    Code.QUICK_MATCH: 16,
+    Code.LOBBY_SUBSCRIBE: 17,
+    Code.LOBBY_UPDATE: 18,
+    Code.SPECTATE: 19,
+    Code.RESUME: 20,
+    Code.PING: 21,
+    Code.PONG: 22,
+    Code.SYNC: 23,
+    Code.MATCH_TIMEOUT: 24,
+    Code.IDENTIFY: 25,
+    Code.MATCHMAKE: 26,
+    Code.RATING: 27,
+}
+CODES = {op: code for code, op in OPCODES.items()}
+FLAG_PACKED = 0x40
+JSON_START = ord('{')
+
+SYMBOLS = {'X': 1, 'O': 2}
+SYMBOL_NAMES = {1: 'X', 2: 'O'}
+
+MOVE_REQUEST = struct.Struct('!hh')     # client -> server: x, y
+MOVE_EVENT = struct.Struct('!hhBBB')    # server -> both: x, y, symbol, by, winner
+# the same with the move's seq (moves seen, for a request), and an event with the ms left on the
+# mover's clock too; the body length tells the five apart
+MOVE_REQUEST_SEQ = struct.Struct('!hhI')
+MOVE_EVENT_SEQ = struct.Struct('!hhBBBI')
+MOVE_EVENT_CLOCK = struct.Struct('!hhBBBII')
+MATCH_START = struct.Struct('!BBBBBB')  # you, opponent, symbol, first_turn, size, win; room_id follows as UTF-8
+
+def negotiate(offered):
+    # highest version both sides support, JSON if there is none
+    for v in SUPPORTED:
+        if v in (offered or ()):
+            return v
+    return PROTOCOL_JSON
+
+def player_num(player_id):
+    # "Player 2" -> 2, or None if the id has no small-int form
+    if isinstance(player_id, str) and player_id.startswith("Player "):
+        n = player_id[7:]
+        if n.isdigit() and str(int(n)) == n and 0 < int(n) < 256:
+            return int(n)
+    return None
+
+def _coord(v):
+    return isinstance(v, int) and not isinstance(v, bool) and -32768 <= v < 32768
+
+def _seq(v):
+    return isinstance(v, int) and not isinstance(v, bool) and 0 <= v < 1 << 32
+
+# packers return None when a payload doesn't fit the fixed layout exactly; it then goes out as JSON
+def _pack_move(p):
+    if not isinstance(p, dict) or not (_coord(p.get('x')) and _coord(p.get('y'))):
+        return None
+    keys = p.keys()
+    if keys == {'x', 'y'}:
+        return MOVE_REQUEST.pack(p['x'], p['y'])
+    if keys == {'x', 'y', 'seq'}:
+        return MOVE_REQUEST_SEQ.pack(p['x'], p['y'], p['seq']) if _seq(p['seq']) else None
+    if keys == {'x', 'y', 'symbol', 'by', 'winner'} or keys == {'x', 'y', 'symbol', 'by', 'winner', 'seq'} or \
+            keys == {'x', 'y', 'symbol', 'by', 'winner', 'seq', 'clock'}:
+        sym = SYMBOLS.get(p['symbol'])
+        by = player_num(p['by'])
+        if not (sym and by and isinstance(p['winner'], bool)):
+            return None
+        if 'seq' not in p:
+            return MOVE_EVENT.pack(p['x'], p['y'], sym, by, p['winner'])
+        if not _seq(p['seq']):
+            return None
+        if 'clock' not in p:
+            return MOVE_EVENT_SEQ.pack(p['x'], p['y'], sym, by, p['winner'], p['seq'])
+        if _seq(p['clock']):
+            return MOVE_EVENT_CLOCK.pack(p['x'], p['y'], sym, by, p['winner'], p['seq'], p['clock'])
+    return None
+
+def _unpack_move(b):
+    n = len(b)
+    if n == MOVE_REQUEST.size:
+        x, y = MOVE_REQUEST.unpack(b)
+        return {'x': x, 'y': y}
+    if n == MOVE_REQUEST_SEQ.size:
+        x, y, seq = MOVE_REQUEST_SEQ.unpack(b)
+        return {'x': x, 'y': y, 'seq': seq}
+    if n == MOVE_EVENT.size:
+        x, y, sym, by, winner = MOVE_EVENT.unpack(b)
+        return {'x': x, 'y': y, 'symbol': SYMBOL_NAMES[sym], 'by': f"Player {by}", 'winner': bool(winner)}
+    if n == MOVE_EVENT_SEQ.size:
+        x, y, sym, by, winner, seq = MOVE_EVENT_SEQ.unpack(b)
+        return {'x': x, 'y': y, 'symbol': SYMBOL_NAMES[sym], 'by': f"Player {by}", 'winner': bool(winner), 'seq': seq}
+    x, y, sym, by, winner, seq, clock = MOVE_EVENT_CLOCK.unpack(b)
+    return {'x': x, 'y': y, 'symbol': SYMBOL_NAMES[sym], 'by': f"Player {by}", 'winner': bool(winner), 'seq': seq,
+            'clock': clock}
+
+def _small(v):
+    return isinstance(v, int) and not isinstance(v, bool) and 0 <= v < 256
+
+def _pack_start(p):
+    if not isinstance(p, dict) or p.keys() != {'you', 'opponent', 'symbol', 'room_id', 'first_turn', 'size', 'win'}:
+        return None
+    nums = [player_num(p['you']), player_num(p['opponent']), SYMBOLS.get(p['symbol']), player_num(p['first_turn'])]
+    if None in nums or not isinstance(p['room_id'], str) or not (_small(p['size']) and _small(p['win'])):
+        return None
+    return MATCH_START.pack(*nums, p['size'], p['win']) + p['room_id'].encode('utf-8')
+
+def _unpack_start(b):
+    you, opp, sym, first, size, win = MATCH_START.unpack(b[:MATCH_START.size])
+    return {'you': f"Player {you}", 'opponent': f"Player {opp}", 'symbol': SYMBOL_NAMES[sym],
+            'room_id': str(b[MATCH_START.size:], 'utf-8'), 'first_turn': f"Player {first}", 'size': size, 'win': win}
+
+PACKERS = {Code.MATCH_MOVE: _pack_move, Code.MATCH_START: _pack_start}
+UNPACKERS = {Code.MATCH_MOVE: _unpack_move, Code.MATCH_START: _unpack_start}
+
+def encode_body(msg: dict, protocol=PROTOCOL_JSON) -> bytes:
+    code = msg.get('code')
+    if protocol != PROTOCOL_BINARY or code not in OPCODES:
+        return json.dumps(msg, ensure_ascii=False).encode('utf-8')
+    payload = msg.get('payload')
+    packer = PACKERS.get(code)
+    packed = packer(payload) if packer else None
+    if packed is not None:
+        return bytes((OPCODES[code] | FLAG_PACKED,)) + packed
+    if payload is None:
+        return bytes((OPCODES[code],))
+    return bytes((OPCODES[code],)) + json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+def encode_frame(msg: dict, protocol=PROTOCOL_JSON) -> bytes:
+    # length-prefixed frame ready for sendall()
+    if protocol != PROTOCOL_BINARY:
+        return pack_msg(msg)
+    body = encode_body(msg, protocol)
+    return struct.pack('!I', len(body)) + body
+
+def decode_frame(body) -> dict:
+    # decode one frame body (bytes or memoryview) of either protocol
+    if not len(body):
+        raise ValueError("empty frame")
+    op = body[0]
+    if op == JSON_START:
+        return json.loads(str(body, 'utf-8'))
+    code = CODES.get(op & ~FLAG_PACKED)
+    if code is None:
+        raise ValueError(f"unknown opcode {op}")
+    if op & FLAG_PACKED:
+        return {'code': code, 'payload': UNPACKERS[code](body[1:])}
+    rest = body[1:]
+    return {'code': code, 'payload': json.loads(str(rest, 'utf-8')) if len(rest) else None}
@@ -1,4 +1,5 @@
 # common.py
+import asyncio
 import json
 import struct
 import socket
@@ -19,32 +20,143 @@ class Code:
     MATCH_DRAW_ACCEPT = "MATCH_DRAW_ACCEPT"
     MATCH_DRAW_REJECT = "MATCH_DRAW_REJECT"
     ERROR = "ERROR"                  # server -> client: error
+    HELLO = "HELLO"                  # client <-> server: wire protocol negotiation (see codec.py)
+    QUICK_MATCH = "QUICK_MATCH"      # client -> server: join the oldest waiting room, or create one and wait
+    LOBBY_SUBSCRIBE = "LOBBY_SUBSCRIBE"  # client -> server: start/stop receiving LOBBY_UPDATE pushes
+    LOBBY_UPDATE = "LOBBY_UPDATE"    # server -> subscriber: waiting-room snapshot, then batched added/removed deltas
+    SPECTATE = "SPECTATE"            # client -> server: watch a room; server -> spectator: room snapshot
+    RESUME = "RESUME"                # client -> server: back after a drop; server -> client: the moves missed
+    PING = "PING"                    # either way: are you there? (the server sends it to silent connections)
+    PONG = "PONG"                    # reply to PING, echoing its payload
+    SYNC = "SYNC"                    # client -> server: the moves after seq N; server -> client: them, a page at a time
+    MATCH_TIMEOUT = "MATCH_TIMEOUT"  # server -> both: the player to move ran out of time and lost
+    IDENTIFY = "IDENTIFY"            # client -> server: who we are (user id + key, or none yet); server -> client: profile
+    MATCHMAKE = "MATCHMAKE"          # client -> server: wait for / stop waiting for a rated game; server -> client: status
+    RATING = "RATING"                # server -> both: new ratings after a rated game
+
+# largest frame body accepted from a peer; a bigger length header is treated as a protocol error
+MAX_FRAME = 1024 * 1024
 
 # utility to send/receive JSON messages with 4-byte length prefix
-def send_msg(sock: socket.socket, obj: dict):
+def pack_msg(obj: dict) -> bytes:
     b = json.dumps(obj, ensure_ascii=False).encode('utf-8')
     header = struct.pack('!I', len(b))
-    sock.sendall(header + b)
+    return header + b
 
-def recv_msg(sock: socket.socket):
-    # read 4 bytes length
+def send_msg(sock: socket.socket, obj: dict):
+    sock.sendall(pack_msg(obj))
+
+def recv_msg(sock: socket.socket, max_frame: int = MAX_FRAME):
+    # one message per call; long-lived connections should use FrameReader instead
     header = recvn(sock, 4)
     if not header:
         return None
     length = struct.unpack('!I', header)[0]
+    if length > max_frame:
+        raise ValueError(f"frame of {length} bytes exceeds limit {max_frame}")
     body = recvn(sock, length)
     if not body:
         return None
     return json.loads(body.decode('utf-8'))
 
 def recvn(sock: socket.socket, n: int):
-    data = b''
-    while len(data) < n:
+    data = bytearray(n)
+    view = memoryview(data)
+    got = 0
+    while got < n:
         try:
-            chunk = sock.recv(n - len(data))
+            k = sock.recv_into(view[got:])
         except ConnectionResetError:
             return None
-        if not chunk:
+        if not k:
             return None
-        data += chunk
-    return data
+        got += k
+    return bytes(data)
+
+class FrameReader:
+    # Buffered reader for one connection: each recv_into() pulls whatever the kernel has into a
+    # reusable bytearray, then every complete length-prefixed frame in it is handed out as a
+    # memoryview slice (valid until the next read), so small messages cost one syscall per batch
+    # rather than two per message, and bytes are never concatenated.
+    def __init__(self, sock: socket.socket, bufsize: int = 64 * 1024, max_frame: int = MAX_FRAME, data: bytes = b''):
+        # data: bytes already read from the socket elsewhere (a connection handed over by another worker)
+        self.sock = sock
+        self.max_frame = max_frame
+        self.buf = bytearray(max(bufsize, len(data)))
+        self.buf[:len(data)] = data
+        self.start = 0   # first unread byte
+        self.end = len(data)   # one past the last received byte
+
+    def pending(self) -> bytes:
+        # bytes received but not yet handed out as frames
+        return bytes(self.buf[self.start:self.end])
+
+    def _fill(self, need):
+        # make room for at least `need` bytes from self.start, then read once; False on EOF
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif len(self.buf) - self.start < need:
+            # move the partial frame to the front, growing the buffer only for a large frame
+            pending = self.end - self.start
+            if need > len(self.buf):
+                new_buf = bytearray(need)
+                new_buf[:pending] = self.buf[self.start:self.end]
+                self.buf = new_buf
+            else:
+                self.buf[:pending] = self.buf[self.start:self.end]
+            self.start, self.end = 0, pending
+        try:
+            k = self.sock.recv_into(memoryview(self.buf)[self.end:])
+        except ConnectionResetError:
+            return False
+        if not k:
+            return False
+        self.end += k
+        return True
+
+    def frames(self):
+        # yield frame bodies as memoryviews until the peer closes the connection
+        while True:
+            view = memoryview(self.buf)
+            while self.end - self.start >= 4:
+                length = struct.unpack_from('!I', self.buf, self.start)[0]
+                if length > self.max_frame:
+                    raise ValueError(f"frame of {length} bytes exceeds limit {self.max_frame}")
+                if self.end - self.start < 4 + length:
+                    break
+                body = view[self.start + 4:self.start + 4 + length]
+                self.start += 4 + length
+                yield body
+            need = 4
+            if self.end - self.start >= 4:
+                need = 4 + struct.unpack_from('!I', self.buf, self.start)[0]
+            view.release()
+            if not self._fill(need):
+                return
+
+    def messages(self):
+        # yield decoded JSON messages until the peer closes the connection
+        for body in self.frames():
+            yield json.loads(str(body, 'utf-8'))
+
+# asyncio equivalents of send_msg / recv_msg, same wire format
+async def async_send_msg(writer: asyncio.StreamWriter, obj: dict):
+    writer.write(pack_msg(obj))
+    await writer.drain()
+
+async def async_recv_frame(reader: asyncio.StreamReader):
+    # one raw frame body, or None on EOF
+    try:
+        header = await reader.readexactly(4)
+        length = struct.unpack('!I', header)[0]
+        if length > MAX_FRAME:
+            raise ValueError(f"frame of {length} bytes exceeds limit {MAX_FRAME}")
+        return await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        return None
+
+async def async_recv_msg(reader: asyncio.StreamReader):
+    body = await async_recv_frame(reader)
+    if body is None:
+        return None
+    return json.loads(body.decode('utf-8'))
@@ -0,0 +1,262 @@
+# headless.py
+# Protocol clients without a window, for scripts, tests and load generation (benchmarks/loadgen.py).
+# They speak the same messages as the Tkinter client (client.py), with the Code values from common.py.
+# - Client: blocking, one socket, on common.send_msg / recv_msg (JSON).
+# - AsyncClient: asyncio; a reader task decodes frames (JSON, or binary after HELLO) as they arrive.
+# Both keep messages nobody is waiting for in a small per-code inbox, so expect(code) also finds a
+# message that arrived before it was called. The inbox is bounded: unsolicited pushes (chat, lobby
+# updates) never grow memory. Both answer the server's PING as they read, like the GUI client.
+# An ERROR that arrives while a call waits for something else ends the wait with ServerError, so a
+# refused request fails at once with the server's reason rather than timing out.
+import asyncio
+import socket
+from collections import defaultdict, deque
+from common import Code, send_msg, recv_msg, async_recv_frame
+from codec import PROTOCOL_JSON, SUPPORTED, decode_frame, encode_frame
+
+INBOX_LIMIT = 64   # messages kept per code for a later expect()
+TIMEOUT = 10.0     # seconds an AsyncClient waits for an expected message by default
+
+class ServerError(Exception):
+    # the server answered with ERROR; payload is its message
+    def __init__(self, payload):
+        super().__init__(payload)
+        self.payload = payload
+
+def join_payload(action, **fields):
+    return {'action': action, **{k: v for k, v in fields.items() if v is not None}}
+
+def move_payload(x, y, seq=None):
+    return {'x': x, 'y': y} if seq is None else {'x': x, 'y': y, 'seq': seq}
+
+class Client:
+    def __init__(self, host="127.0.0.1", port=5000, timeout=10.0):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.inbox = defaultdict(lambda: deque(maxlen=INBOX_LIMIT))
+
+    def send(self, code, payload=None):
+        send_msg(self.sock, {'code': code, 'payload': payload})
+
+    def expect(self, code, pred=None):
+        # payload of the next `code` message (matching pred); other messages go to the inbox
+        box = self.inbox[code]
+        for payload in box:
+            if pred is None or pred(payload):
+                box.remove(payload)
+                return payload
+        while True:
+            msg = recv_msg(self.sock)
+            if msg is None:
+                raise ConnectionError("server closed the connection")
+            payload = msg.get('payload')
+            if msg.get('code') == code and (pred is None or pred(payload)):
+                return payload
+            if msg.get('code') == Code.PING:
+                self.send(Code.PONG, payload)
+                continue
+            if msg.get('code') == Code.ERROR:
+                raise ServerError(payload)
+            self.inbox[msg.get('code')].append(payload)
+
+    def create_room(self, size=None, win=None, opponent=None):
+        self.send(Code.JOIN_ROOM, join_payload('CREATE', size=size, win=win, opponent=opponent))
+        return self.expect(Code.JOIN_ROOM)
+
+    def join_room(self, room_id):
+        self.send(Code.JOIN_ROOM, join_payload('JOIN', room_id=room_id))
+        return self.expect(Code.JOIN_ROOM)
+
+    def quick_match(self):
+        self.send(Code.QUICK_MATCH, {})
+        return self.expect(Code.JOIN_ROOM)
+
+    def identify(self, user=None, key=None):
+        # our profile; a new player (with its 'key', given out this once) unless user and key are given
+        self.send(Code.IDENTIFY, {'user': user, 'key': key} if user else {})
+        return self.expect(Code.IDENTIFY)
+
+    def matchmake(self, size=None, win=None):
+        # wait for a rated game: the QUEUED reply now, then JOIN_ROOM and MATCH_START once paired
+        self.send(Code.MATCHMAKE, join_payload('JOIN', size=size, win=win))
+        return self.expect(Code.MATCHMAKE)
+
+    def cancel_matchmake(self):
+        self.send(Code.MATCHMAKE, {'action': 'LEAVE'})
+        return self.expect(Code.MATCHMAKE)
+
+    def move(self, x, y, seq=None):
+        # our move as echoed back to us by the server; with seq (the moves we have seen) a move made
+        # before the opponent's is echoed once it has been played after it
+        self.send(Code.MATCH_MOVE, move_payload(x, y, seq))
+        return self.expect(Code.MATCH_MOVE, lambda p: p.get('x') == x and p.get('y') == y)
+
+    def sync(self, seq):
+        # the moves of the current game after the first `seq`
+        self.send(Code.SYNC, {'seq': seq})
+        return self.expect(Code.SYNC)
+
+    def chat(self, text):
+        self.send(Code.MESSAGE_CODE, {'text': text})
+
+    def leave(self):
+        self.send(Code.ROOM_LEAVE, {})
+        return self.expect(Code.ROOM_LEAVE_SUCCESS)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class AsyncClient:
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.protocol = PROTOCOL_JSON
+        self.inbox = defaultdict(lambda: deque(maxlen=INBOX_LIMIT))
+        self.waiters = defaultdict(list)   # code -> [(pred, future, tagged)]
+        self.closed = False
+        self.task = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def connect(self, host="127.0.0.1", port=5000, binary=False):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        sock = self.writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.task = asyncio.ensure_future(self.read())
+        if binary:
+            # until the server answers, keep talking JSON
+            await self.send(Code.HELLO, {'versions': list(SUPPORTED)})
+            self.protocol = (await self.expect(Code.HELLO)).get('version', PROTOCOL_JSON)
+        return self
+
+    async def send(self, code, payload=None):
+        frame = encode_frame({'code': code, 'payload': payload}, self.protocol)
+        self.bytes_out += len(frame)
+        self.writer.write(frame)
+        await self.writer.drain()
+
+    async def read(self):
+        try:
+            while True:
+                body = await async_recv_frame(self.reader)
+                if body is None:
+                    break
+                self.bytes_in += 4 + len(body)
+                msg = decode_frame(body)
+                self.route(msg.get('code'), msg.get('payload'))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.closed = True
+            self.fail_waiters(ConnectionError("server closed the connection"))
+            self.waiters.clear()
+
+    def route(self, code, payload):
+        if code == Code.PING:
+            frame = encode_frame({'code': Code.PONG, 'payload': payload}, self.protocol)
+            self.bytes_out += len(frame)
+            self.writer.write(frame)
+            return
+        waiters = self.waiters.get(code)
+        if waiters:
+            for i, (pred, future, tagged) in enumerate(waiters):
+                if not future.done() and (pred is None or pred(payload)):
+                    del waiters[i]
+                    future.set_result((code, payload) if tagged else payload)
+                    return
+        if code == Code.ERROR and self.fail_waiters(ServerError(payload)):
+            return
+        self.inbox[code].append(payload)
+
+    def fail_waiters(self, error):
+        # end every pending wait with error; False if nothing was waiting
+        failed = False
+        for waiters in self.waiters.values():
+            for _, future, _ in waiters:
+                if not future.done():
+                    future.set_exception(error)
+                    failed = True
+        return failed
+
+    async def expect(self, code, pred=None, timeout=None):
+        # payload of the next `code` message (matching pred)
+        return await self.expect_first({code: pred}, timeout, tagged=False)
+
+    async def expect_first(self, preds, timeout=None, tagged=True):
+        # (code, payload) of the first message matching one of {code: pred or None}, e.g. the
+        # opponent's move or its leaving, whichever comes first
+        for code, pred in preds.items():
+            box = self.inbox[code]
+            for payload in box:
+                if pred is None or pred(payload):
+                    box.remove(payload)
+                    return (code, payload) if tagged else payload
+        if self.closed:
+            raise ConnectionError("server closed the connection")
+        future = asyncio.get_running_loop().create_future()
+        entries = []
+        for code, pred in preds.items():
+            entry = (pred, future, tagged)
+            self.waiters[code].append(entry)
+            entries.append((code, entry))
+        try:
+            return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        finally:
+            for code, entry in entries:
+                waiters = self.waiters.get(code)
+                if waiters and entry in waiters:
+                    waiters.remove(entry)
+
+    async def create_room(self, size=None, win=None, opponent=None):
+        await self.send(Code.JOIN_ROOM, join_payload('CREATE', size=size, win=win, opponent=opponent))
+        return await self.expect(Code.JOIN_ROOM)
+
+    async def join_room(self, room_id):
+        await self.send(Code.JOIN_ROOM, join_payload('JOIN', room_id=room_id))
+        return await self.expect(Code.JOIN_ROOM)
+
+    async def quick_match(self):
+        await self.send(Code.QUICK_MATCH, {})
+        return await self.expect(Code.JOIN_ROOM)
+
+    async def identify(self, user=None, key=None):
+        await self.send(Code.IDENTIFY, {'user': user, 'key': key} if user else {})
+        return await self.expect(Code.IDENTIFY)
+
+    async def matchmake(self, size=None, win=None):
+        await self.send(Code.MATCHMAKE, join_payload('JOIN', size=size, win=win))
+        return await self.expect(Code.MATCHMAKE)
+
+    async def cancel_matchmake(self):
+        await self.send(Code.MATCHMAKE, {'action': 'LEAVE'})
+        return await self.expect(Code.MATCHMAKE)
+
+    async def move(self, x, y, seq=None):
+        await self.send(Code.MATCH_MOVE, move_payload(x, y, seq))
+        return await self.expect(Code.MATCH_MOVE, lambda p: p.get('x') == x and p.get('y') == y)
+
+    async def sync(self, seq):
+        await self.send(Code.SYNC, {'seq': seq})
+        return await self.expect(Code.SYNC)
+
+    async def chat(self, text):
+        await self.send(Code.MESSAGE_CODE, {'text': text})
+
+    async def leave(self):
+        await self.send(Code.ROOM_LEAVE, {})
+        return await self.expect(Code.ROOM_LEAVE_SUCCESS)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
@@ -0,0 +1,268 @@
+# journal.py
+# Append-only binary journal of room lifecycle events and moves, so games in progress survive a
+# server restart.
+# - handlers append encoded records to an in-memory batch (under their room lock, which keeps each
+#   room's records in order); a journal thread writes the batch and fsyncs it once per flush interval
+#   (group commit), so no handler ever waits on disk. A crash loses at most the last interval.
+# - every record carries its room's sequence number. Each compact snapshot starts a new log segment:
+#   the old log is closed, then every live room is written out as the records that rebuild it, and
+#   log records with a sequence number the snapshot already covers are skipped on replay.
+# - files: snapshot-<gen>.bin (complete, written via rename) and log-<gen>.bin for gen >= it.
+# Record frame: body length (uint16), crc32 of the body (uint32), then the body: type, room id,
+# room seq, and the type's fields. A torn or corrupt record ends the replay of its file.
+import os
+import struct
+import threading
+import time
+import zlib
+import logger
+from helper import safe_start_thread
+
+FLUSH_INTERVAL = 0.05        # seconds between group commits; 0 commits as soon as anything is appended
+GROUP_BYTES = 64 * 1024      # ... or sooner, once this much is waiting
+SNAPSHOT_INTERVAL = 300.0    # seconds between compact snapshots
+
+_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0)
+
+# record types
+CREATE, SEAT, START, MOVE, DRAW, LEAVE, CLOSE, FLAG, USER, FORFEIT = range(1, 11)
+
+# CREATE flags
+PRIVATE, RATED = 1, 2
+
+_FRAME = struct.Struct('=HI')    # body length, crc32
+_HEAD = struct.Struct('=B6sI')   # type, room id, room seq
+_FIELDS = {
+    CREATE: struct.Struct('=BBB'),  # size, win, flags
+    SEAT: struct.Struct('=BB8s'),   # player, is a bot, rejoin token
+    START: struct.Struct('=B'),     # player with X, who moves first
+    MOVE: struct.Struct('=Bhh'),    # player, x, y (board.COORD_LIMIT fits int16)
+    DRAW: struct.Struct(''),
+    LEAVE: struct.Struct('=B'),     # player
+    CLOSE: struct.Struct(''),
+    FLAG: struct.Struct('=B'),      # player who ran out of time
+    USER: struct.Struct('=B12s'),   # player, its user id (ratings.py), in a rated room
+    FORFEIT: struct.Struct('=B'),   # player who left a rated game before it ended
+}
+
+def encode(kind, room_id, seq, *fields):
+    body = _HEAD.pack(kind, room_id.encode('ascii'), seq) + _FIELDS[kind].pack(*fields)
+    return _FRAME.pack(len(body), zlib.crc32(body)) + body
+
+def read_records(path):
+    # (type, room id, seq, fields) of every intact record in a file, up to the first bad one
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return
+    pos = 0
+    while pos + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, pos)
+        body = data[pos + _FRAME.size:pos + _FRAME.size + length]
+        if len(body) != length or zlib.crc32(body) != crc or length < _HEAD.size:
+            return
+        kind, room_id, seq = _HEAD.unpack_from(body)
+        fields = _FIELDS.get(kind)
+        if fields is None or length != _HEAD.size + fields.size:
+            return
+        yield kind, room_id.rstrip(b'\0').decode('ascii'), seq, fields.unpack_from(body, _HEAD.size)
+        pos += _FRAME.size + length
+
+def apply(logs, kind, room_id, seq, fields, snapshot=False):
+    # fold one record into {room_id: room log}; a room log is a plain dict the server rebuilds a room from.
+    # A snapshot writes each room's records at its current seq, so they are applied unconditionally.
+    room = logs.get(room_id)
+    if kind == CREATE:
+        if room is not None and seq <= room['seq'] and not snapshot:
+            return
+        size, win, flags = fields
+        logs[room_id] = {'seq': seq, 'size': size, 'win': win, 'private': bool(flags & PRIVATE),
+                         'rated': bool(flags & RATED), 'seats': {}, 'users': {}, 'first': None, 'moves': [],
+                         'draw': False, 'flag': None, 'forfeit': None}
+        return
+    if room is None or (seq <= room['seq'] and not snapshot):
+        return
+    room['seq'] = seq
+    if kind == SEAT:
+        player, bot, token = fields
+        room['seats'][player] = (token.decode('ascii'), bool(bot))
+    elif kind == START:
+        room['first'] = fields[0]
+        room['moves'] = []
+        room['draw'] = False
+        room['flag'] = None
+        room['forfeit'] = None
+    elif kind == MOVE:
+        room['moves'].append(fields)
+    elif kind == DRAW:
+        room['draw'] = True
+    elif kind == FLAG:
+        room['flag'] = fields[0]
+    elif kind == FORFEIT:
+        room['forfeit'] = fields[0]
+    elif kind == USER:
+        room['users'][fields[0]] = fields[1].decode('ascii')
+    elif kind == LEAVE:
+        room['seats'].pop(fields[0], None)
+        room['users'].pop(fields[0], None)
+    elif kind == CLOSE:
+        del logs[room_id]
+
+def generations(directory):
+    # {'snapshot': [gen, ...], 'log': [gen, ...]}, ascending
+    found = {'snapshot': [], 'log': []}
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return found
+    for name in names:
+        stem, dot, ext = name.partition('.')
+        kind, _, gen = stem.partition('-')
+        if ext == 'bin' and kind in found and gen.isdigit():
+            found[kind].append(int(gen))
+    found['snapshot'].sort()
+    found['log'].sort()
+    return found
+
+def sync_dir(directory):
+    # make a rename durable; directories can't be opened for this on Windows
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def file_path(directory, kind, gen):
+    return os.path.join(directory, f"{kind}-{gen:08d}.bin")
+
+def replay(directory):
+    # (room logs, last generation) rebuilt from the newest snapshot and every log segment after it
+    found = generations(directory)
+    base = found['snapshot'][-1] if found['snapshot'] else 0
+    logs = {}
+    if found['snapshot']:
+        for record in read_records(file_path(directory, 'snapshot', base)):
+            apply(logs, *record, snapshot=True)
+    last = base
+    for gen in found['log']:
+        if gen >= base:
+            for record in read_records(file_path(directory, 'log', gen)):
+                apply(logs, *record)
+            last = gen
+    return logs, last
+
+class Journal:
+    def __init__(self, directory, snapshot_fn, gen=0, flush_interval=FLUSH_INTERVAL,
+                 snapshot_interval=SNAPSHOT_INTERVAL):
+        # snapshot_fn() returns the encoded records of every live room; it is called on the journal thread
+        self.directory = directory
+        self.snapshot_fn = snapshot_fn
+        self.gen = gen
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.pending = []
+        self.pending_bytes = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        self.fd = None
+        # totals, for benchmarks
+        self.records = 0
+        self.bytes = 0
+        self.fsyncs = 0
+        self.snapshots = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        # begin with a snapshot, so what was just recovered no longer depends on the older files
+        self.snapshot()
+        self.thread = safe_start_thread(self.run, ())
+        return self
+
+    def append(self, record):
+        with self.cond:
+            self.pending.append(record)
+            self.pending_bytes += len(record)
+            if self.pending_bytes >= GROUP_BYTES or not self.flush_interval:
+                self.cond.notify()
+
+    def take(self):
+        with self.cond:
+            batch = self.pending
+            self.pending = []
+            self.pending_bytes = 0
+        return batch
+
+    def write(self, batch):
+        if not batch:
+            return
+        data = b''.join(batch)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+        os.fsync(self.fd)
+        self.records += len(batch)
+        self.bytes += len(data)
+        self.fsyncs += 1
+
+    def run(self):
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while True:
+            with self.cond:
+                if not self.closed and self.pending_bytes < GROUP_BYTES:
+                    if self.flush_interval:
+                        self.cond.wait(self.flush_interval)
+                    elif not self.pending:
+                        # woken by the next append; time out now and then to check the snapshot clock
+                        self.cond.wait(1.0)
+                closed = self.closed
+            try:
+                self.write(self.take())
+                if not closed and time.monotonic() >= next_snapshot:
+                    self.snapshot()
+                    next_snapshot = time.monotonic() + self.snapshot_interval
+            except OSError as e:
+                logger.error("journal_error", error=e)
+            if closed:
+                return
+
+    def snapshot(self):
+        # on the journal thread (or before it starts): rotate the log, then write every live room
+        batch = self.take()
+        if self.fd is not None:
+            self.write(batch)
+            os.close(self.fd)
+        self.gen += 1
+        self.fd = os.open(file_path(self.directory, 'log', self.gen), _OPEN_FLAGS, 0o644)
+        data = b''.join(self.snapshot_fn())
+        path = file_path(self.directory, 'snapshot', self.gen)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        sync_dir(self.directory)
+        self.snapshots += 1
+        # the new snapshot and log now cover everything: drop the older generations
+        found = generations(self.directory)
+        for kind in ('snapshot', 'log'):
+            for gen in found[kind]:
+                if gen < self.gen:
+                    try:
+                        os.remove(file_path(self.directory, kind, gen))
+                    except OSError:
+                        pass
+
+    def close(self):
+        # flush what is pending and stop the journal thread
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        os.close(self.fd)
@@ -0,0 +1,106 @@
+# lobby.py
+# Index of waiting rooms (one player, open to join), kept up to date by the server on
+# create/join/leave/disconnect so listing and matchmaking never scan `server.rooms`.
+# - rooms in the order they started waiting: an OrderedDict, so the oldest is found in O(1)
+# - one such OrderedDict per (size, win), for quick match with specific rules
+# - a parallel ascending list of sequence numbers for cursor pages: a cursor is the sequence number
+#   of the last room of the previous page, and a page is found by bisection
+# - the changes since the last take_changes(), coalesced per room, for the LOBBY_UPDATE pushes:
+#   a room added and filled within one tick never shows up, a room re-listed is sent as added again
+# - in cluster mode, other workers' rooms too (cluster.py), listed like ours but queued apart, so
+#   quick match can prefer a room of this process and only then hand the player to another worker
+# Not thread-safe by itself: the server only touches it while holding ROOMS_LOCK.
+import itertools
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+PAGE_SIZE = 20       # rooms per ROOM_LIST page unless the client asks for fewer
+MAX_PAGE_SIZE = 100
+
+class WaitingRooms:
+    def __init__(self):
+        self.rooms = OrderedDict()   # room_id -> (seq, rules)
+        self.by_origin = {True: OrderedDict(), False: OrderedDict()}   # local? -> OrderedDict room_id -> None
+        self.by_rules = {}           # (size, win, local?) -> OrderedDict room_id -> None
+        self.seqs = []               # ascending seq of every waiting room ...
+        self.ids = []                # ... and its room_id, for pages
+        self.next_seq = itertools.count(1)
+        self.changes = {}            # room_id -> [entry or None if removed, listed before these changes]
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def __contains__(self, room_id):
+        return room_id in self.rooms
+
+    def add(self, room_id, rules, local=True):
+        # a room that starts waiting again goes to the back of the queue
+        if room_id in self.rooms:
+            return
+        seq = next(self.next_seq)
+        self.rooms[room_id] = (seq, rules)
+        self.by_origin[local][room_id] = None
+        self.by_rules.setdefault((rules['size'], rules['win'], local), OrderedDict())[room_id] = None
+        self.seqs.append(seq)
+        self.ids.append(room_id)
+        entry = {'room_id': room_id, **rules}
+        change = self.changes.get(room_id)
+        if change is None:
+            self.changes[room_id] = [entry, False]
+        else:
+            change[0] = entry
+
+    def discard(self, room_id):
+        entry = self.rooms.pop(room_id, None)
+        if entry is None:
+            return
+        seq, rules = entry
+        local = room_id in self.by_origin[True]
+        del self.by_origin[local][room_id]
+        key = (rules['size'], rules['win'], local)
+        bucket = self.by_rules[key]
+        del bucket[room_id]
+        if not bucket:
+            del self.by_rules[key]
+        i = bisect_left(self.seqs, seq)
+        del self.seqs[i]
+        del self.ids[i]
+        change = self.changes.get(room_id)
+        if change is None:
+            self.changes[room_id] = [None, True]
+        elif change[1]:
+            change[0] = None
+        else:
+            del self.changes[room_id]
+
+    def oldest(self, rules=None, local=True):
+        # room_id of the room of this process (or, local=False, of another worker) waiting longest,
+        # with these rules if given; None if there is none
+        if rules is None:
+            bucket = self.by_origin[local]
+        else:
+            bucket = self.by_rules.get((rules['size'], rules['win'], local))
+        if not bucket:
+            return None
+        return next(iter(bucket))
+
+    def page(self, cursor=None, limit=PAGE_SIZE):
+        # ([{'room_id', 'size', 'win'}, ...], cursor for the next page or None)
+        start = bisect_right(self.seqs, cursor) if cursor else 0
+        end = start + limit
+        entries = [{'room_id': rid, **self.rooms[rid][1]} for rid in self.ids[start:end]]
+        next_cursor = self.seqs[end - 1] if end < len(self.seqs) else None
+        return entries, next_cursor
+
+    def snapshot(self):
+        # (room_id, (seq, rules)) of every waiting room, oldest first; a cheap copy to format outside the lock
+        return list(self.rooms.items())
+
+    def take_changes(self):
+        # (entries added or re-listed, oldest first; room_ids no longer waiting) since the last call
+        changes = self.changes
+        self.changes = {}
+        added = [entry for entry, _ in changes.values() if entry is not None]
+        added.sort(key=lambda e: self.rooms[e['room_id']][0])
+        removed = [room_id for room_id, (entry, _) in changes.items() if entry is None]
+        return added, removed
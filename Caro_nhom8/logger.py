@@ -0,0 +1,161 @@
+# logger.py
+# Structured, asynchronous, level-filtered log for the server.
+#   logger.info("room_created", room=room_id, by=addr)
+# configure() binds debug() .. error() below the configured level to a no-op, so a filtered-out call
+# is one empty call. One at or above it only appends (time, level, event, fields) to a queue; the
+# writer thread builds and formats the lines and writes them in batches, so a handler never waits on
+# stdout, even while it holds a lock. If the writer falls MAX_QUEUED lines behind, new lines are
+# dropped and counted instead of growing memory.
+# Hot paths that would build costly fields can test enabled(level) first.
+# Output: "2026-10-18 12:00:00.123 INFO room_created room=ab12cd by=127.0.0.1:5000", or one JSON
+# object per line with configure(fmt="json").
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from helper import safe_start_thread
+
+DEBUG, INFO, WARNING, ERROR, OFF = 10, 20, 30, 40, 100
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR, 'off': OFF}
+NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+MAX_QUEUED = 100000      # lines waiting for the writer before new ones are dropped
+FLUSH_INTERVAL = 0.05    # seconds between the writer's batches
+
+level = INFO
+fmt = "text"
+stream = None            # None: sys.stdout at write time
+dropped = 0
+tags = {}                # fields put first on every line (cluster.py: the worker)
+
+_pending = deque()
+_append = _pending.append
+_now = time.time
+_writer = None
+_writer_lock = threading.Lock()
+_stop = threading.Event()
+
+def configure(level_name=None, format_name=None, out=None):
+    global level, fmt, stream
+    if level_name is not None:
+        level = LEVELS[level_name.lower()]
+    if format_name is not None:
+        if format_name not in ("text", "json"):
+            raise ValueError(f"unknown log format {format_name!r}")
+        fmt = format_name
+    if out is not None:
+        stream = out
+    _bind()
+
+def enabled(lvl):
+    return lvl >= level
+
+def log(lvl, event, fields):
+    if lvl >= level:
+        _emitter(lvl)(event, **fields)
+
+def _off(event, **fields):
+    pass
+
+def _emitter(lvl):
+    def emit(event, **fields):
+        global dropped
+        if len(_pending) < MAX_QUEUED:
+            _append((_now(), lvl, event, fields))
+            if _writer is None:
+                _start()
+        else:
+            dropped += 1
+    return emit
+
+def _bind():
+    # debug() .. error() for the current level: the queueing call, or the no-op below it
+    global debug, info, warning, error
+    debug, info, warning, error = (_emitter(lvl) if lvl >= level else _off
+                                   for lvl in (DEBUG, INFO, WARNING, ERROR))
+
+_bind()
+
+def _value(v):
+    if type(v) is str:
+        s = v
+    elif isinstance(v, tuple) and len(v) == 2 and isinstance(v[1], int):
+        # socket address
+        return f"{v[0]}:{v[1]}"
+    else:
+        s = str(v)
+    if not s or ' ' in s or '"' in s or '=' in s:
+        return json.dumps(s, ensure_ascii=False)
+    return s
+
+_second = (None, "")     # (unix second, its formatted date and time), for _stamp
+
+def _stamp(ts):
+    # "2026-10-18 12:00:00.123"; the part up to the second is formatted once per second
+    global _second
+    second, text = _second
+    if int(ts) != second:
+        second = int(ts)
+        text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        _second = (second, text)
+    return f"{text}.{int(ts * 1000) % 1000:03d}"
+
+def format_line(ts, lvl, event, fields):
+    if tags:
+        fields = {**tags, **fields}
+    if fmt == "json":
+        record = {'ts': round(ts, 3), 'level': NAMES[lvl].lower(), 'event': event}
+        for k, v in fields.items():
+            record[k] = _value(v) if isinstance(v, tuple) else v
+        return json.dumps(record, ensure_ascii=False, default=str)
+    line = f"{_stamp(ts)} {NAMES[lvl]} {event}"
+    for k, v in fields.items():
+        line += f" {k}={_value(v)}"
+    return line
+
+def flush():
+    # write everything queued; called on the writer thread, and at exit
+    lines = []
+    while _pending:
+        lines.append(format_line(*_pending.popleft()))
+    if lines:
+        out = stream or sys.stdout
+        try:
+            out.write("\n".join(lines) + "\n")
+            out.flush()
+        except (OSError, ValueError):
+            pass
+
+def _run():
+    # one batch per FLUSH_INTERVAL: woken for every line, the writer would take the GIL from the
+    # handlers as often as they log
+    while not _stop.is_set():
+        _stop.wait(FLUSH_INTERVAL)
+        flush()
+    flush()
+
+def _start():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = safe_start_thread(_run, ())
+            atexit.register(close)
+
+def _after_fork():
+    # a forked worker (cluster.py) has no writer thread: it starts its own on first use, and lines
+    # the parent had not written yet stay the parent's
+    global _writer, _writer_lock
+    _writer = None
+    _writer_lock = threading.Lock()
+    _pending.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+def close():
+    _stop.set()
+    if _writer is not None:
+        _writer.join(1.0)
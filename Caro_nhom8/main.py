@@ -1,33 +1,124 @@
 # main.py
+import os
 import sys
+import clock
+import cluster
+import logger
+import metrics
+import profiler
+import server
 from client import client_handler
 from server import server_handler
+from aserver import async_server_handler
+from journal import FLUSH_INTERVAL
 
 HOST = "127.0.0.1"
 PORT = 5000
 
 def usage():
-    print("Usage: python main.py [server|client] [host] [port]")
+    print("Usage: python main.py [server|aserver|client] [host] [port] [--journal DIR] [--flush-ms MS] [--grace SEC] [--records FILE]")
+    print("       [--ratings FILE] [--idle SEC] [--room-idle SEC] [--clock BASE+INC] [--move-time SEC] [--workers N]")
+    print("       [--metrics PORT] [--log-level debug|info|warning|error|off] [--log-format text|json]")
     print("Examples:")
     print("  python main.py server 0.0.0.0 5000")
+    print("  python main.py aserver 0.0.0.0 5000   (asyncio, single event loop)")
+    print("  python main.py server 0.0.0.0 5000 --journal data/journal   (games survive a restart)")
+    print("  python main.py server 0.0.0.0 5000 --grace 60   (seconds a dropped player's seat is held; 0 = none)")
+    print("  python main.py server 0.0.0.0 5000 --records data/games.bin   (finished games, see analyze.py)")
+    print("  python main.py server 0.0.0.0 5000 --ratings data/ratings.jsonl   (players and ratings kept across restarts)")
+    print("  python main.py server 0.0.0.0 5000 --idle 60 --room-idle 900   (close silent connections / inactive rooms; 0 = never)")
+    print("  python main.py server 0.0.0.0 5000 --clock 300+5 --move-time 60   (5 min + 5 s per move, at most 60 s a move)")
+    print("  python main.py aserver 0.0.0.0 5000 --workers 4   (4 processes on one port; Linux)")
+    print("  python main.py aserver 0.0.0.0 5000 --metrics 9100   (Prometheus metrics on http://127.0.0.1:9100/metrics)")
+    print("      then: curl 'http://127.0.0.1:9100/profile?seconds=10'   (sample the live server for 10 s)")
     print("  python main.py client 127.0.0.1 5000")
 
+def take_option(args, name, default=None):
+    # remove `name value` from args and return value
+    if name in args:
+        i = args.index(name)
+        if i + 1 < len(args):
+            value = args[i + 1]
+            del args[i:i + 2]
+            return value
+        usage()
+        sys.exit(1)
+    return default
+
+def worker_paths(shard, journal_dir, records_path, metrics_port, ratings_path=None):
+    # each cluster worker journals, records and serves metrics on its own: DIR/shard-N, NAME.N.EXT,
+    # PORT+N; the players are all kept by server.RATINGS_SHARD, in the one ratings file
+    if journal_dir is not None:
+        journal_dir = os.path.join(journal_dir, f"shard-{shard}")
+    if records_path is not None:
+        root, ext = os.path.splitext(records_path)
+        records_path = f"{root}.{shard}{ext}"
+    if shard != server.RATINGS_SHARD:
+        ratings_path = None
+    if metrics_port is not None:
+        metrics_port = int(metrics_port) + shard
+    return journal_dir, records_path, metrics_port, ratings_path
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2 or sys.argv[1] not in {"server", "client", "help"}:
+    args = sys.argv[1:]
+    journal_dir = take_option(args, "--journal")
+    flush_ms = take_option(args, "--flush-ms")
+    flush_interval = float(flush_ms) / 1000 if flush_ms is not None else FLUSH_INTERVAL
+    records_path = take_option(args, "--records")
+    ratings_path = take_option(args, "--ratings")
+    metrics_port = take_option(args, "--metrics")
+    try:
+        logger.configure(take_option(args, "--log-level"), take_option(args, "--log-format"))
+    except (KeyError, ValueError):
+        usage()
+        sys.exit(1)
+    server.RESUME_GRACE = float(take_option(args, "--grace", server.RESUME_GRACE))
+    server.IDLE_TIMEOUT = float(take_option(args, "--idle", server.IDLE_TIMEOUT))
+    # pinged after a third of it, so a live client has two chances to answer
+    server.PING_INTERVAL = server.IDLE_TIMEOUT / 3
+    server.ROOM_IDLE_TIMEOUT = float(take_option(args, "--room-idle", server.ROOM_IDLE_TIMEOUT))
+    try:
+        server.CLOCK_BASE, server.CLOCK_INCREMENT = clock.parse(take_option(args, "--clock", 0))
+        server.MOVE_TIME = max(float(take_option(args, "--move-time", server.MOVE_TIME)), 0.0)
+    except ValueError:
+        usage()
+        sys.exit(1)
+    workers = int(take_option(args, "--workers", 1))
+    if len(args) < 1 or args[0] not in {"server", "aserver", "client", "help"}:
         usage()
         sys.exit(1)
 
-    mode = sys.argv[1]
+    mode = args[0]
     host = HOST
     port = PORT
-    if len(sys.argv) >= 3:
-        host = sys.argv[2]
-    if len(sys.argv) >= 4:
-        port = int(sys.argv[3])
+    if len(args) >= 2:
+        host = args[1]
+    if len(args) >= 3:
+        port = int(args[2])
+
+    def serve(shard=None):
+        # one server, or worker `shard` of a cluster
+        journal, records, metrics_at, players = journal_dir, records_path, metrics_port, ratings_path
+        if shard is not None:
+            journal, records, metrics_at, players = worker_paths(shard, journal_dir, records_path, metrics_port,
+                                                                 ratings_path)
+        if metrics_at is not None:
+            metrics.serve_http(int(metrics_at))
+        handler = server_handler if mode == "server" else async_server_handler
+        handler(host, port, journal, flush_interval, records, reuse_port=shard is not None, ratings_path=players)
 
-    if mode == "server":
+    if mode in ("server", "aserver") and workers > 1:
+        if not cluster.supported() or workers > cluster.MAX_WORKERS:
+            print(f"--workers needs Linux and at most {cluster.MAX_WORKERS} workers")
+            sys.exit(1)
+        print(f"Starting {workers} {mode} workers on {host}:{port}")
+        cluster.run(workers, serve)
+    elif mode == "server":
         print(f"Starting server on {host}:{port}")
-        server_handler(host, port)
+        serve()
+    elif mode == "aserver":
+        print(f"Starting async server on {host}:{port}")
+        serve()
     elif mode == "client":
         print(f"Starting client connecting to {host}:{port}")
         client_handler(host, port)
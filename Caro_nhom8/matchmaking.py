@@ -0,0 +1,116 @@
+# matchmaking.py
+# Queue of players waiting for a rated game (MATCHMAKE), paired by rating.
+# - players are kept in buckets of BUCKET rating points, each an OrderedDict in the order they
+#   queued, so joining and leaving are O(1) and the oldest player of a bucket is found in O(1)
+# - a player accepts anyone whose rating is within its window: `window` points at first, widening by
+#   `widen` points a second while it waits, up to `max_window`. Two players are paired only if each
+#   accepts the other.
+# - pairing a player looks at the oldest player of each bucket its window reaches, nearest bucket
+#   first: at most 2 * max_window / BUCKET + 1 buckets, however many players are queued. The oldest
+#   of a bucket has waited longest there, so has the widest window of it.
+# - sweep() pairs the players whose windows have widened since they queued: it tries the oldest of
+#   each bucket, so it costs about the number of buckets (ratings span a few thousand points) plus
+#   the pairs it makes.
+# Not thread-safe by itself: the server only touches it while holding MATCH_LOCK.
+from collections import OrderedDict
+
+BUCKET = 25.0
+
+class Entry:
+    __slots__ = ('key', 'rating', 'since', 'bucket')
+
+    def __init__(self, key, rating, since):
+        self.key = key
+        self.rating = rating
+        self.since = since       # when it queued, in seconds
+        self.bucket = int(rating // BUCKET)
+
+class MatchQueue:
+    def __init__(self, window=50.0, widen=10.0, max_window=600.0):
+        self.window_base = window
+        self.widen = widen
+        self.max_window = max_window
+        self.entries = {}        # key -> Entry
+        self.buckets = {}        # bucket number -> OrderedDict key -> Entry, oldest first
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def window(self, entry, now):
+        return min(self.window_base + self.widen * max(now - entry.since, 0.0), self.max_window)
+
+    def add(self, key, rating, now):
+        # queue `key` (any hashable, e.g. a connection); a key already queued keeps its place
+        if key in self.entries:
+            return
+        entry = self.entries[key] = Entry(key, rating, now)
+        bucket = self.buckets.get(entry.bucket)
+        if bucket is None:
+            bucket = self.buckets[entry.bucket] = OrderedDict()
+        bucket[key] = entry
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        bucket = self.buckets[entry.bucket]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[entry.bucket]
+        return True
+
+    def match(self, key, now):
+        # the key queued to play `key`, both taken off the queue, or None if nobody fits yet
+        entry = self.entries.get(key)
+        other = self.partner(entry, now) if entry is not None else None
+        if other is None:
+            return None
+        self.discard(key)
+        self.discard(other.key)
+        return other.key
+
+    def partner(self, entry, now):
+        # the nearest rated player queued that entry and it both accept, or None
+        window = self.window(entry, now)
+        best = None
+        best_diff = window
+        for d in range(int(window // BUCKET) + 2):
+            if best is not None and (d - 1) * BUCKET > best_diff:
+                # every bucket further out is further away than the one found
+                break
+            for b in ((entry.bucket,) if d == 0 else (entry.bucket - d, entry.bucket + d)):
+                bucket = self.buckets.get(b)
+                if not bucket:
+                    continue
+                other = None
+                for candidate in bucket.values():
+                    if candidate is not entry:
+                        other = candidate
+                        break
+                if other is None:
+                    continue
+                diff = abs(other.rating - entry.rating)
+                if diff <= best_diff and diff <= self.window(other, now) and (best is None or diff < best_diff):
+                    best, best_diff = other, diff
+        return best
+
+    def sweep(self, now, limit=None):
+        # pairs (waited longer, other) of queued players whose windows now reach each other, at most
+        # `limit` of them; each is off the queue
+        pairs = []
+        for b in sorted(self.buckets):
+            while limit is None or len(pairs) < limit:
+                bucket = self.buckets.get(b)
+                if not bucket:
+                    break
+                entry = next(iter(bucket.values()))
+                other = self.partner(entry, now)
+                if other is None:
+                    break
+                self.discard(entry.key)
+                self.discard(other.key)
+                pairs.append((entry.key, other.key) if entry.since <= other.since else (other.key, entry.key))
+        return pairs
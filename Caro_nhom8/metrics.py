@@ -0,0 +1,221 @@
+# metrics.py
+# In-process server metrics, served in the Prometheus text format on a local HTTP endpoint
+# (main.py --metrics PORT, then GET http://127.0.0.1:PORT/metrics).
+# - counters and histograms are updated inline by the handlers: an update is a few attribute/dict
+#   operations, no lock. Under the threaded server a thread switch in the middle of one can
+#   (rarely) lose an increment; that is the price of keeping locks off the hot path.
+# - gauges (rooms, connections, queued bytes, ...) are callbacks evaluated only when scraped.
+# - TimedLock is a drop-in threading.Lock that records how long contended acquisitions waited;
+#   an uncontended acquire is not timed.
+# The endpoint runs on its own thread; other modules can add routes (ROUTES) for admin commands.
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from helper import safe_start_thread
+
+# seconds; handler latency and lock waits
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+REGISTRY = []
+
+def _labels(name, value):
+    return f'{{{name}="{value}"}}' if name else ''
+
+class Counter:
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.value = 0
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, n=1):
+        self.value += n
+
+    def inc_label(self, key, n=1):
+        self.values[key] = self.values.get(key, 0) + n
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        if self.label:
+            for key, v in sorted(self.values.copy().items()):
+                yield f"{self.name}{_labels(self.label, key)} {v}"
+        else:
+            yield f"{self.name} {self.value}"
+
+class Histogram:
+    # one series; see LabeledHistogram for one per label value
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-quantile (None if nothing was observed)
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def lines(self, name, labels=''):
+        inner = labels[1:-1] + ',' if labels else ''
+        total = 0
+        for bound, n in zip(self.bounds, self.counts):
+            total += n
+            yield f'{name}_bucket{{{inner}le="{bound:g}"}} {total}'
+        yield f'{name}_bucket{{{inner}le="+Inf"}} {self.count}'
+        yield f"{name}_sum{labels} {self.sum:.6f}"
+        yield f"{name}_count{labels} {self.count}"
+
+class LabeledHistogram:
+    def __init__(self, name, help_text, label, bounds=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.bounds = bounds
+        self.series = {}
+        REGISTRY.append(self)
+
+    def get(self, key):
+        h = self.series.get(key)
+        if h is None:
+            h = self.series.setdefault(key, Histogram(self.bounds))
+        return h
+
+    def observe(self, key, v):
+        self.get(key).observe(v)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, h in sorted(self.series.copy().items()):
+            yield from h.lines(self.name, _labels(self.label, key))
+
+class Gauge:
+    # fn() returns a number, or {label value: number} when the gauge has a label
+    def __init__(self, name, help_text, fn, label=None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.label = label
+        REGISTRY.append(self)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            # the structure it reads changed size mid-scrape; skip this one sample
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        if self.label:
+            for key, v in sorted(value.items()):
+                yield f"{self.name}{_labels(self.label, key)} {v}"
+        else:
+            yield f"{self.name} {value}"
+
+_gauges = {}
+
+def gauge(name, help_text, fn, label=None):
+    # register (or replace, when a server mode starts again) a gauge
+    g = _gauges.get(name)
+    if g is None:
+        _gauges[name] = Gauge(name, help_text, fn, label)
+    else:
+        g.fn = fn
+
+class TimedLock:
+    __slots__ = ('lock', 'wait')
+
+    def __init__(self, wait):
+        self.lock = threading.Lock()
+        self.wait = wait   # Histogram of contended waits
+
+    def __enter__(self):
+        if not self.lock.acquire(False):
+            t0 = time.perf_counter()
+            self.lock.acquire()
+            self.wait.observe(time.perf_counter() - t0)
+        return True
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self.lock.acquire(blocking, timeout)
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+# the server's metrics
+MESSAGES = Counter("caro_messages_total", "Messages received, by code.", "code")
+HANDLER_SECONDS = LabeledHistogram("caro_handler_seconds", "Time spent handling a message, by code.", "code")
+BYTES_IN = Counter("caro_bytes_in_total", "Frame bytes received from clients.")
+BYTES_OUT = Counter("caro_bytes_out_total", "Frame bytes queued to clients.")
+LOCK_WAIT = LabeledHistogram("caro_lock_wait_seconds", "Wait for a contended lock, by lock.", "lock")
+CONNECTIONS_TOTAL = Counter("caro_connections_total", "Connections accepted.")
+GAMES_TOTAL = Counter("caro_games_finished_total", "Games finished, by result.", "result")
+TIMEOUTS = Counter("caro_timeouts_total", "Idle connections closed, inactive rooms closed and games lost on time.", "kind")
+HANDOFFS = Counter("caro_handoffs_total", "Connections handed between cluster workers (out, in, failed).", "result")
+START_TIME = time.time()
+Gauge("caro_uptime_seconds", "Seconds since the server started.", lambda: round(time.time() - START_TIME, 3))
+
+def timed_lock(name):
+    return TimedLock(LOCK_WAIT.get(name))
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# path -> fn(query string) returning (status, content type, body text)
+ROUTES = {'/metrics': lambda query: (200, "text/plain; version=0.0.4", render())}
+
+class AdminHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        route = ROUTES.get(path)
+        if route is None:
+            status, ctype, body = 404, "text/plain", "not found\n"
+        else:
+            try:
+                status, ctype, body = route(query)
+            except Exception as e:
+                status, ctype, body = 500, "text/plain", f"error: {e}\n"
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def serve_http(port, host="127.0.0.1"):
+    # start the endpoint on its own thread; local only by default, it is not authenticated
+    httpd = ThreadingHTTPServer((host, port), AdminHandler)
+    httpd.daemon_threads = True
+    safe_start_thread(httpd.serve_forever, ())
+    return httpd
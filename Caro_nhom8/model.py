@@ -0,0 +1,123 @@
+# model.py
+# The server's in-memory state as __slots__ classes, in place of nested dicts and tuples:
+# - Connection: one per client connection (or in-process LocalPeer). It carries what used to be looked
+#   up by socket in several global dicts: the negotiated protocol, the outbound queue, the idle stamp,
+#   and the seat it plays in or the room it watches, so a handler gets from a message to its room and
+#   opponent through attributes, without the global lock.
+# - Room: rules, lock, board and game state, spectators, journal seq. It always has exactly two
+#   PlayerSlots, made with the room.
+# - PlayerSlot: seat 1 or 2. Players are small ints inside the server and "Player N" only on the
+#   wire. A slot has its connection (None while empty or held), rejoin token, symbol, held-seat
+#   timer, and a direct reference to the opposite slot.
+# Parts most rooms never use (spectators, the fan-out queue, restart votes) are created on first use,
+# and every room with the same rules shares one rules dict.
+import time
+import metrics
+from board import make_board
+from codec import PROTOCOL_JSON
+
+NAMES = (None, "Player 1", "Player 2")
+
+_rules = {}
+
+def shared_rules(size, win):
+    # the one {'size', 'win'} dict for these rules; treat it as read-only
+    rules = _rules.get((size, win))
+    if rules is None:
+        rules = _rules[(size, win)] = {'size': size, 'win': win}
+    return rules
+
+class Connection:
+    __slots__ = ('sock', 'addr', 'protocol', 'queue', 'seat', 'watching', 'last_seen', 'user', 'queued',
+                 '__weakref__')
+
+    def __init__(self, sock, addr, protocol=PROTOCOL_JSON):
+        self.sock = sock
+        self.addr = addr
+        self.protocol = protocol
+        self.queue = None       # OutboundQueue of the threaded server; None: write to sock directly
+        self.seat = None        # PlayerSlot it plays in
+        self.watching = None    # Room it spectates
+        self.last_seen = None   # wheel tick of the last message, while the idle timeout watches it
+        self.user = None        # ratings.Player it has identified as
+        self.queued = None      # matchmaking.MatchQueue it waits in for a rated game
+
+class PlayerSlot:
+    __slots__ = ('room', 'num', 'name', 'conn', 'token', 'symbol', 'held', 'timer', 'opponent', 'premove', 'user')
+
+    def __init__(self, room, num):
+        self.room = room
+        self.num = num
+        self.name = NAMES[num]
+        self.conn = None        # Connection seated here
+        self.token = None       # rejoin token while the seat is taken or held
+        self.symbol = None      # 'X' or 'O' once a game has started
+        self.held = None        # while held for a dropped player: whether that player is a bot
+        self.timer = None       # wheel timer that gives a held seat up
+        self.opponent = None
+        self.premove = None     # (x, y) sent ahead of the opponent's move, played right after it
+        self.user = None        # ratings.Player seated here, in a rated room
+
+    def taken(self):
+        # seated, or held for a player to come back
+        return self.conn is not None or self.held is not None
+
+class Room:
+    __slots__ = ('id', 'rules', 'lock', 'seats', 'board', 'turn', 'finished', 'result', 'moves', 'started',
+                 'votes', 'draw_offer', 'closed', 'private', 'rated', 'spectators', 'fanout', 'jseq', 'active',
+                 'clock')
+
+    def __init__(self, room_id, rules, private, active, rated=False):
+        self.id = room_id
+        self.rules = rules
+        self.lock = metrics.timed_lock('room')
+        p1, p2 = PlayerSlot(self, 1), PlayerSlot(self, 2)
+        p1.opponent, p2.opponent = p2, p1
+        self.seats = (p1, p2)
+        self.closed = False
+        self.private = private  # AI and rated games are never listed or quick-matched
+        self.rated = rated      # made by matchmaking: its games change the players' ratings
+        self.spectators = None  # set of watching Connections
+        self.fanout = None      # deque of [conns, next index, msg, frames] waiting to go to spectators
+        self.jseq = 0           # journal seq
+        self.active = active    # wheel tick of the last join, move or chat
+        self.clock = None       # clock.Clock of the game, with a time control
+        self.reset()
+
+    def reset(self):
+        # a new, not yet started game
+        self.board = make_board(self.rules['size'], self.rules['win'])
+        self.turn = None        # PlayerSlot to move
+        self.finished = False
+        # {'winner': "Player N"} (with 'timeout': the loser, on time, or 'forfeit': the loser, who
+        # left a rated game) or {'draw': True}, as sent to clients; in a rated room also 'ratings':
+        # the players' new ratings
+        self.result = None
+        self.moves = []         # (player number, x, y) in order, for journal snapshots and rejoins
+        self.started = time.time()   # unix time, for the game's record
+        self.votes = None       # player numbers that asked to play again
+        self.draw_offer = None  # PlayerSlot whose draw offer waits for the opponent, until the next move
+        for slot in self.seats:
+            slot.symbol = None
+            slot.premove = None
+
+    def start(self, first):
+        # a new game, `first` (a PlayerSlot) playing X
+        self.reset()
+        first.symbol = 'X'
+        first.opponent.symbol = 'O'
+        self.turn = first
+
+    def seated(self):
+        # the slots with a connection in them, seat 1 first
+        return [slot for slot in self.seats if slot.conn is not None]
+
+    def conns(self):
+        return [slot.conn for slot in self.seats if slot.conn is not None]
+
+    def occupied(self):
+        # seats taken or held
+        return sum(1 for slot in self.seats if slot.taken())
+
+    def held(self):
+        return [slot for slot in self.seats if slot.held is not None]
@@ -0,0 +1,157 @@
+# opening.py
+# Opening book for the AI on bounded square boards. Positions are keyed by a canonical hash: the
+# minimum, over the 8 symmetries of the square, of a 64-bit hash of the transformed stones and side
+# to move, so mirrored and rotated openings share one entry. The stored move is in the orientation of
+# that minimum and is mapped back through the inverse symmetry on lookup.
+# Books are built offline with the engine (python opening.py [size] [win] ...) into
+# data/book_<size>_<win>.bin: a header, the sorted hashes (uint64) and the moves (int16 pairs).
+# They are memory-mapped on first lookup; a missing book just means no book moves.
+import mmap
+import os
+import struct
+import sys
+import threading
+from bisect import bisect_left
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# positions with more stones than this are never looked up
+BOOK_MAX_STONES = 4
+
+# magic, size, win, reserved, number of positions, reserved (16 bytes, so the hashes are 8-aligned)
+_HEADER = struct.Struct('=4sBBHII')
+_MAGIC = b'CARB'
+_MASK64 = (1 << 64) - 1
+_SIDE_O = 0x9E3779B97F4A7C15
+
+# the 8 symmetries of an n x n board, and the index of each one's inverse
+SYMMETRIES = (
+    lambda x, y, n: (x, y),
+    lambda x, y, n: (n - 1 - x, y),
+    lambda x, y, n: (x, n - 1 - y),
+    lambda x, y, n: (n - 1 - x, n - 1 - y),
+    lambda x, y, n: (y, x),
+    lambda x, y, n: (n - 1 - y, x),
+    lambda x, y, n: (y, n - 1 - x),
+    lambda x, y, n: (n - 1 - y, n - 1 - x),
+)
+INVERSE = (0, 1, 2, 3, 4, 6, 5, 7)
+
+def mix64(v):
+    # splitmix64 finaliser: a fixed, well-spread hash that is the same in every process
+    v = (v + 0x9E3779B97F4A7C15) & _MASK64
+    v = ((v ^ (v >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    v = ((v ^ (v >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return v ^ (v >> 31)
+
+def canonical(size, stones, sym):
+    # (canonical hash, index of the symmetry that produced it)
+    best = None
+    for i, t in enumerate(SYMMETRIES):
+        h = _SIDE_O if sym == 'O' else 0
+        for x, y, s in stones:
+            tx, ty = t(x, y, size)
+            h ^= mix64((tx * 128 + ty) * 2 + (s == 'O'))
+        if best is None or h < best[0]:
+            best = (h, i)
+    return best
+
+def book_path(size, win):
+    return os.path.join(DATA_DIR, f"book_{size}_{win}.bin")
+
+class Book:
+    def __init__(self, mm, count):
+        self.mm = mm
+        self.hashes = memoryview(mm)[_HEADER.size:_HEADER.size + 8 * count].cast('Q')
+        self.moves = memoryview(mm)[_HEADER.size + 8 * count:].cast('h')
+
+    def get(self, key):
+        i = bisect_left(self.hashes, key)
+        if i < len(self.hashes) and self.hashes[i] == key:
+            return self.moves[2 * i], self.moves[2 * i + 1]
+        return None
+
+def write_book(size, win, entries):
+    # entries: {canonical hash: (x, y) in canonical orientation}
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = book_path(size, win)
+    keys = sorted(entries)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, size, win, 0, len(keys), 0))
+        f.write(struct.pack(f"={len(keys)}Q", *keys))
+        f.write(struct.pack(f"={2 * len(keys)}h", *[c for k in keys for c in entries[k]]))
+    os.replace(tmp, path)
+
+def map_book(size, win):
+    try:
+        with open(book_path(size, win), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    magic, s, w, _, count, _ = _HEADER.unpack_from(mm)
+    if magic != _MAGIC or s != size or w != win or len(mm) != _HEADER.size + 12 * count:
+        mm.close()
+        return None
+    return Book(mm, count)
+
+_books = {}
+_lock = threading.Lock()
+
+def get_book(size, win):
+    key = (size, win)
+    if key not in _books:
+        with _lock:
+            if key not in _books:
+                _books[key] = map_book(size, win)
+    return _books[key]
+
+def lookup(size, win, stones, sym):
+    # book move (x, y) for `sym`, or None
+    if not size or len(stones) > BOOK_MAX_STONES:
+        return None
+    book = get_book(size, win)
+    if book is None:
+        return None
+    h, i = canonical(size, stones, sym)
+    move = book.get(h)
+    if move is None:
+        return None
+    return SYMMETRIES[INVERSE[i]](move[0], move[1], size)
+
+def build(size, win, plies=4, width=5, depth=4):
+    # engine searches for every position reachable in `plies` moves where the first move is near the
+    # centre and after that each side plays one of its `width` best-ordered candidates
+    from ai import SYMBOL_PLAYER, Engine
+    engine = Engine(use_book=False)
+    entries = {}
+    frontier = [[]]
+    for ply in range(plies + 1):
+        sym = 'X' if ply % 2 == 0 else 'O'
+        children = []
+        for stones in frontier:
+            h, i = canonical(size, stones, sym)
+            if h in entries:
+                continue
+            x, y = engine.best_move(size, win, stones, sym, 0, depth)
+            entries[h] = SYMMETRIES[i](x, y, size)
+            if ply < plies:
+                if stones:
+                    moves, _, _ = engine.position(size, win, stones).candidates(SYMBOL_PLAYER[sym])
+                    replies = [(m[1], m[2]) for m in moves[:width]]
+                else:
+                    # any first move within 2 of the centre
+                    c = size // 2
+                    replies = [(c + dx, c + dy) for dx in range(-2, 3) for dy in range(-2, 3)]
+                children.extend(stones + [(cx, cy, sym)] for cx, cy in replies)
+        frontier = children
+        print(f"ply {ply}: {len(entries)} positions")
+    write_book(size, win, entries)
+    return len(entries)
+
+if __name__ == "__main__":
+    # python opening.py [size] [win] [plies] [width] [depth]
+    args = [int(a) for a in sys.argv[1:]]
+    size = args[0] if args else 15
+    win = args[1] if len(args) > 1 else 5
+    n = build(size, win, *args[2:])
+    print(f"wrote {book_path(size, win)} ({n} positions)")
@@ -0,0 +1,183 @@
+# outbound.py
+# Per-connection outbound queue: handlers enqueue encoded frames without blocking and a dedicated
+# writer drains them, coalescing everything queued into one sendall(). When nothing is queued the
+# frame is first offered to the socket with a non-blocking send, so an idle connection costs no
+# writer wake-up; only what the kernel does not take right away is queued. A writer blocked on a
+# client that has stopped reading looks at the water marks every STALL_CHECK seconds, so the client
+# is evicted on time even when nothing more is sent to it.
+import select
+import socket
+import threading
+import time
+from collections import deque
+from helper import safe_start_thread
+
+# defaults, all overridable per queue
+HIGH_WATER = 256 * 1024      # bytes queued before a client counts as "slow"
+LOW_WATER = 64 * 1024        # a slow client is forgiven once its queue drains below this
+MAX_QUEUED = 4 * 1024 * 1024 # hard cap: a client this far behind is evicted immediately
+STALL_TIMEOUT = 3.0          # seconds a client may stay above HIGH_WATER before eviction
+STALL_CHECK = 0.25           # seconds between water-mark checks while the writer is blocked
+# kernel send buffer of a client socket: left to autotune it grows to megabytes, all of which a
+# client that stops reading fills before anything even queues here
+SEND_BUFFER = 128 * 1024
+BATCH_BYTES = 64 * 1024      # upper bound on one coalesced write
+# 0 where the platform has no per-call non-blocking flag: every frame then goes through the writer
+_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+def limit_send_buffer(sock, size=SEND_BUFFER):
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+    except OSError:
+        pass
+
+class WaterMarks:
+    # slow-consumer policy shared by the threaded queue and the asyncio transport adapter
+    def __init__(self, high_water=HIGH_WATER, low_water=LOW_WATER, max_queued=MAX_QUEUED, stall_timeout=STALL_TIMEOUT):
+        self.high_water = high_water
+        self.low_water = low_water
+        self.max_queued = max_queued
+        self.stall_timeout = stall_timeout
+        self.over_since = None
+
+    def should_evict(self, queued, now=None):
+        if queued > self.max_queued:
+            return True
+        if self.over_since is None:
+            if queued > self.high_water:
+                self.over_since = now if now is not None else time.monotonic()
+            return False
+        if queued < self.low_water:
+            self.over_since = None
+            return False
+        now = now if now is not None else time.monotonic()
+        return now - self.over_since > self.stall_timeout
+
+class OutboundQueue:
+    def __init__(self, sock, marks=None, batch_bytes=BATCH_BYTES, on_evict=None):
+        self.sock = sock
+        self.marks = marks or WaterMarks()
+        self.batch_bytes = batch_bytes
+        self.on_evict = on_evict
+        self.frames = deque()
+        self.queued = 0
+        self.closed = False
+        self.evicted = False
+        self.sending = False   # the writer is in sendall() outside the lock
+        self.finishing = False # finish() is waiting for the last frames to go out
+        self.cond = threading.Condition()
+        limit_send_buffer(sock)
+        self.thread = safe_start_thread(self.writer, ())
+
+    def put(self, data: bytes):
+        # enqueue one encoded frame; returns False if the connection is closed or was just evicted
+        with self.cond:
+            if self.closed or self.finishing:
+                return False
+            if _DONTWAIT and not self.frames and not self.sending:
+                try:
+                    sent = self.sock.send(data, _DONTWAIT)
+                except OSError:
+                    # full buffer, or a broken socket the writer will find on its own
+                    sent = 0
+                if sent == len(data):
+                    return True
+                data = data[sent:]
+            self.frames.append(data)
+            self.queued += len(data)
+            if self.marks.should_evict(self.queued):
+                self._evict()
+                return False
+            self.cond.notify()
+        return True
+
+    def finish(self, timeout):
+        # before the socket changes hands (cluster.py): take no more frames, wait until everything
+        # queued has been written, then stop the writer. False if that did not happen within
+        # `timeout` or the connection broke; the queue is closed either way.
+        with self.cond:
+            self.finishing = True
+            done = self.cond.wait_for(lambda: self.closed or (not self.frames and not self.sending), timeout)
+            ok = done and not self.closed
+            self.closed = True
+            self.frames.clear()
+            self.queued = 0
+            self.cond.notify_all()
+        return ok
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.frames.clear()
+            self.queued = 0
+            self.cond.notify()
+
+    def _evict(self):
+        # caller holds self.cond; drop the backlog and shut the socket so the reader sees EOF
+        # and runs the normal disconnect path
+        self.closed = True
+        self.evicted = True
+        self.frames.clear()
+        self.queued = 0
+        self.cond.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if self.on_evict:
+            self.on_evict(self.sock)
+
+    def writer(self):
+        while True:
+            with self.cond:
+                while not self.frames and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                batch = []
+                size = 0
+                while self.frames and size < self.batch_bytes:
+                    frame = self.frames.popleft()
+                    batch.append(frame)
+                    size += len(frame)
+                self.sending = True
+            try:
+                if not self.write(b''.join(batch)):
+                    return
+            except (OSError, ValueError):
+                # ValueError: select() on a socket closed under it
+                self.close()
+                return
+            with self.cond:
+                self.sending = False
+                if self.closed:
+                    return
+                self.queued -= size
+                if self.finishing and not self.frames:
+                    self.cond.notify_all()
+                if self.marks.should_evict(self.queued):
+                    self._evict()
+                    return
+
+    def write(self, data):
+        # sendall() that wakes up every STALL_CHECK while the socket takes nothing, to evict a client
+        # stalled past the water marks; False if it was evicted (or closed) meanwhile
+        view = memoryview(data)
+        while view:
+            if _DONTWAIT:
+                try:
+                    view = view[self.sock.send(view, _DONTWAIT):]
+                    continue
+                except (BlockingIOError, InterruptedError):
+                    pass
+            _, ready, _ = select.select((), (self.sock,), (), STALL_CHECK)
+            if not _DONTWAIT and ready:
+                view = view[self.sock.send(view):]
+            elif not ready:
+                with self.cond:
+                    if self.closed:
+                        return False
+                    if self.marks.should_evict(self.queued):
+                        self._evict()
+                        return False
+        return True
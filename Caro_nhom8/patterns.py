@@ -0,0 +1,98 @@
+# patterns.py
+# Precomputed line-pattern table for the AI evaluation. For a win length w, the 2*(w-1) cells around
+# an empty cell along one direction (each empty / X / O / off-board) are encoded base 4 into a code
+# (ai.line_offsets order); table[2*code] and table[2*code+1] hold the gain of an X / O stone on that
+# cell along that line, with the top bit set if the stone completes a row. This covers every threat
+# shape at once (open four, broken three, ...) without counting windows at search time.
+# Tables are built on first use, cached as data/patterns_w<win>.bin (header + uint32 array) and
+# memory-mapped read-only, so every search process shares the same pages.
+import mmap
+import os
+import struct
+import threading
+from array import array
+from ai import GAIN_MASK, WINDOW_BASE, line_gain, window_scores
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# 4 ** (2 * (win - 1)) codes: 64K entries (512 KiB) at win 5; longer rows fall back to window counting
+TABLE_MAX_WIN = 5
+
+# magic, win, window base, reserved, number of codes
+_HEADER = struct.Struct('=4sBBHI')
+_MAGIC = b'CARP'
+
+_tables = {}
+_lock = threading.Lock()
+
+def table_path(win):
+    return os.path.join(DATA_DIR, f"patterns_w{win}.bin")
+
+def build_table(win):
+    # array('I') of 2 entries per code
+    n = 2 * (win - 1)
+    s = window_scores(win)
+    table = array('I', bytes(4 * 2 * 4 ** n))
+    for code in range(4 ** n):
+        digits = []
+        c = code
+        for _ in range(n):
+            c, d = divmod(c, 4)
+            digits.append(d)
+        digits.reverse()
+        line = digits[:win - 1] + [0] + digits[win - 1:]
+        g1, g2, w1, w2 = line_gain(line, win, s)
+        table[2 * code] = g1 | (w1 << 31)
+        table[2 * code + 1] = g2 | (w2 << 31)
+        assert g1 <= GAIN_MASK and g2 <= GAIN_MASK
+    return table
+
+def write_table(win, table):
+    # write to a temporary name first so a concurrent loader never maps a half-written file
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = table_path(win)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, win, WINDOW_BASE, 0, len(table) // 2))
+        f.write(table.tobytes())
+    os.replace(tmp, path)
+
+def map_table(win):
+    # memoryview of uint32 over the mapped file, or None if it is missing or stale
+    try:
+        with open(table_path(win), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    magic, w, base, _, codes = _HEADER.unpack_from(mm)
+    if magic != _MAGIC or w != win or base != WINDOW_BASE or len(mm) != _HEADER.size + 8 * codes \
+            or codes != 4 ** (2 * (win - 1)):
+        mm.close()
+        return None
+    return memoryview(mm)[_HEADER.size:].cast('I')
+
+def get_table(win):
+    # the pattern table for `win`, loaded (or built) on first use; None if win is too long for a table
+    if win > TABLE_MAX_WIN:
+        return None
+    table = _tables.get(win)
+    if table is not None:
+        return table
+    with _lock:
+        if win not in _tables:
+            table = map_table(win)
+            if table is None:
+                built = build_table(win)
+                try:
+                    write_table(win, built)
+                    table = map_table(win)
+                except OSError as e:
+                    print("Could not cache pattern table:", e)
+                if table is None:
+                    table = built
+            _tables[win] = table
+        return _tables[win]
+
+if __name__ == "__main__":
+    for w in range(3, TABLE_MAX_WIN + 1):
+        write_table(w, build_table(w))
+        print("wrote", table_path(w))
@@ -0,0 +1,204 @@
+# profiler.py
+# Sampling profiler for the live server, switched on from the admin endpoint (main.py --metrics PORT)
+# for a fixed window, without restarting and without dropping the games held in memory:
+#   curl 'http://127.0.0.1:PORT/profile?seconds=10'     sample 10 s, reply with a report
+#   curl 'http://127.0.0.1:PORT/profile/stop'           end a running window early
+# Every sample snapshots the Python stack of every thread (sys._current_frames): the handle_client
+# threads of the threaded server, or the one event-loop thread, which is running whichever task is
+# being served. A thread waiting for work (blocked in recv, a writer waiting on its condition, the
+# event loop in select) is counted as idle and not walked. Busy stacks are counted as they are, and
+# a sample inside server.dispatch is also credited to the message code it is handling.
+# The window writes a collapsed-stack file (one "outer;...;inner count" line per stack, the input of
+# flamegraph.pl or speedscope) to PROFILE_DIR and replies with samples per code next to the handler
+# time metrics measured for the same window.
+# Overhead: after each sample the sampler sleeps at least (cost / BUDGET), cost being its own CPU
+# time, so sampling holds the GIL for at most BUDGET of the wall time however many threads there
+# are; the sampling rate drops instead.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+import logger
+import metrics
+
+INTERVAL = 0.005        # seconds between samples when sampling is cheap (200 Hz)
+BUDGET = 0.01           # share of wall time spent sampling, at most
+MAX_SECONDS = 300
+MAX_DEPTH = 64          # frames kept per stack, innermost first
+PROFILE_DIR = os.path.join("data", "profiles")
+TOP = 20                # functions listed in the report
+
+# (file, function) of the frames a thread sits in while it waits for work
+IDLE = {
+    ('common.py', '_fill'),              # handle_client blocked in recv_into
+    ('server.py', 'timer_ticker'),       # time.sleep between ticks
+    ('server.py', 'lobby_ticker'),
+    ('threading.py', 'wait'),            # OutboundQueue, journal, records and logger writers
+    ('selectors.py', 'select'),          # the asyncio event loop, waiting on connections
+    ('socket.py', 'accept'),
+    ('connection.py', '_poll'),          # a bot waiting for its AI process
+    ('connection.py', '_recv'),
+    ('connection.py', 'wait'),
+}
+DISPATCH = ('server.py', 'dispatch')
+
+_kinds = {}             # code object -> 'idle', 'dispatch' or None
+_labels = {}            # code object -> "function (file:line)"
+_busy = threading.Lock()
+_stop = threading.Event()
+
+def _kind(code):
+    kind = _kinds.get(code, False)
+    if kind is False:
+        key = (os.path.basename(code.co_filename), code.co_name)
+        kind = 'idle' if key in IDLE else 'dispatch' if key == DISPATCH else None
+        _kinds[code] = kind
+    return kind
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        name = getattr(code, 'co_qualname', code.co_name)
+        label = _labels[code] = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+class Profile:
+    def __init__(self):
+        self.stacks = Counter()     # (code objects, innermost first) -> samples
+        self.by_code = Counter()    # message code -> samples inside dispatch
+        self.rounds = 0             # times all threads were sampled
+        self.busy = 0               # thread samples that were doing something
+        self.idle = 0
+        self.cost = 0.0             # seconds spent sampling
+        self.elapsed = 0.0
+
+    def sample(self, skip):
+        idle = 0
+        kinds = _kinds
+        for ident, frame in sys._current_frames().items():
+            kind = kinds.get(frame.f_code, False)
+            if kind is False:
+                kind = _kind(frame.f_code)
+            if kind == 'idle':
+                idle += 1
+                continue
+            if ident == skip:
+                continue
+            stack = []
+            msg_code = None
+            while frame is not None and len(stack) < MAX_DEPTH:
+                code = frame.f_code
+                stack.append(code)
+                if msg_code is None and _kind(code) == 'dispatch':
+                    msg_code = frame.f_locals.get('code', 'unknown')
+                frame = frame.f_back
+            self.stacks[tuple(stack)] += 1
+            self.busy += 1
+            if msg_code is not None:
+                self.by_code[msg_code] += 1
+        self.idle += idle
+        self.rounds += 1
+
+    def collapsed(self):
+        lines = [";".join(_label(code) for code in reversed(stack)) + f" {n}"
+                 for stack, n in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def self_samples(self):
+        # samples per innermost function
+        leaves = Counter()
+        for stack, n in self.stacks.items():
+            leaves[stack[0]] += n
+        return leaves
+
+def run(seconds, interval=INTERVAL):
+    # sample every thread but the calling one for `seconds` (or until stop()); None if a window
+    # is already running
+    if not _busy.acquire(False):
+        return None
+    try:
+        _stop.clear()
+        profile = Profile()
+        me = threading.get_ident()
+        t0 = time.perf_counter()
+        end = t0 + seconds
+        while time.perf_counter() < end:
+            # this thread's CPU time: under load, waiting for the GIL in between is not our cost
+            c0 = time.thread_time()
+            profile.sample(me)
+            cost = time.thread_time() - c0
+            profile.cost += cost
+            if _stop.wait(max(interval, cost / BUDGET - cost)):
+                break
+        profile.elapsed = time.perf_counter() - t0
+        return profile
+    finally:
+        _busy.release()
+
+def stop():
+    _stop.set()
+
+def write_collapsed(profile, directory=PROFILE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(profile.collapsed())
+    return path
+
+def _handler_totals():
+    return {code: (h.count, h.sum) for code, h in metrics.HANDLER_SECONDS.series.copy().items()}
+
+def report(profile, path, before, after):
+    elapsed = profile.elapsed or 1e-9
+    busy = profile.busy or 1
+    per_round = elapsed / profile.rounds if profile.rounds else 0.0
+    lines = [
+        f"window {profile.elapsed:.2f}s, {profile.rounds} samples ({profile.rounds / elapsed:.0f}/s), "
+        f"sampling cost {profile.cost / elapsed * 100:.2f}% of wall time",
+        f"thread samples: busy {profile.busy}, idle {profile.idle}",
+        f"collapsed stacks: {path}",
+        "",
+        f"{'code':<20}{'samples':>9}{'est_ms':>10}{'calls':>9}{'handler_ms':>12}{'mean_us':>9}",
+    ]
+    codes = set(profile.by_code) | {c for c in after if after[c] != before.get(c)}
+    rows = []
+    for code in codes:
+        n0, s0 = before.get(code, (0, 0.0))
+        n1, s1 = after.get(code, (0, 0.0))
+        rows.append((profile.by_code.get(code, 0), code, n1 - n0, s1 - s0))
+    for samples, code, calls, spent in sorted(rows, key=lambda r: (-r[0], -r[3])):
+        mean = spent / calls * 1e6 if calls else 0.0
+        lines.append(f"{str(code):<20}{samples:>9}{samples * per_round * 1000:>10.1f}{calls:>9}"
+                     f"{spent * 1000:>12.1f}{mean:>9.1f}")
+    lines += ["", f"top functions (self samples of {profile.busy}):"]
+    for code, n in profile.self_samples().most_common(TOP):
+        lines.append(f"{n:>8}  {n / busy * 100:5.1f}%  {_label(code)}")
+    return "\n".join(lines) + "\n"
+
+def handle_profile(query):
+    params = parse_qs(query)
+    try:
+        seconds = min(float(params.get('seconds', ['10'])[0]), MAX_SECONDS)
+        interval = float(params.get('interval_ms', [INTERVAL * 1000])[0]) / 1000
+    except ValueError:
+        return 400, "text/plain", "seconds and interval_ms must be numbers\n"
+    before = _handler_totals()
+    logger.info("profile_started", seconds=seconds)
+    profile = run(seconds, max(interval, 0.001))
+    if profile is None:
+        return 409, "text/plain", "a profile is already running\n"
+    after = _handler_totals()
+    path = write_collapsed(profile)
+    logger.info("profile_written", path=path, samples=profile.rounds, busy=profile.busy)
+    if params.get('format', [''])[0] == "collapsed":
+        return 200, "text/plain", profile.collapsed()
+    return 200, "text/plain", report(profile, path, before, after)
+
+def handle_stop(query):
+    stop()
+    return 200, "text/plain", "stopping\n"
+
+metrics.ROUTES['/profile'] = handle_profile
+metrics.ROUTES['/profile/stop'] = handle_stop
@@ -0,0 +1,189 @@
+# ratings.py
+# Player identities and their Glicko ratings.
+# - a player is a random user id plus a secret key the client keeps (only its sha256 is stored); the
+#   server hands both out on a first IDENTIFY and the client sends them back on later connections
+# - Glicko (Glickman 1999) with every game its own rating period: a rating and a rating deviation
+#   (RD, how unsure the rating is). A game moves an unsure rating a lot and a settled one a little,
+#   and RD grows back while a player doesn't play, so a returning player settles again quickly.
+# - PlayerStore keeps every player in memory. With a file (--ratings FILE) each change is also
+#   appended to it as a JSON line by a writer thread, like the game records; loading keeps the last
+#   line per player and rewrites the file compacted.
+# Not thread-safe by itself: the server only touches a store and its players while holding RATINGS_LOCK.
+import hashlib
+import json
+import math
+import os
+import secrets
+import threading
+import time
+import logger
+from helper import safe_start_thread
+
+INITIAL_RATING = 1500.0
+INITIAL_RD = 350.0
+MIN_RD = 30.0
+# RD growth per idle day: a settled player (RD 50) is back to unrated after a year away
+RD_PER_DAY = math.sqrt((INITIAL_RD ** 2 - 50.0 ** 2) / 365)
+FLUSH_INTERVAL = 1.0     # seconds between writes of changed players to the ratings file
+
+_Q = math.log(10) / 400
+
+def _g(rd):
+    # how much an opponent's rating counts, given how unsure it is
+    return 1 / math.sqrt(1 + 3 * _Q * _Q * rd * rd / (math.pi * math.pi))
+
+def expected(rating, other, other_rd):
+    # expected score (1 win, 0 loss) against `other`
+    return 1 / (1 + 10 ** (-_g(other_rd) * (rating - other) / 400))
+
+def hash_key(key):
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class Player:
+    __slots__ = ('user', 'key', 'rating', 'rd', 'games', 'wins', 'draws', 'last')
+
+    def __init__(self, user, key, rating=INITIAL_RATING, rd=INITIAL_RD, games=0, wins=0, draws=0, last=0.0):
+        self.user = user
+        self.key = key           # sha256 of the secret key
+        self.rating = rating
+        self.rd = rd             # as of `last`
+        self.games = games
+        self.wins = wins
+        self.draws = draws
+        self.last = last         # unix time of the last rated game, 0 if none
+
+    def current_rd(self, now):
+        # RD grown by the time since the last game
+        if not self.last:
+            return self.rd
+        days = max(now - self.last, 0.0) / 86400
+        return min(math.sqrt(self.rd * self.rd + RD_PER_DAY * RD_PER_DAY * days), INITIAL_RD)
+
+    def to_dict(self):
+        return {'user': self.user, 'key': self.key, 'rating': round(self.rating, 2), 'rd': round(self.rd, 2),
+                'games': self.games, 'wins': self.wins, 'draws': self.draws, 'last': self.last}
+
+    def profile(self, now=None):
+        # what the player is told about itself
+        rd = self.current_rd(time.time() if now is None else now)
+        return {'user': self.user, 'rating': round(self.rating, 1), 'rd': round(rd, 1), 'games': self.games,
+                'wins': self.wins, 'draws': self.draws}
+
+def rate(a, b, score, now=None):
+    # update players a and b after a game between them; score is a's (1 win, 0.5 draw, 0 loss).
+    # Both updates use the ratings from before the game. Returns the rating changes (a's, b's).
+    now = time.time() if now is None else now
+    ra, rda = a.rating, a.current_rd(now)
+    rb, rdb = b.rating, b.current_rd(now)
+    changes = []
+    for p, r, rd, other, other_rd, s in ((a, ra, rda, rb, rdb, score), (b, rb, rdb, ra, rda, 1 - score)):
+        g = _g(other_rd)
+        e = expected(r, other, other_rd)
+        d2 = 1 / (_Q * _Q * g * g * e * (1 - e))
+        inv = 1 / (rd * rd) + 1 / d2
+        p.rating = r + _Q / inv * g * (s - e)
+        p.rd = max(math.sqrt(1 / inv), MIN_RD)
+        p.games += 1
+        p.wins += s == 1
+        p.draws += s == 0.5
+        p.last = now
+        changes.append(p.rating - r)
+    return changes[0], changes[1]
+
+class PlayerStore:
+    def __init__(self, path=None, flush_interval=FLUSH_INTERVAL):
+        self.players = {}        # user id -> Player
+        self.path = path
+        self.flush_interval = flush_interval
+        self.changed = {}        # user id -> the player's line, not yet written
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = None
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self.players)
+
+    def load(self):
+        # every player of the file, then the file rewritten with one line each; a torn last line is skipped
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        d = json.loads(line)
+                        self.players[d['user']] = Player(d['user'], d['key'], d['rating'], d['rd'], d['games'],
+                                                         d['wins'], d['draws'], d['last'])
+                    except (ValueError, KeyError, TypeError):
+                        pass
+        except FileNotFoundError:
+            pass
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding='utf-8') as f:
+            for p in self.players.values():
+                f.write(json.dumps(p.to_dict()) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def start(self):
+        if self.path:
+            self.file = open(self.path, "a", encoding='utf-8')
+            self.thread = safe_start_thread(self.run, ())
+        return self
+
+    def new(self):
+        # a new player; returns (Player, secret key), the key given out this once
+        key = secrets.token_hex(16)
+        user = secrets.token_hex(6)
+        while user in self.players:
+            user = secrets.token_hex(6)
+        p = self.players[user] = Player(user, hash_key(key))
+        # written at once: a client holding a key the server lost can't get its player back
+        self.saved(p, now=True)
+        return p, key
+
+    def get(self, user, key):
+        # the player with this id and key, or None
+        p = self.players.get(user) if isinstance(user, str) else None
+        if p is None or not isinstance(key, str) or not secrets.compare_digest(p.key, hash_key(key)):
+            return None
+        return p
+
+    def saved(self, p, now=False):
+        # p changed: write it out with the next batch, or straight away
+        if self.thread is not None:
+            line = json.dumps(p.to_dict()) + "\n"
+            with self.cond:
+                self.changed[p.user] = line
+                if now:
+                    self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.closed:
+                    self.cond.wait(self.flush_interval)
+                batch = self.changed
+                self.changed = {}
+                closed = self.closed
+            if batch:
+                try:
+                    self.file.write("".join(batch.values()))
+                    self.file.flush()
+                except OSError as e:
+                    logger.error("ratings_error", error=e)
+            if closed:
+                self.file.close()
+                return
+
+    def close(self):
+        if self.thread is None:
+            return
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
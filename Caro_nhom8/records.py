@@ -0,0 +1,133 @@
+# records.py
+# Compact records of finished games, written by the server (--records FILE) and read back by analyze.py.
+# File: MAGIC, then records back to back. A record is a fixed header followed by its moves packed as
+# int16 x, y pairs; who played each move follows from alternation, starting with the first mover
+# (who plays X). Readers walk the records in place (e.g. over an mmap) without copying the moves.
+# Header: record length (header included), room id, board size (0 = unbounded), win length,
+# bot flags (bit 1 << player number), first mover, result, start and end unix times, move count.
+# The result is P1_WINS, P2_WINS or DRAW; a win that didn't come from the moves (the loser ran out of
+# time, or left a rated game) also has the TIMEOUT or FORFEIT bit set, so readers take winner(result)
+# rather than the result itself.
+import os
+import struct
+import threading
+from array import array
+import logger
+from helper import safe_start_thread
+
+MAGIC = b'CAROGR01'
+FLUSH_INTERVAL = 1.0     # seconds between writes of finished games to the records file
+
+# padded to 36 bytes so the int16 moves (and the next record) stay aligned
+_HEAD = struct.Struct('=I6sBBBBBxddI')
+HEADER_SIZE = _HEAD.size
+
+# results
+P1_WINS, P2_WINS, DRAW = 1, 2, 3
+# result flags: the winner won on time, or by the opponent leaving
+TIMEOUT, FORFEIT = 4, 8
+OUTCOME_MASK = 3
+
+def winner(result):
+    # P1_WINS, P2_WINS or DRAW, without the flags
+    return result & OUTCOME_MASK
+
+def encode(room_id, size, win, bots, first, result, started, ended, moves):
+    # moves: (x, y) in the order played
+    coords = array('h')
+    for x, y in moves:
+        coords.extend((x, y))
+    return _HEAD.pack(HEADER_SIZE + 2 * len(coords), room_id.encode('ascii'), size, win, bots, first, result,
+                      started, ended, len(coords) // 2) + coords.tobytes()
+
+def decode_header(buf, pos):
+    # (length, room id, size, win, bots, first, result, started, ended, move count) of the record at pos
+    length, room_id, *rest = _HEAD.unpack_from(buf, pos)
+    return (length, room_id.rstrip(b'\0').decode('ascii'), *rest)
+
+def check_magic(buf):
+    if bytes(buf[:len(MAGIC)]) != MAGIC:
+        raise ValueError("not a game records file")
+    return len(MAGIC)
+
+def offsets(buf, pos=None):
+    # start offset of every complete record from pos (default: the first one); stops at a torn tail
+    if pos is None:
+        pos = check_magic(buf)
+    end = len(buf)
+    while pos + HEADER_SIZE <= end:
+        length, = struct.unpack_from('=I', buf, pos)
+        if length < HEADER_SIZE or pos + length > end:
+            return
+        yield pos
+        pos += length
+
+def moves_view(view, pos, count):
+    # the record's moves as a flat int16 memoryview (x0, y0, x1, y1, ...) over `view`, no copy
+    start = pos + HEADER_SIZE
+    return view[start:start + 4 * count].cast('h')
+
+def to_dict(buf, pos):
+    # one record as plain data, for export
+    _, room_id, size, win, bots, first, result, started, ended, count = decode_header(buf, pos)
+    coords = array('h')
+    coords.frombytes(bytes(buf[pos + HEADER_SIZE:pos + HEADER_SIZE + 4 * count]))
+    return {'room_id': room_id, 'size': size, 'win': win, 'first': first, 'result': result,
+            'bots': [n for n in (1, 2) if bots & (1 << n)], 'started': started, 'ended': ended,
+            'moves': [[coords[i], coords[i + 1]] for i in range(0, len(coords), 2)]}
+
+def from_dict(d):
+    bots = sum(1 << n for n in d.get('bots', ()))
+    return encode(d['room_id'], d['size'], d['win'], bots, d['first'], d['result'],
+                  d.get('started', 0.0), d.get('ended', 0.0), d['moves'])
+
+class RecordWriter:
+    # appends finished games to a records file; handlers only add to an in-memory batch, a writer
+    # thread does the I/O. Records are not fsynced: they are for analysis, the journal is for recovery.
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.records = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+            self.file.flush()
+
+    def start(self):
+        self.thread = safe_start_thread(self.run, ())
+        return self
+
+    def append(self, record):
+        with self.cond:
+            self.pending.append(record)
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.closed:
+                    self.cond.wait(self.flush_interval)
+                batch = self.pending
+                self.pending = []
+                closed = self.closed
+            if batch:
+                try:
+                    self.file.write(b''.join(batch))
+                    self.file.flush()
+                    self.records += len(batch)
+                except OSError as e:
+                    logger.error("records_error", error=e)
+            if closed:
+                self.file.close()
+                return
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
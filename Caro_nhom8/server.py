@@ -1,334 +1,1750 @@
 # server.py
+import queue
+import secrets
 import socket
 import threading
+import time
 import uuid
-from common import Code, send_msg, recv_msg
+from collections import deque
+from common import Code, FrameReader
+from board import DEFAULT_SIZE, DEFAULT_WIN, valid_rules
+from codec import OPCODES, decode_frame, encode_frame, negotiate, player_num
 from helper import safe_start_thread
+from clock import Clock
+from journal import (CLOSE, CREATE, DRAW, FLAG, FLUSH_INTERVAL, FORFEIT, LEAVE, MOVE, PRIVATE, RATED, SEAT,
+                     START, USER, Journal, encode as encode_record, replay)
+from lobby import MAX_PAGE_SIZE, PAGE_SIZE, WaitingRooms
+from matchmaking import MatchQueue
+from metrics import BYTES_IN, BYTES_OUT, CONNECTIONS_TOTAL, GAMES_TOTAL, HANDLER_SECONDS, HANDOFFS, MESSAGES, TIMEOUTS
+from model import Connection, Room, shared_rules
+import logger
+import metrics
+import ratings
+import records
+from outbound import OutboundQueue
+from timers import TimerWheel
 
-# Data structures kept in RAM:
-# rooms: room_id -> { 'players': [ (sock, addr, player_id) , ...], 'state': {...} , 'created': ts }
+# Data structures kept in RAM (model.py):
+# rooms: room_id -> Room, with its two PlayerSlots. A Connection knows the slot it is seated in
+# (conn.seat) or the room it watches (conn.watching), so a handler never looks its connection up.
 rooms = {}
-# mapping from socket to room_id and player_id
-clients = {}
+# index of the rooms in `rooms` that have one player and can be joined (lobby.py)
+waiting = WaitingRooms()
+# connections receiving LOBBY_UPDATE pushes, and those subscribed since the last tick (snapshot pending)
+lobby_subscribers = set()
+lobby_joining = set()
+# every live connection of the threaded server, for the connection gauges
+connections = set()
+# connections handed over by another worker, while the message they came with is handled
+# (such a message is never handed on again)
+arrived = set()
+# journal.Journal when started with --journal, else None
+journal = None
+# records.RecordWriter for finished games when started with --records, else None
+game_records = None
+# every player identity and rating (ratings.py); kept in memory only unless started with --ratings
+players = ratings.PlayerStore()
+# (size, win) -> MatchQueue of the connections waiting for a rated game with those rules
+match_queues = {}
+# whether a matchmaking sweep is scheduled on the timer wheel
+sweeping = False
 
-LOCK = threading.Lock()
+# Locking model:
+# - ROOMS_LOCK guards only the `rooms`, `waiting` and lobby subscriber indexes and is held for a few
+#   dict operations.
+# - each room has its own lock guarding its seats, game state and spectators, so rooms never wait on
+#   each other. conn.seat and conn.watching are set under the lock of the room they point to; a
+#   handler reads them without a lock, then checks under the room lock that the seat is still its
+#   own (slot.conn is conn) and the room still open.
+# - a room lock may take ROOMS_LOCK briefly, never the other way round.
+# - MATCH_LOCK guards the matchmaking queues and conn.queued. It is held while a pair found in a
+#   queue is seated in a new room, so it comes before room locks; a connection leaves the queues
+#   (under it) before anything else seats it or drops it, and so is never seated twice.
+# - RATINGS_LOCK guards `players` and the ratings in it, for a few field updates; it may be taken
+#   under a room lock, and no other server lock is taken under it.
+# - handlers collect outgoing messages in a list and call deliver() after releasing every lock,
+#   so a slow socket only delays its own room's sender.
+# - deliver()/send() only enqueue on the connection's OutboundQueue; its writer thread does the
+#   blocking I/O and evicts clients that stay past the queue's water marks.
+# - messages to spectators are queued on the room's fan-out deque while the room lock is held, so
+#   they keep the room's order, and are sent later in slices on the fan-out thread (or event loop),
+#   off the players' move path.
+# - journal records are appended to the journal's in-memory batch under the room lock, which keeps
+#   each room's records in order; the journal thread does the writing and fsyncing.
+ROOMS_LOCK = metrics.timed_lock('rooms')
+MATCH_LOCK = metrics.timed_lock('match')
+RATINGS_LOCK = metrics.timed_lock('ratings')
 
-def server_handler(host="127.0.0.1", port=5000):
+# how many times QUICK_MATCH retries when the oldest waiting room fills before it can join
+QUICK_MATCH_TRIES = 3
+# seconds between lobby pushes; room changes within one tick go out as a single coalesced update
+LOBBY_TICK = 0.25
+# spectators sent to per fan-out step; other work (the players' next move) can run between steps
+FANOUT_SLICE = 64
+# most moves sent in one SYNC reply; a client further behind asks again from where the reply ended
+SYNC_PAGE = 256
+# seconds a dropped player's seat and game are held for it to RESUME (0: leave at once, as before)
+RESUME_GRACE = 30.0
+# seconds the seats of rooms recovered from the journal are held for their players to rejoin
+RECOVERY_GRACE = 120.0
+# seconds of silence after which a connection is sent a PING, and after which it is closed
+# (0: never); a connection blocked in recv otherwise holds its thread forever
+IDLE_TIMEOUT = 60.0
+PING_INTERVAL = 20.0
+# seconds a room may go without a join, move or chat before it is closed (0: never); this also
+# expires rooms left waiting for an opponent
+ROOM_IDLE_TIMEOUT = 900.0
+# time control of every game (clock.py; main.py --clock BASE+INC --move-time SEC): seconds on each
+# player's clock and added after each of its moves, and seconds a single move may take; 0 turns each off
+CLOCK_BASE = 0.0
+CLOCK_INCREMENT = 0.0
+MOVE_TIME = 0.0
+# matchmaking: a queued player accepts opponents within MATCH_WINDOW rating points, MATCH_WIDEN
+# more for every second it waits, up to MATCH_MAX_WINDOW; queued players are paired again every
+# MATCH_INTERVAL seconds, at most MATCH_SWEEP pairs at a time
+MATCH_WINDOW = 50.0
+MATCH_WIDEN = 10.0
+MATCH_MAX_WINDOW = 600.0
+MATCH_INTERVAL = 1.0
+MATCH_SWEEP = 500
+# resolution of the timer wheel driving the timeouts above, held seats and game clocks
+TIMER_TICK = 0.1
+# most timers run in one tick; a burst (thousands of clocks running out together) is spread over
+# the next ticks instead of holding up one
+TIMERS_PER_TICK = 1000
+# cluster mode (cluster.py): this worker's shard and the number of workers; 1 is a single server.
+# The first character of a room id is the shard (SHARD_DIGITS) of the worker that owns the room.
+SHARD = 0
+SHARDS = 1
+SHARD_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+# the worker holding the player identities, ratings and matchmaking queues: IDENTIFY and MATCHMAKE
+# go there, so rated rooms are all its own
+RATINGS_SHARD = 0
+# seconds a connection being handed to another worker may take to send what is queued for it
+HANDOFF_TIMEOUT = 5.0
+# messages that name a room, and so may belong to another worker
+ROOM_MESSAGES = frozenset((Code.JOIN_ROOM, Code.RESUME, Code.SPECTATE))
+# messages about players and their ratings, answered by RATINGS_SHARD
+RATED_MESSAGES = frozenset((Code.IDENTIFY, Code.MATCHMAKE))
+# message codes counted under their own name in the metrics; anything else a client sends is 'unknown'
+KNOWN_CODES = frozenset(OPCODES)
+
+def count_seats(kind):
+    # scrape-time count over every room: 'players' seated, 'held' seats, 'spectators' watching
+    n = 0
+    for room in list(rooms.values()):
+        if kind == 'spectators':
+            n += len(room.spectators or ())
+        else:
+            for slot in room.seats:
+                n += (slot.conn if kind == 'players' else slot.held) is not None
+    return n
+
+# gauges, read only when the metrics endpoint is scraped
+metrics.gauge("caro_rooms", "Open rooms.", lambda: len(rooms))
+metrics.gauge("caro_waiting_rooms", "Rooms listed in the lobby.", lambda: len(waiting))
+metrics.gauge("caro_players", "Players seated in a room.", lambda: count_seats('players'))
+metrics.gauge("caro_spectators", "Connections watching a room.", lambda: count_seats('spectators'))
+metrics.gauge("caro_held_seats", "Seats held for a dropped player to resume.", lambda: count_seats('held'))
+metrics.gauge("caro_timers", "Pending timeouts in the timer wheel.", lambda: len(wheel))
+metrics.gauge("caro_lobby_subscribers", "Connections receiving lobby updates.", lambda: len(lobby_subscribers))
+metrics.gauge("caro_matchmaking_queued", "Connections waiting for a rated game.",
+              lambda: sum(len(q) for q in list(match_queues.values())))
+metrics.gauge("caro_rated_players", "Player identities known to the server.", lambda: len(players))
+metrics.gauge("caro_log_dropped_total", "Log lines dropped because the log writer fell behind.",
+              lambda: logger.dropped)
+
+def register_connection_gauges(connections, queued_bytes):
+    # called by the server mode that is running: live connections and bytes waiting to be sent
+    metrics.gauge("caro_connections", "Open client connections.", connections)
+    metrics.gauge("caro_outbound_queued_bytes", "Bytes queued for clients but not yet sent.", queued_bytes)
+
+class LocalPeer(Connection):
+    # an in-process participant standing in for a client connection: send() hands it message dicts
+    # directly instead of encoding frames, through the receive(msg) each subclass defines (BotPlayer
+    # in bot.py)
+    def __init__(self, addr=None):
+        super().__init__(None, addr)
+
+def call_soon(fn, *args):
+    # run a handler on behalf of a LocalPeer; the asyncio server replaces this so that
+    # handlers always run on its event loop thread
+    fn(*args)
+
+# every timeout of the server; advanced by timer_ticker (or its asyncio counterpart)
+wheel = TimerWheel(TIMER_TICK, time.monotonic())
+# timers that came due but were left for the next tick (TIMERS_PER_TICK)
+overdue = deque()
+
+# cluster mode hooks, set by cluster.py: hand_off(shard, fd, state, pending) passes a connection to
+# another worker and returns True once it is on its way; publish_lobby(added, removed) sends the
+# lobby changes of this worker's rooms to the others
+hand_off = None
+publish_lobby = None
+
+class Moved(Exception):
+    # raised while routing a message that belongs to another worker; the connection's reader then
+    # hands the connection over, the message with it
+    def __init__(self, shard):
+        super().__init__(shard)
+        self.shard = shard
+
+def adopt(fd, state, pending):
+    # a connection handed over by another worker (cluster.py), with what its reader had already
+    # received; the asyncio server replaces this to serve it on its event loop
+    sock = socket.socket(fileno=fd)
+    safe_start_thread(handle_client, (sock, tuple(state['addr']), pending, state))
+
+_fanout = None
+_fanout_lock = threading.Lock()
+
+def fanout_worker(jobs):
+    while True:
+        fn, args = jobs.get()
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error("fanout_error", error=e)
+
+def defer(fn, *args):
+    # run fn(*args) soon, in call order, on the fan-out thread (started on first use);
+    # the asyncio server replaces this with loop.call_soon
+    global _fanout
+    if _fanout is None:
+        with _fanout_lock:
+            if _fanout is None:
+                jobs = queue.Queue()
+                safe_start_thread(fanout_worker, (jobs,))
+                _fanout = jobs
+    _fanout.put((fn, args))
+
+def server_handler(host="127.0.0.1", port=5000, journal_dir=None, flush_interval=FLUSH_INTERVAL, records_path=None,
+                   reuse_port=False, ratings_path=None):
+    # reuse_port: one of several workers listening on the same port (cluster.py)
+    if ratings_path:
+        # before the journal: recovered rated rooms find their players
+        start_ratings(ratings_path)
+    if journal_dir:
+        start_journal(journal_dir, flush_interval)
+    if records_path:
+        start_records(records_path)
     srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     srv.bind((host, port))
     srv.listen(50)
-    print("Server listening on", host, port)
+    logger.info("listening", host=host, port=port, mode="threads")
+    register_connection_gauges(lambda: len(connections),
+                               lambda: sum(c.queue.queued for c in list(connections) if c.queue))
+    safe_start_thread(lobby_ticker)
+    safe_start_thread(timer_ticker)
     try:
         while True:
             client_sock, addr = srv.accept()
-            print("Client connected", addr)
+            # frames are already coalesced by the OutboundQueue writer; don't let Nagle delay them further
+            client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            CONNECTIONS_TOTAL.inc()
+            logger.info("client_connected", addr=addr)
             safe_start_thread(handle_client, (client_sock, addr))
     finally:
         srv.close()
 
-def handle_client(sock, addr):
+def new_outbound(conn):
+    addr = conn.addr
+    conn.queue = OutboundQueue(conn.sock, on_evict=lambda s: logger.warning("slow_client_evicted", addr=addr))
+
+def handle_client(sock, addr, preload=b'', moved_in=None):
+    # moved_in: the state of a connection handed over by another worker, preload the bytes its
+    # reader there had received but not handled
+    conn = Connection(sock, addr)
+    new_outbound(conn)
+    connections.add(conn)
+    watch_connection(conn)
+    reader = FrameReader(sock, data=preload)
     try:
-        while True:
-            msg = recv_msg(sock)
-            if msg is None:
-                print("Client disconnected", addr)
-                handle_disconnect(sock)
-                break
-            code = msg.get('code')
-            payload = msg.get('payload')
-            if code == Code.JOIN_ROOM:
-                handle_join_room(sock, addr, payload)
-            elif code == Code.ROOM_CODE:
-                if payload == "LIST":
-                    send_room_list(sock)
-            elif code == Code.MESSAGE_CODE:
-                handle_chat(sock, payload)
-            elif code == Code.MATCH_MOVE:
-                handle_move(sock, payload)
-            elif code == Code.MATCH_RESTART:
-                handle_restart_request(sock, payload)
-            elif code == Code.ROOM_LEAVE:
-                handle_leave_room(sock, payload)
-            elif code == Code.MATCH_DRAW_REQUEST:
-                handle_draw_request(sock, payload)
-            elif code == Code.MATCH_DRAW_ACCEPT:
-                handle_draw_accept(sock, payload)
-            elif code == Code.MATCH_DRAW_REJECT:
-                handle_draw_reject(sock, payload)
-            else:
-                send_msg(sock, {'code': Code.ERROR, 'payload': 'Unknown code'})
+        if moved_in:
+            arrive(conn, moved_in)
+        for body in reader.frames():
+            BYTES_IN.inc(4 + len(body))
+            conn.last_seen = wheel.tick
+            msg = decode_frame(body)
+            try:
+                dispatch(conn, msg)
+            except Moved as moved:
+                if move_connection(conn, msg, moved.shard, reader.pending()):
+                    return
+        logger.info("client_disconnected", addr=addr)
+        handle_disconnect(conn)
     except Exception as e:
-        print("Exception in client handler:", e)
-        handle_disconnect(sock)
+        logger.error("client_handler_error", addr=addr, error=e)
+        handle_disconnect(conn)
     finally:
+        connections.discard(conn)
+        unsubscribe_lobby(conn)
+        conn.last_seen = None
+        if conn.queue:
+            conn.queue.close()
         try:
             sock.close()
         except:
             pass
 
-def handle_join_room(sock, addr, payload):
-    action = payload.get('action')
-    with LOCK:
-        if action == "CREATE":
-            room_id = str(uuid.uuid4())[:6]
-            rooms[room_id] = {
-                'players': [(sock, addr, "Player 1")],
-                'state': make_new_state(),
-            }
-            clients[sock] = {'room_id': room_id, 'player_id': "Player 1"}
-            send_msg(sock, {'code': Code.JOIN_ROOM, 'payload': {'status': 'WAIT', 'room_id': room_id, 'player_id': "Player 1"}})
-            print(f"Room {room_id} created by {addr}")
-        elif action == "JOIN":
-            room_id = payload.get('room_id')
-            if not room_id or room_id not in rooms:
-                send_msg(sock, {'code': Code.ERROR, 'payload': 'Room not found'})
-                return
-            room = rooms[room_id]
-            if len(room['players']) >= 2:
-                send_msg(sock, {'code': Code.ERROR, 'payload': 'Room full'})
-                return
-            assigned_id = "Player 2"
-            room['players'].append((sock, addr, assigned_id))
-            clients[sock] = {'room_id': room_id, 'player_id': assigned_id}
-
-            if len(room['players']) == 2:
-                # start match
-                p1_sock, _, p1_id = room['players'][0]
-                p2_sock, _, p2_id = room['players'][1]
-                # initialize state
-                room['state'] = make_new_state()
-                room['state']['turn'] = p1_id  # p1 starts
-                room['state']['symbols'] = {p1_id: 'X', p2_id: 'O'}
-                # notify both
-                send_msg(p1_sock, {'code': Code.MATCH_START,
-                                   'payload': {'you': p1_id, 'opponent': p2_id, 'symbol': 'X', 'room_id': room_id, 'first_turn': p1_id}})
-                send_msg(p2_sock, {'code': Code.MATCH_START,
-                                   'payload': {'you': p2_id, 'opponent': p1_id, 'symbol': 'O', 'room_id': room_id, 'first_turn': p1_id}})
-                print(f"Match started in room {room_id} between {p1_id} and {p2_id}")
+def move_connection(conn, msg, shard, pending):
+    # hand a connection of the threaded server to worker `shard` once its queued replies are out;
+    # False if that failed, and it carries on here
+    state = detach(conn, msg)
+    if conn.queue.finish(HANDOFF_TIMEOUT) and hand_off(shard, conn.sock.fileno(), state, pending):
+        logger.info("client_moved", addr=conn.addr, shard=shard)
+        return True
+    new_outbound(conn)
+    undo_detach(conn, state)
+    return False
+
+def detach(conn, msg):
+    # a connection about to go to another worker leaves the lobby subscribers and the room it
+    # watches; returns what the other worker needs to carry on with it
+    stop_spectating(conn)
+    leave_queue(conn)
+    with ROOMS_LOCK:
+        subscribed = conn in lobby_subscribers or conn in lobby_joining
+        lobby_subscribers.discard(conn)
+        lobby_joining.discard(conn)
+    return {'msg': msg, 'addr': list(conn.addr), 'protocol': conn.protocol, 'lobby': subscribed,
+            'user': conn.user.user if conn.user is not None else None}
+
+def undo_detach(conn, state):
+    # the hand-off failed: the connection stays, and the player is told to try again
+    HANDOFFS.inc_label('failed')
+    if state['lobby']:
+        with ROOMS_LOCK:
+            lobby_joining.add(conn)
+    send(conn, {'code': Code.ERROR, 'payload': 'Server busy, try again'})
+
+def arrive(conn, state):
+    # the other end of detach(), on the worker the connection was handed to: restore what it had
+    # negotiated and subscribed to, then handle the message it came with
+    HANDOFFS.inc_label('in')
+    conn.protocol = state['protocol']
+    user = state.get('user')
+    if user is not None:
+        # only RATINGS_SHARD has the player; elsewhere its id is kept for the way back there
+        with RATINGS_LOCK:
+            conn.user = players.players.get(user) if SHARD == RATINGS_SHARD else ratings.Player(user, None)
+    if state['lobby']:
+        with ROOMS_LOCK:
+            lobby_joining.add(conn)
+    arrived.add(conn)
+    try:
+        dispatch(conn, state['msg'])
+    finally:
+        arrived.discard(conn)
+
+def dispatch(conn, msg):
+    # route one decoded message to its handler, counted and timed by code; shared by the threaded
+    # and asyncio servers
+    code = msg.get('code')
+    if code not in KNOWN_CODES:
+        code = 'unknown'
+    t0 = time.perf_counter()
+    try:
+        route(conn, msg.get('code'), msg.get('payload'))
+    finally:
+        MESSAGES.inc_label(code)
+        HANDLER_SECONDS.observe(code, time.perf_counter() - t0)
+
+def route(conn, code, payload):
+    if SHARDS > 1 and code in ROOM_MESSAGES and conn not in arrived:
+        check_shard(conn, code, payload)
+    elif SHARDS > 1 and code in RATED_MESSAGES and SHARD != RATINGS_SHARD and conn not in arrived:
+        if not check_ratings_shard(conn, code, payload):
+            return
+    if code == Code.MATCH_MOVE:
+        # the hot path first
+        handle_move(conn, payload)
+    elif code == Code.HELLO:
+        handle_hello(conn, payload)
+    elif code == Code.PING:
+        send(conn, {'code': Code.PONG, 'payload': payload})
+    elif code == Code.PONG:
+        # any message counts as activity; handle_client has noted it
+        pass
+    elif code == Code.JOIN_ROOM:
+        handle_join_room(conn, payload)
+    elif code == Code.ROOM_CODE:
+        if payload == "LIST":
+            send_room_list(conn, {})
+        elif isinstance(payload, dict) and payload.get('action') == "LIST":
+            send_room_list(conn, payload)
+    elif code == Code.QUICK_MATCH:
+        handle_quick_match(conn, payload or {})
+    elif code == Code.IDENTIFY:
+        handle_identify(conn, payload or {})
+    elif code == Code.MATCHMAKE:
+        handle_matchmake(conn, payload or {})
+    elif code == Code.LOBBY_SUBSCRIBE:
+        handle_lobby_subscribe(conn, payload or {})
+    elif code == Code.SPECTATE:
+        handle_spectate(conn, payload or {})
+    elif code == Code.RESUME:
+        handle_resume(conn, payload or {})
+    elif code == Code.MESSAGE_CODE:
+        handle_chat(conn, payload)
+    elif code == Code.SYNC:
+        handle_sync(conn, payload or {})
+    elif code == Code.MATCH_RESTART:
+        handle_restart_request(conn, payload)
+    elif code == Code.ROOM_LEAVE:
+        handle_leave_room(conn, payload)
+    elif code == Code.MATCH_DRAW_REQUEST:
+        handle_draw_request(conn, payload)
+    elif code == Code.MATCH_DRAW_ACCEPT:
+        handle_draw_accept(conn, payload)
+    elif code == Code.MATCH_DRAW_REJECT:
+        handle_draw_reject(conn, payload)
+    else:
+        send(conn, {'code': Code.ERROR, 'payload': 'Unknown code'})
+
+def check_shard(conn, code, payload):
+    # raise Moved for a message about a room of another worker, from a connection free to go there
+    if not isinstance(payload, dict) or isinstance(conn, LocalPeer):
+        return
+    if code == Code.JOIN_ROOM and payload.get('action') not in ("JOIN", "REJOIN"):
+        return
+    shard = shard_of(payload.get('room_id'))
+    if shard is None or shard == SHARD:
+        return
+    if conn.seat is None:
+        HANDOFFS.inc_label('out')
+        raise Moved(shard)
+
+def check_ratings_shard(conn, code, payload):
+    # raise Moved for IDENTIFY or MATCHMAKE from a connection free to go to RATINGS_SHARD; False if
+    # it can't go now, and has been told so
+    if isinstance(conn, LocalPeer) or not isinstance(payload, dict):
+        return True
+    if code == Code.MATCHMAKE and payload.get('action') == 'LEAVE':
+        # a connection leaves the queue as it leaves RATINGS_SHARD: nothing to go back for
+        return True
+    if conn.seat is None:
+        HANDOFFS.inc_label('out')
+        raise Moved(RATINGS_SHARD)
+    if code == Code.IDENTIFY:
+        send(conn, {'code': Code.IDENTIFY, 'payload': {'error': 'Not while in a room'}})
+    else:
+        send(conn, {'code': Code.ERROR, 'payload': 'Already in a room'})
+    return False
+
+def new_room_id():
+    # caller holds ROOMS_LOCK; in cluster mode the first character names this worker
+    while True:
+        room_id = str(uuid.uuid4())[:6]
+        if SHARDS > 1:
+            room_id = SHARD_DIGITS[SHARD] + room_id[1:]
+        if room_id not in rooms:
+            return room_id
+
+def shard_of(room_id):
+    # the worker a room id belongs to, or None if it isn't one of the cluster's
+    if not isinstance(room_id, str) or not room_id:
+        return None
+    shard = SHARD_DIGITS.find(room_id[0])
+    return shard if 0 <= shard < SHARDS else None
+
+def send(conn, msg):
+    # queue one message for a connection, encoded in its negotiated protocol
+    if isinstance(conn, LocalPeer):
+        conn.receive(msg)
+        return
+    send_frame(conn, encode_frame(msg, conn.protocol))
+
+def send_frame(conn, frame):
+    # queue an already encoded frame; connections without a queue (asyncio adapter) are written directly
+    BYTES_OUT.inc(len(frame))
+    q = conn.queue
+    if q is not None:
+        q.put(frame)
+        return
+    try:
+        conn.sock.sendall(frame)
+    except OSError:
+        # the receiver's own handler notices the broken socket and cleans up
+        pass
+
+def deliver(out):
+    # called after every lock has been released
+    for conn, msg in out:
+        send(conn, msg)
+
+def broadcast(conns, msg, frames=None):
+    # the same message to many connections, encoded once per wire protocol; callers sending one
+    # message along several paths can share `frames` (protocol -> frame) between the calls.
+    # msg may be a list of messages, which then go out in one write per connection.
+    if frames is None:
+        frames = {}
+    for conn in conns:
+        if isinstance(conn, LocalPeer):
+            if isinstance(msg, list):
+                for m in msg:
+                    conn.receive(m)
             else:
-                # waiting for opponent
-                send_msg(sock, {'code': Code.JOIN_ROOM, 'payload': {'status': 'WAIT', 'room_id': room_id, 'player_id': assigned_id}})
-                print(f"{assigned_id} joined room {room_id}, waiting for opponent")
-        else:
-            send_msg(sock, {'code': Code.ERROR, 'payload': 'Invalid JOIN_ROOM action'})
-
-def send_room_list(sock):
-    with LOCK:
-        waiting = []
-        for rid, r in rooms.items():
-            if len(r['players']) == 1:
-                waiting.append({'room_id': rid})
-        send_msg(sock, {'code': Code.ROOM_LIST, 'payload': waiting})
-
-def handle_chat(sock, payload):
-    info = clients.get(sock)
-    if not info:
-        send_msg(sock, {'code': Code.ERROR, 'payload': 'Not in a room'})
+                conn.receive(msg)
+            continue
+        proto = conn.protocol
+        frame = frames.get(proto)
+        if frame is None:
+            if isinstance(msg, list):
+                frame = b''.join(encode_frame(m, proto) for m in msg)
+            else:
+                frame = encode_frame(msg, proto)
+            frames[proto] = frame
+        send_frame(conn, frame)
+
+def handle_hello(conn, payload):
+    # the reply still goes out in JSON; everything after it uses the chosen protocol
+    version = negotiate((payload or {}).get('versions'))
+    send(conn, {'code': Code.HELLO, 'payload': {'version': version}})
+    conn.protocol = version
+
+def new_token():
+    # rejoin token for a seat: 8 ASCII characters (journal.SEAT)
+    return secrets.token_hex(4)
+
+def log_event(room, kind, *fields):
+    # journal one room event; caller holds room.lock, or the room isn't published yet
+    if journal is None:
         return
-    room_id = info['room_id']
-    with LOCK:
-        room = rooms.get(room_id)
-        if not room:
-            send_msg(sock, {'code': Code.ERROR, 'payload': 'Room not found'})
+    room.jseq += 1
+    journal.append(encode_record(kind, room.id, room.jseq, *fields))
+
+def record_game(room):
+    # count and store a game that just finished (room.result set); caller holds room.lock
+    result = room.result
+    GAMES_TOTAL.inc_label('draw' if result.get('draw') else 'timeout' if result.get('timeout')
+                          else 'forfeit' if result.get('forfeit') else 'win')
+    if room.rated:
+        rate_game(room)
+    if game_records is None:
+        return
+    p1, p2 = room.seats
+    first = p1 if p1.symbol == 'X' else p2
+    bots = 0
+    for slot in room.seats:
+        if isinstance(slot.conn, LocalPeer) or slot.held:
+            bots |= 1 << slot.num
+    if result.get('draw'):
+        outcome = records.DRAW
+    else:
+        outcome = player_num(result['winner'])
+        if result.get('timeout'):
+            outcome |= records.TIMEOUT
+        elif result.get('forfeit'):
+            outcome |= records.FORFEIT
+    game_records.append(records.encode(
+        room.id, room.rules['size'], room.rules['win'], bots, first.num, outcome,
+        room.started, time.time(), [(x, y) for _, x, y in room.moves]))
+
+def close_room(room):
+    # caller holds room.lock
+    room.closed = True
+    stop_clock(room)
+    log_event(room, CLOSE)
+    watchers = room.spectators
+    room.spectators = None
+    with ROOMS_LOCK:
+        if rooms.get(room.id) is room:
+            del rooms[room.id]
+            waiting.discard(room.id)
+    if watchers:
+        for conn in watchers:
+            if conn.watching is room:
+                conn.watching = None
+        queue_fanout(room, list(watchers), {'code': Code.SPECTATE, 'payload': {'room_id': room.id, 'closed': True}})
+
+def update_waiting(room):
+    # caller holds room.lock and ROOMS_LOCK; list the room iff one player is waiting in it
+    p1, p2 = room.seats
+    if (not room.closed and not room.private and p1.held is None and p2.held is None
+            and (p1.conn is None) != (p2.conn is None)):
+        waiting.add(room.id, room.rules)
+    else:
+        waiting.discard(room.id)
+
+def handle_join_room(conn, payload):
+    action = payload.get('action')
+    # a player taking a seat itself stops waiting for a rated game
+    leave_queue(conn)
+    if action in ("CREATE", "JOIN") and conn.seat is not None:
+        send(conn, {'code': Code.ERROR, 'payload': 'Already in a room'})
+        return
+    if action == "CREATE":
+        size, win = payload.get('size', DEFAULT_SIZE), payload.get('win', DEFAULT_WIN)
+        if not valid_rules(size, win):
+            send(conn, {'code': Code.ERROR, 'payload': 'Invalid board size'})
+            return
+        ai = payload.get('opponent') == 'ai'
+        room = create_room(conn, shared_rules(size, win), private=ai)
+        if ai:
+            add_bot(room.id)
+    elif action == "JOIN":
+        error = join_room(conn, payload.get('room_id'))
+        if error:
+            send(conn, {'code': Code.ERROR, 'payload': error})
+    elif action == "REJOIN":
+        error = rejoin_room(conn, payload.get('room_id'), payload.get('token'), payload.get('seq'))
+        if error:
+            send(conn, {'code': Code.ERROR, 'payload': error})
+    else:
+        send(conn, {'code': Code.ERROR, 'payload': 'Invalid JOIN_ROOM action'})
+
+def create_room(conn, rules, private=False, rated=False):
+    # a new room with conn waiting in it; returns the room
+    room = Room(None, rules, private or rated, wheel.tick, rated)
+    slot = room.seats[0]
+    slot.token = new_token()
+    # the room lock is held until it is journaled, so a joiner's records can't come first
+    slot.conn = conn
+    with room.lock:
+        conn.seat = slot
+        with ROOMS_LOCK:
+            room.id = new_room_id()
+            rooms[room.id] = room
+            update_waiting(room)
+        log_event(room, CREATE, rules['size'], rules['win'], room.private * PRIVATE | rated * RATED)
+        log_event(room, SEAT, slot.num, isinstance(conn, LocalPeer), slot.token.encode('ascii'))
+        seat_user(slot, conn)
+    send(conn, {'code': Code.JOIN_ROOM, 'payload': {'status': 'WAIT', 'room_id': room.id, 'player_id': slot.name,
+                                                    'token': slot.token, **rules}})
+    watch_room(room)
+    logger.info("room_created", room=room.id, by=conn.addr)
+    return room
+
+def join_room(conn, room_id):
+    # seat conn in room_id and start the game; returns an error message instead if it can't
+    with ROOMS_LOCK:
+        room = rooms.get(room_id) if room_id else None
+    if not room:
+        return 'Room not found'
+    out = []
+    with room.lock:
+        if room.closed:
+            return 'Room not found'
+        p1, p2 = room.seats
+        if p1.held is not None or p2.held is not None or (p1.conn is None) == (p2.conn is None):
+            return 'Room full'
+        # the seat left free: a room re-listed after Player 1 left still holds "Player 2"
+        slot = p2 if p2.conn is None else p1
+        first = slot.opponent   # the player who waited plays X and starts
+        slot.conn = conn
+        conn.seat = slot
+        room.active = wheel.tick
+        slot.token = new_token()
+        log_event(room, SEAT, slot.num, isinstance(conn, LocalPeer), slot.token.encode('ascii'))
+        seat_user(slot, conn)
+        with ROOMS_LOCK:
+            update_waiting(room)
+        room.start(first)
+        log_event(room, START, first.num)
+        start_clock(room)
+        rules = room.rules
+        # the joiner's rejoin token, then notify both
+        out.append((conn, {'code': Code.JOIN_ROOM, 'payload': {'status': 'JOINED', 'room_id': room.id,
+                                                               'player_id': slot.name, 'token': slot.token, **rules}}))
+        for p in (first, slot):
+            payload = {'you': p.name, 'opponent': p.opponent.name, 'symbol': p.symbol,
+                       'room_id': room.id, 'first_turn': first.name, **rules}
+            if room.clock is not None:
+                payload['clock'] = room.clock.settings()
+            if room.rated:
+                payload['ratings'] = rating_state(room)
+            out.append((p.conn, {'code': Code.MATCH_START, 'payload': payload}))
+        notify_spectators(room)
+    deliver(out)
+    logger.info("match_started", room=room.id, x=first.name, o=slot.name)
+    return None
+
+def rejoin_room(conn, room_id, token, since=None):
+    # take back a held seat with its session token; returns an error message if it can't.
+    # `since`: the number of moves of the current game the player already has; if given, only the
+    # moves after it are sent (RESUME), otherwise the whole game (JOIN_ROOM REJOINED).
+    if conn.seat is not None:
+        return 'Already in a room'
+    with ROOMS_LOCK:
+        room = rooms.get(room_id) if room_id else None
+    if not room:
+        return 'Room not found'
+    with room.lock:
+        if room.closed:
+            return 'Room not found'
+        slot = next((s for s in room.seats if s.held is not None and s.token == token), None)
+        if slot is None:
+            return 'Invalid session token'
+        slot.held = None
+        slot.conn = conn
+        conn.seat = slot
+        room.active = wheel.tick
+        timer, slot.timer = slot.timer, None
+        with ROOMS_LOCK:
+            update_waiting(room)
+        if timer:
+            wheel.cancel(timer)
+        # sent before the lock is released, so no later move of the opponent can overtake it
+        send(conn, resume_msg(slot, since))
+        opponent = slot.opponent.conn
+        if opponent is not None:
+            send(opponent, {'code': Code.RESUME, 'payload': {'room_id': room.id, 'returned': slot.name}})
+        notify_spectators(room)
+    logger.info("seat_rejoined", room=room.id, player=slot.name)
+    return None
+
+def resume_msg(slot, since=None):
+    # what a player coming back needs to carry on; caller holds room.lock
+    room = slot.room
+    moves = room.moves
+    turn = room.turn.name if room.turn else None
+    opponent_present = slot.opponent.conn is not None
+    if slot.symbol and isinstance(since, int) and not isinstance(since, bool) and 0 <= since <= len(moves):
+        sym_of = (None, room.seats[0].symbol, room.seats[1].symbol)
+        return {'code': Code.RESUME, 'payload': {
+            'room_id': room.id, 'player_id': slot.name, 'seq': len(moves),
+            'moves': [[x, y, sym_of[n]] for n, x, y in moves[since:]],
+            'turn': turn, 'finished': room.finished, 'result': room.result,
+            'opponent_present': opponent_present, **clock_state(room)}}
+    payload = {'room_id': room.id, 'player_id': slot.name, 'token': slot.token, **room.rules}
+    if not slot.symbol:
+        payload['status'] = 'WAIT'
+    else:
+        sym_of = (None, room.seats[0].symbol, room.seats[1].symbol)
+        payload.update({'status': 'REJOINED', 'symbol': slot.symbol, 'opponent': slot.opponent.name,
+                        'opponent_present': opponent_present,
+                        'turn': turn, 'finished': room.finished, 'result': room.result,
+                        'moves': [[x, y, sym_of[n]] for n, x, y in moves], **clock_state(room)})
+    return {'code': Code.JOIN_ROOM, 'payload': payload}
+
+def handle_resume(conn, payload):
+    # a dropped player on a new connection: {'room_id', 'token', 'seq': moves it has of the current game}
+    leave_queue(conn)
+    error = rejoin_room(conn, payload.get('room_id'), payload.get('token'), payload.get('seq'))
+    if error:
+        send(conn, {'code': Code.RESUME, 'payload': {'room_id': payload.get('room_id'), 'error': error}})
+
+def hold_seat(slot, grace, bot=False):
+    # keep a dropped player's seat for `grace` seconds; caller holds room.lock
+    slot.held = bot
+    slot.timer = wheel.schedule(grace, release_seat, slot)
+
+def release_seat(slot):
+    # a held seat nobody came back to: the player leaves the room for good
+    room = slot.room
+    out = []
+    deleted = False
+    with room.lock:
+        timer = slot.timer
+        if timer is not None and timer.slot is not None:
+            # a late call: the seat was taken back and held again since, under a newer timer
             return
-        for p_sock, _, p_id in room['players']:
-            if p_sock != sock:
-                send_msg(p_sock, {'code': Code.MESSAGE_CODE, 'payload': {'from': info['player_id'], 'text': payload.get('text')}})
-
-def handle_move(sock, payload):
-    info = clients.get(sock)
-    if not info:
-        send_msg(sock, {'code': Code.ERROR, 'payload': 'Not in room'})
+        slot.timer = None
+        if room.closed or slot.held is None:
+            return
+        # a rated game the player dropped out of is lost
+        out.extend(forfeit(room, slot))
+        slot.held = None
+        slot.token = None
+        slot.user = None
+        log_event(room, LEAVE, slot.num)
+        # no game until somebody else sits down
+        stop_clock(room)
+        for conn in room.conns():
+            out.append((conn, {'code': Code.MATCH_LEFT, 'payload': {'left_player': slot.name}}))
+            out.append((conn, {'code': Code.ROOM_LEAVE, 'payload': {'left_player': slot.name}}))
+        if slot.opponent.taken():
+            notify_spectators(room)
+            with ROOMS_LOCK:
+                update_waiting(room)
+        else:
+            close_room(room)
+            deleted = True
+    deliver(out)
+    logger.info("seat_released", room=room.id, player=slot.name, room_deleted=deleted)
+
+# timeouts
+def run_timers():
+    # fire the timeouts that have come due, up to TIMERS_PER_TICK; runs on the timer thread (or the event loop)
+    overdue.extend(wheel.advance(time.monotonic()))
+    batch = [overdue.popleft() for _ in range(min(len(overdue), TIMERS_PER_TICK))]
+    wheel.run(batch, lambda e: logger.error("timer_error", error=e))
+
+def timer_ticker():
+    while True:
+        time.sleep(TIMER_TICK)
+        run_timers()
+
+def watch_connection(conn):
+    # start the idle timeout of a new connection; its reader stamps conn.last_seen on every message
+    if IDLE_TIMEOUT > 0:
+        conn.last_seen = wheel.tick
+        wheel.schedule(min(PING_INTERVAL, IDLE_TIMEOUT), check_idle, conn)
+
+def check_idle(conn):
+    # ping a connection silent for PING_INTERVAL, close it once silent for IDLE_TIMEOUT; otherwise
+    # look again when it could next be due
+    last = conn.last_seen
+    if last is None:
+        return
+    idle = wheel.seconds(wheel.tick - last)
+    if idle >= IDLE_TIMEOUT:
+        TIMEOUTS.inc_label('connection')
+        logger.info("idle_timeout", addr=conn.addr, idle=round(idle, 1))
+        try:
+            # wakes the reader, which then disconnects it like any dropped client (seat held for RESUME)
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    elif idle >= PING_INTERVAL:
+        send(conn, {'code': Code.PING, 'payload': None})
+        wheel.schedule_at(last + wheel.ticks(IDLE_TIMEOUT), check_idle, conn)
+    else:
+        wheel.schedule_at(last + wheel.ticks(PING_INTERVAL), check_idle, conn)
+
+def watch_room(room):
+    if ROOM_IDLE_TIMEOUT > 0:
+        wheel.schedule_at(room.active + wheel.ticks(ROOM_IDLE_TIMEOUT), check_room, room)
+
+def check_room(room):
+    if room.closed:
         return
-    room_id = info['room_id']
-    player_id = info['player_id']
-    with LOCK:
-        room = rooms.get(room_id)
-        if not room:
-            send_msg(sock, {'code': Code.ERROR, 'payload': 'Room missing'})
+    if wheel.seconds(wheel.tick - room.active) >= ROOM_IDLE_TIMEOUT:
+        expire_room(room)
+    else:
+        watch_room(room)
+
+def expire_room(room):
+    # close a room nobody has joined, moved or chatted in for ROOM_IDLE_TIMEOUT; its players go
+    # back to the lobby and held seats are given up
+    out = []
+    timers = []
+    with room.lock:
+        if room.closed:
             return
-        state = room['state']
-        if len(room['players']) < 2:
-            send_msg(sock, {'code': Code.ERROR, 'payload': 'Opponent missing'})
+        players = room.conns()
+        held = len(room.held())
+        if room.turn is not None:
+            # a rated game nobody moved in for so long is lost by the player who was to move
+            out.extend(forfeit(room, room.turn))
+        for slot in room.seats:
+            if slot.conn is not None:
+                slot.conn.seat = None
+                slot.conn = None
+            if slot.timer is not None:
+                timers.append(slot.timer)
+                slot.timer = None
+            slot.held = None
+            slot.token = None
+            slot.user = None
+        for conn in players:
+            out.append((conn, {'code': Code.ROOM_LEAVE_SUCCESS, 'payload': {'reason': 'inactive'}}))
+        close_room(room)
+    for timer in timers:
+        wheel.cancel(timer)
+    deliver(out)
+    TIMEOUTS.inc_label('room')
+    logger.info("room_expired", room=room.id, players=len(players), held=held)
+
+# game clocks: one wheel timer per room with a time control, due by the deadline of the player to
+# move; a tick only touches the rooms whose timer is due
+def start_clock(room):
+    # the clock of a game that has just started, with the server's time control; caller holds room.lock
+    stop_clock(room)
+    if CLOCK_BASE > 0 or MOVE_TIME > 0:
+        now = time.monotonic()
+        room.clock = Clock(CLOCK_BASE, CLOCK_INCREMENT, MOVE_TIME, now)
+        wind_clock(room, now)
+
+def stop_clock(room):
+    # caller holds room.lock
+    clock = room.clock
+    if clock is not None:
+        room.clock = None
+        if clock.timer is not None:
+            wheel.cancel(clock.timer)
+
+def wind_clock(room, now):
+    # make sure the flag fall of the player to move is looked at by its deadline; caller holds room.lock.
+    # A pending timer due sooner is kept: it winds the clock again when it fires, which is cheaper
+    # than moving it on every move (as with idle connections).
+    clock = room.clock
+    tick = wheel.tick + wheel.ticks(clock.deadline(room.turn.num) - (now - clock.since))
+    timer = clock.timer
+    if timer is not None and timer.slot is not None:
+        if timer.expires <= tick:
             return
-        if state.get('finished'):
-            send_msg(sock, {'code': Code.ERROR, 'payload': 'Match finished'})
+        wheel.cancel(timer)
+    clock.timer = wheel.schedule_at(tick, flag_fall, room, clock)
+
+def flag_fall(room, clock):
+    with room.lock:
+        timer = clock.timer
+        if room.clock is not clock or (timer is not None and timer.slot is not None):
+            # a late call: the game is over or restarted, or a move was made since
             return
-        if state.get('turn') != player_id:
-            send_msg(sock, {'code': Code.ERROR, 'payload': 'Not your turn'})
+        clock.timer = None
+        if not room.turn.taken() or not room.turn.opponent.taken():
+            stop_clock(room)
             return
-        x = payload.get('x'); y = payload.get('y')
-        if not (0 <= x < 10 and 0 <= y < 10):
-            send_msg(sock, {'code': Code.ERROR, 'payload': 'Invalid move'})
+        now = time.monotonic()
+        if not clock.expired(room.turn.num, now):
+            # the wheel's ticks are coarser than the clock
+            wind_clock(room, now)
             return
-        if state['board'][y][x] != '':
-            send_msg(sock, {'code': Code.ERROR, 'payload': 'Cell occupied'})
+        loser = room.turn
+        out = time_out(room)
+    deliver(out)
+    logger.info("flag_fall", room=room.id, player=loser.name)
+
+def time_out(room):
+    # the player to move has run out of time and loses; returns the messages to deliver. Caller
+    # holds room.lock.
+    loser = room.turn
+    stop_clock(room)
+    room.finished = True
+    room.result = {'winner': loser.opponent.name, 'timeout': loser.name}
+    for slot in room.seats:
+        slot.premove = None
+    log_event(room, FLAG, loser.num)
+    record_game(room)
+    TIMEOUTS.inc_label('clock')
+    notify_spectators(room)
+    msg = {'code': Code.MATCH_TIMEOUT, 'payload': {'loser': loser.name, 'winner': loser.opponent.name}}
+    return [(conn, msg) for conn in room.conns()] + rating_news(room)
+
+def clock_state(room):
+    # the time control and the time both players have left, for a player or spectator catching up:
+    # {} without a time control; caller holds room.lock
+    clock = room.clock
+    if clock is None:
+        return {}
+    now = time.monotonic()
+    state = clock.settings()
+    if clock.base:
+        state['left'] = {slot.name: round(clock.remaining(slot.num, slot is room.turn, now), 3) for slot in room.seats}
+    return {'clock': state}
+
+def handle_quick_match(conn, payload):
+    # join the room that has waited longest (with the requested rules, if any), or create one and wait
+    rules = None
+    if 'size' in payload or 'win' in payload:
+        size, win = payload.get('size', DEFAULT_SIZE), payload.get('win', DEFAULT_WIN)
+        if not valid_rules(size, win):
+            send(conn, {'code': Code.ERROR, 'payload': 'Invalid board size'})
             return
-        sym = state['symbols'][player_id]
-        state['board'][y][x] = sym
-        winner = check_winner(state['board'], x, y, sym)
-        # determine opponent socket
-        opponent_sock = None
-        for p_sock, _, p_id in room['players']:
-            if p_id != player_id:
-                opponent_sock = p_sock
-                opp_id = p_id
-                break
-        if not winner:
-            state['turn'] = opp_id
+        rules = shared_rules(size, win)
+    leave_queue(conn)
+    if conn.seat is not None:
+        send(conn, {'code': Code.ERROR, 'payload': 'Already in a room'})
+        return
+    # another player may take the oldest room first; then try the next oldest
+    for _ in range(QUICK_MATCH_TRIES):
+        with ROOMS_LOCK:
+            room_id = waiting.oldest(rules)
+        if room_id is None or join_room(conn, room_id) is None:
+            break
+    else:
+        room_id = None
+    if room_id is None and SHARDS > 1 and conn not in arrived and not isinstance(conn, LocalPeer):
+        # nobody waiting here: join the oldest room waiting on another worker, over there
+        with ROOMS_LOCK:
+            remote = waiting.oldest(rules, local=False)
+        shard = shard_of(remote)
+        if shard is not None and shard != SHARD:
+            HANDOFFS.inc_label('out')
+            raise Moved(shard)
+    if room_id is None:
+        create_room(conn, rules or shared_rules(DEFAULT_SIZE, DEFAULT_WIN))
+
+def add_bot(room_id):
+    # seat an AI opponent as Player 2; it joins through the normal JOIN path
+    from bot import BotPlayer
+    handle_join_room(BotPlayer(('ai', room_id)), {'action': 'JOIN', 'room_id': room_id})
+
+# rated games: player identities (IDENTIFY), a matchmaking queue per rules (MATCHMAKE) that seats
+# players of about the same rating in a new rated room, and the players' ratings updated as its
+# games finish
+def handle_identify(conn, payload):
+    # {'user', 'key'}: play as that player from here on; {}: as a new player, whose key is sent back
+    # this once. Replies with the player's profile, or {'error'}.
+    user = payload.get('user')
+    key = None
+    with RATINGS_LOCK:
+        if user is None:
+            player, key = players.new()
         else:
-            state['finished'] = True
-            state['result'] = {'winner': player_id}
-        for p_sock, _, p_id in room['players']:
-            send_msg(p_sock, {'code': Code.MATCH_MOVE, 'payload': {'x': x, 'y': y, 'symbol': sym, 'by': player_id, 'winner': winner}})
-        if winner:
-            print(f"Winner in room {room_id}: {player_id}")
+            player = players.get(user, payload.get('key'))
+        profile = player.profile() if player is not None else None
+    if player is None:
+        send(conn, {'code': Code.IDENTIFY, 'payload': {'error': 'Unknown player'}})
+        return
+    if conn.user is not player:
+        # queued under the old rating
+        leave_queue(conn)
+        conn.user = player
+    if key is not None:
+        profile['key'] = key
+    send(conn, {'code': Code.IDENTIFY, 'payload': profile})
 
-def handle_restart_request(sock, payload):
-    info = clients.get(sock)
-    if not info:
+def handle_matchmake(conn, payload):
+    # {'action': 'JOIN'} (optionally with 'size', 'win'): wait for a rated game against a player of
+    # about the same rating, as a new player if conn hasn't identified; {'action': 'LEAVE'}: stop waiting
+    action = payload.get('action', 'JOIN')
+    if action == 'LEAVE':
+        left = leave_queue(conn)
+        send(conn, {'code': Code.MATCHMAKE, 'payload': {'status': 'LEFT' if left else 'NOT_QUEUED'}})
+        return
+    if action != 'JOIN':
+        send(conn, {'code': Code.ERROR, 'payload': 'Invalid MATCHMAKE action'})
         return
-    room_id = info['room_id']
-    player_id = info['player_id']
-    with LOCK:
-        room = rooms.get(room_id)
-        if not room:
+    size, win = payload.get('size', DEFAULT_SIZE), payload.get('win', DEFAULT_WIN)
+    if not valid_rules(size, win):
+        send(conn, {'code': Code.ERROR, 'payload': 'Invalid board size'})
+        return
+    if conn.user is None:
+        handle_identify(conn, {})
+    with RATINGS_LOCK:
+        rating = conn.user.rating
+    with MATCH_LOCK:
+        # checked under MATCH_LOCK: a sweep may be seating conn right now
+        if conn.seat is not None:
+            send(conn, {'code': Code.ERROR, 'payload': 'Already in a room'})
             return
-        state = room['state']
-        if 'restart_votes' not in state:
-            state['restart_votes'] = set()
-        vote = payload.get('agree', False)
-        if vote:
-            state['restart_votes'].add(player_id)
+        if conn.queued is not None:
+            # queued with other rules: the latest request counts
+            conn.queued.discard(conn)
+        mq = match_queues.get((size, win))
+        if mq is None:
+            mq = match_queues[(size, win)] = MatchQueue(MATCH_WINDOW, MATCH_WIDEN, MATCH_MAX_WINDOW)
+        mq.add(conn, rating, time.monotonic())
+        conn.queued = mq
+        send(conn, {'code': Code.MATCHMAKE, 'payload': {'status': 'QUEUED', 'rating': round(rating, 1),
+                                                        'size': size, 'win': win}})
+        other = mq.match(conn, time.monotonic())
+        if other is not None:
+            # the other player has waited longer: it plays X
+            start_rated(other, conn, shared_rules(size, win))
+        elif not sweeping:
+            schedule_sweep()
+
+def leave_queue(conn):
+    # take conn off the matchmaking queue it waits in; True if it was waiting. Always under
+    # MATCH_LOCK, even when conn looks unqueued: a sweep that has just paired conn clears
+    # conn.queued before it seats conn, and a caller about to check conn.seat must wait for that.
+    with MATCH_LOCK:
+        mq = conn.queued
+        conn.queued = None
+        return mq is not None and mq.discard(conn)
+
+def start_rated(first, second, rules):
+    # two players just taken off a matchmaking queue, in a new rated room; caller holds MATCH_LOCK
+    first.queued = second.queued = None
+    room = create_room(first, rules, rated=True)
+    error = join_room(second, room.id)
+    if error:
+        send(second, {'code': Code.ERROR, 'payload': error})
+        handle_leave_room(first, {})
+
+def schedule_sweep():
+    # caller holds MATCH_LOCK
+    global sweeping
+    sweeping = True
+    wheel.schedule(MATCH_INTERVAL, sweep_queues)
+
+def sweep_queues():
+    # every MATCH_INTERVAL while anyone is queued: pair the players whose windows have widened
+    # enough to take each other since they queued
+    global sweeping
+    with MATCH_LOCK:
+        now = time.monotonic()
+        budget = MATCH_SWEEP
+        for key, mq in list(match_queues.items()):
+            pairs = mq.sweep(now, budget) if budget > 0 else ()
+            for first, second in pairs:
+                start_rated(first, second, shared_rules(*key))
+            budget -= len(pairs)
+            if not mq:
+                del match_queues[key]
+        sweeping = False
+        if match_queues:
+            schedule_sweep()
+
+def seat_user(slot, conn):
+    # the rated player conn plays as, seated in slot of a rated room; caller holds room.lock
+    room = slot.room
+    if room.rated and conn.user is not None:
+        slot.user = conn.user
+        log_event(room, USER, slot.num, conn.user.user.encode('ascii'))
+
+def rating_state(room):
+    # {player id: rating} of a rated room's players, for MATCH_START; caller holds room.lock
+    with RATINGS_LOCK:
+        return {slot.name: round(slot.user.rating, 1) for slot in room.seats if slot.user is not None}
+
+def rate_game(room):
+    # a game of a rated room has just finished (room.result set): both players' ratings move, and
+    # their new ratings go in room.result['ratings']; caller holds room.lock
+    p1, p2 = room.seats
+    if p1.user is None or p2.user is None or p1.user is p2.user:
+        return
+    result = room.result
+    score = 0.5 if result.get('draw') else 1.0 if result.get('winner') == p1.name else 0.0
+    with RATINGS_LOCK:
+        changes = ratings.rate(p1.user, p2.user, score)
+        result['ratings'] = {}
+        for slot, change in zip(room.seats, changes):
+            players.saved(slot.user)
+            result['ratings'][slot.name] = {'user': slot.user.user, 'rating': round(slot.user.rating, 1),
+                                            'change': round(change, 1)}
+    logger.info("game_rated", room=room.id, **{f"p{slot.num}": round(slot.user.rating) for slot in room.seats})
+
+def rating_news(room):
+    # the RATING messages for the players of a game that has just finished, if it was rated; caller holds room.lock
+    changes = room.result.get('ratings') if room.result else None
+    if not changes:
+        return []
+    msg = {'code': Code.RATING, 'payload': {'room_id': room.id, 'ratings': changes}}
+    return [(conn, msg) for conn in room.conns()]
+
+def forfeit(room, slot):
+    # slot's player is leaving for good while a game of a rated room is on: it loses, and the game
+    # is rated as such; returns the RATING messages. Caller holds room.lock, and slot still has its user.
+    if not room.rated or room.turn is None or room.finished:
+        return []
+    stop_clock(room)
+    room.finished = True
+    room.result = {'winner': slot.opponent.name, 'forfeit': slot.name}
+    room.draw_offer = None
+    for s in room.seats:
+        s.premove = None
+    log_event(room, FORFEIT, slot.num)
+    record_game(room)
+    notify_spectators(room)
+    logger.info("game_forfeited", room=room.id, player=slot.name)
+    return rating_news(room)
+
+def send_room_list(conn, payload):
+    # one page of waiting rooms, oldest first; pass back 'next_cursor' as 'cursor' for the next page
+    cursor = payload.get('cursor')
+    limit = payload.get('limit', PAGE_SIZE)
+    if not isinstance(cursor, int) or isinstance(cursor, bool):
+        cursor = None
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        limit = PAGE_SIZE
+    with ROOMS_LOCK:
+        entries, next_cursor = waiting.page(cursor, min(limit, MAX_PAGE_SIZE))
+        total = len(waiting)
+    send(conn, {'code': Code.ROOM_LIST, 'payload': {'rooms': entries, 'next_cursor': next_cursor, 'total': total}})
+
+def handle_lobby_subscribe(conn, payload):
+    # the snapshot goes out with the next tick, so it is always ordered before the deltas that follow it
+    if isinstance(conn, LocalPeer):
+        return
+    with ROOMS_LOCK:
+        if payload.get('subscribe', True):
+            lobby_subscribers.discard(conn)
+            lobby_joining.add(conn)
         else:
-            state['restart_votes'] = set()
-        if len(state['restart_votes']) >= 2:
-            room['state'] = make_new_state()
-            if len(room['players']) == 2:
-                p1_id = room['players'][0][2]
-                room['state']['turn'] = p1_id
-                room['state']['symbols'] = {room['players'][0][2]: 'X', room['players'][1][2]: 'O'}
-            for p_sock, _, _ in room['players']:
-                send_msg(p_sock, {'code': Code.MATCH_RESTART, 'payload': {}})
-            print(f"Room {room_id} restarted by mutual agreement")
+            lobby_subscribers.discard(conn)
+            lobby_joining.discard(conn)
+
+def unsubscribe_lobby(conn):
+    with ROOMS_LOCK:
+        lobby_subscribers.discard(conn)
+        lobby_joining.discard(conn)
+
+def flush_lobby():
+    # one tick: the coalesced room changes to every subscriber, a full snapshot to new ones.
+    # Only this function sends LOBBY_UPDATE, from one thread (or the event loop), so a subscriber
+    # never sees a delta older than its snapshot.
+    with ROOMS_LOCK:
+        added, removed = waiting.take_changes()
+        subscribers = list(lobby_subscribers)
+        joining = list(lobby_joining)
+        lobby_subscribers.update(lobby_joining)
+        lobby_joining.clear()
+        snapshot = waiting.snapshot() if joining else None
+    if subscribers and (added or removed):
+        broadcast(subscribers, {'code': Code.LOBBY_UPDATE, 'payload': {'added': added, 'removed': removed}})
+    if joining:
+        entries = [{'room_id': room_id, **rules} for room_id, (_, rules) in snapshot]
+        broadcast(joining, {'code': Code.LOBBY_UPDATE, 'payload': {'snapshot': True, 'added': entries, 'removed': []}})
+    if publish_lobby is not None:
+        # the other workers hear about this worker's rooms only
+        publish_lobby([e for e in added if shard_of(e['room_id']) == SHARD],
+                      [room_id for room_id in removed if shard_of(room_id) == SHARD])
+
+def local_lobby():
+    # this worker's waiting rooms, the snapshot a new peer worker starts from
+    with ROOMS_LOCK:
+        return [{'room_id': room_id, **waiting.rooms[room_id][1]} for room_id in waiting.by_origin[True]]
+
+def apply_remote_lobby(shard, added, removed, reset=False):
+    # lobby changes of worker `shard` (cluster.py): its rooms are listed here and quick match can
+    # send players to them; reset drops everything listed for it first (it restarted, or went away)
+    with ROOMS_LOCK:
+        if reset:
+            for room_id in [r for r in waiting.by_origin[False] if shard_of(r) == shard]:
+                waiting.discard(room_id)
+        for room_id in removed:
+            if shard_of(room_id) == shard:
+                waiting.discard(room_id)
+        for entry in added:
+            if shard_of(entry['room_id']) == shard:
+                waiting.add(entry['room_id'], shared_rules(entry['size'], entry['win']), local=False)
+
+def lobby_ticker():
+    while True:
+        time.sleep(LOBBY_TICK)
+        try:
+            flush_lobby()
+        except Exception as e:
+            logger.error("lobby_update_error", error=e)
+
+def spectator_snapshot(room):
+    # compact view of a room for spectators: rules, seats, turn, result, and the stones as flat
+    # [x0, y0, x1, y1, ...] lists per symbol; caller holds room.lock
+    stones = {'X': [], 'O': []}
+    for x, y, sym in room.board.stones():
+        stones[sym].extend((x, y))
+    return {'code': Code.SPECTATE, 'payload': {
+        'room_id': room.id, **room.rules, 'players': [slot.name for slot in room.seated()],
+        'symbols': {slot.name: slot.symbol for slot in room.seats if slot.symbol},
+        'turn': room.turn.name if room.turn else None, 'finished': room.finished,
+        'result': room.result, 'x': stones['X'], 'o': stones['O'], 'seq': len(room.moves), **clock_state(room)}}
+
+def queue_fanout(room, conns, msg, frames=None):
+    # caller holds room.lock; start a fan-out pass unless one is already draining the room's queue
+    pending = room.fanout
+    if pending is None:
+        pending = room.fanout = deque()
+    pending.append([conns, 0, msg, frames])
+    if len(pending) == 1:
+        defer(fan_out, room)
+
+def fan_out(room):
+    # one slice of the oldest pending spectator message, then yield; the queue is only appended to
+    # under the room lock, and a spare pass started by a racing append finds nothing or just helps
+    pending = room.fanout
+    if not pending:
+        return
+    job = pending[0]
+    conns, start, msg, frames = job
+    end = start + FANOUT_SLICE
+    if end < len(conns):
+        job[1] = end
+    else:
+        pending.popleft()
+    broadcast(conns[start:end], msg, frames)
+    if pending:
+        defer(fan_out, room)
+
+def notify_spectators(room, msg=None, frames=None):
+    # queue msg (default: a fresh snapshot) for the room's spectators; caller holds room.lock
+    if room.spectators:
+        queue_fanout(room, list(room.spectators), msg or spectator_snapshot(room), frames)
+
+def handle_spectate(conn, payload):
+    # watch a room read-only: a snapshot first, then its moves, chat and state changes
+    room_id = payload.get('room_id')
+    # a spectator doesn't wait for a rated game: a sweep would seat it while it watches
+    leave_queue(conn)
+    if conn.seat is not None:
+        send(conn, {'code': Code.ERROR, 'payload': 'Already in a room'})
+        return
+    with ROOMS_LOCK:
+        room = rooms.get(room_id) if room_id else None
+    stop_spectating(conn)
+    if not room:
+        send(conn, {'code': Code.ERROR, 'payload': 'Room not found'})
+        return
+    with room.lock:
+        if room.closed:
+            error = 'Room not found'
         else:
-            for p_sock, _, p_id in room['players']:
-                if p_id != player_id:
-                    send_msg(p_sock, {'code': Code.MATCH_RESTART, 'payload': {'request_from': player_id}})
+            error = None
+            if room.spectators is None:
+                room.spectators = set()
+            room.spectators.add(conn)
+            conn.watching = room
+            # through the room's fan-out queue like every later spectator message, so the snapshot comes first
+            queue_fanout(room, [conn], spectator_snapshot(room))
+    if error:
+        send(conn, {'code': Code.ERROR, 'payload': error})
 
-def handle_leave_room(sock, payload):
-    info = clients.get(sock)
-    if not info:
+def stop_spectating(conn):
+    # returns True if conn was watching a room
+    room = conn.watching
+    if room is None:
+        return False
+    with room.lock:
+        if room.spectators:
+            room.spectators.discard(conn)
+        if conn.watching is room:
+            conn.watching = None
+    return True
+
+def handle_chat(conn, payload):
+    slot = conn.seat
+    if slot is None:
+        send(conn, {'code': Code.ERROR, 'payload': 'Not in a room'})
         return
-    room_id = info['room_id']
-    player_id = info['player_id']
-    with LOCK:
-        room = rooms.get(room_id)
-        if not room:
-            return
-        new_players = [p for p in room['players'] if p[2] != player_id]
-        room['players'] = new_players
-        for p_sock, _, p_id in room['players']:
-            send_msg(p_sock, {'code': Code.ROOM_LEAVE, 'payload': {'left_player': player_id}})
-            send_msg(p_sock, {'code': Code.MATCH_LEFT, 'payload': {'left_player': player_id}})
-        if len(room['players']) == 0:
-            del rooms[room_id]
-            print(f"🗑️ Room {room_id} deleted (empty)")
-        send_msg(sock, {'code': Code.ROOM_LEAVE_SUCCESS, 'payload': {}})
-        try:
-            del clients[sock]
-        except KeyError:
-            pass
-        print(f"Player {player_id} left room {room_id} voluntarily")
+    room = slot.room
+    msg = {'code': Code.MESSAGE_CODE, 'payload': {'from': slot.name, 'text': payload.get('text')}}
+    with room.lock:
+        if room.closed or slot.conn is not conn:
+            opponent = None
+            error = 'Room not found'
+        else:
+            error = None
+            room.active = wheel.tick
+            opponent = slot.opponent.conn
+            notify_spectators(room, msg)
+    if error:
+        send(conn, {'code': Code.ERROR, 'payload': error})
+    elif opponent is not None:
+        send(opponent, msg)
 
-def handle_disconnect(sock):
-    info = clients.get(sock)
-    if not info:
+def handle_move(conn, payload):
+    # payload {'x', 'y'}, optionally 'seq': the number of moves of the game the client has seen.
+    # With seq, a resend of a move already played is answered again instead of refused, an older
+    # seq is refused as stale, and a move sent while the opponent is to move is kept as a pre-move
+    # and played straight after the opponent's move.
+    slot = conn.seat
+    if slot is None:
+        send(conn, {'code': Code.ERROR, 'payload': 'Not in room'})
         return
-    room_id = info['room_id']
-    player_id = info['player_id']
-    with LOCK:
-        room = rooms.get(room_id)
-        if room:
-            new_players = [p for p in room['players'] if p[2] != player_id]
-            room['players'] = new_players
-            for p_sock, _, p_id in room['players']:
-                send_msg(p_sock, {'code': Code.MATCH_LEFT, 'payload': {'left_player': player_id}})
-                send_msg(p_sock, {'code': Code.ROOM_LEAVE, 'payload': {'left_player': player_id}})
-            if len(room['players']) == 0:
-                del rooms[room_id]
-                print(f"🗑️ Room {room_id} deleted (empty due to disconnect)")
-        try:
-            del clients[sock]
-        except:
-            pass
-        print(f"Handled disconnect of {player_id} from room {room_id}")
+    room = slot.room
+    frames = {}
+    msgs = None
+    reply = None
+    dropped = None
+    flagged = None
+    rated = None
+    with room.lock:
+        seq = payload.get('seq')
+        if seq is not None and seq != len(room.moves):
+            error, reply = seen_move(conn, slot, payload, seq)
+        else:
+            error = validate_move(conn, slot, payload, premove=seq is not None)
+        if not error and not reply:
+            if room.turn is slot and room.clock is not None and room.clock.expired(slot.num, time.monotonic()):
+                # too late, only the flag-fall timer hasn't fired yet
+                flagged = time_out(room)
+            elif room.turn is slot:
+                msgs = [play_move(slot, payload['x'], payload['y'])]
+                ahead = slot.opponent
+                if ahead.premove is not None and not room.finished:
+                    x, y = ahead.premove
+                    ahead.premove = None
+                    if room.board.is_empty(x, y):
+                        msgs.append(play_move(ahead, x, y))
+                    else:
+                        dropped = ahead.conn
+            else:
+                # the latest pre-move counts
+                slot.premove = (payload['x'], payload['y'])
+            if msgs:
+                opponent = slot.opponent.conn
+                # one encoding per protocol, shared by the players and the spectator fan-out; a
+                # pre-move played along goes out in the same write as the move before it
+                if len(msgs) == 1:
+                    msgs = msgs[0]
+                notify_spectators(room, msgs, frames)
+                if room.finished:
+                    rated = rating_news(room)
+    if error:
+        send(conn, {'code': Code.ERROR, 'payload': error})
+        return
+    if reply:
+        send(conn, reply)
+    if msgs:
+        broadcast((conn, opponent) if opponent is not None else (conn,), msgs, frames)
+        if room.finished and room.result.get('winner'):
+            logger.info("game_won", room=room.id, winner=room.result['winner'])
+    if rated:
+        deliver(rated)
+    if dropped is not None:
+        send(dropped, {'code': Code.ERROR, 'payload': 'Pre-move dropped'})
+    if flagged:
+        deliver(flagged)
+        logger.info("flag_fall", room=room.id, player=slot.name)
+
+def play_move(slot, x, y):
+    # put slot's stone on (x, y), already validated; returns the MATCH_MOVE to send. Caller holds room.lock.
+    room = slot.room
+    winner = room.board.place(x, y, slot.symbol)
+    room.moves.append((slot.num, x, y))
+    room.active = wheel.tick
+    room.draw_offer = None
+    log_event(room, MOVE, slot.num, x, y)
+    if not winner:
+        # the opponent's seat may be held, with nobody in it right now
+        room.turn = slot.opponent
+    else:
+        room.finished = True
+        room.result = {'winner': slot.name}
+        record_game(room)
+    msg = move_msg(room, len(room.moves) - 1)
+    clock = room.clock
+    if clock is not None:
+        if winner:
+            stop_clock(room)
+        else:
+            now = time.monotonic()
+            left = clock.press(slot.num, now)
+            wind_clock(room, now)
+            if clock.base:
+                # ms left on the mover's clock
+                msg['payload']['clock'] = int(left * 1000)
+    return msg
+
+def move_msg(room, i):
+    # the MATCH_MOVE of move i of the current game; its 'seq' is i + 1. Caller holds room.lock.
+    n, x, y = room.moves[i]
+    slot = room.seats[n - 1]
+    winner = room.finished and i == len(room.moves) - 1 and room.result.get('winner') == slot.name
+    return {'code': Code.MATCH_MOVE, 'payload': {'x': x, 'y': y, 'symbol': slot.symbol, 'by': slot.name,
+                                                 'winner': winner, 'seq': i + 1}}
+
+def seen_move(conn, slot, payload, seq):
+    # (error, reply) for a move whose seq is not the room's: the move is never played. A resend of
+    # one of our moves already played (a reply lost to a dropped connection) gets its MATCH_MOVE
+    # again; anything else was made on a position the client no longer has. Caller holds room.lock.
+    room = slot.room
+    if room.closed or slot.conn is not conn:
+        return 'Room missing', None
+    if type(seq) is not int or seq < 0:
+        return 'Invalid move', None
+    if seq < len(room.moves) and room.moves[seq] == (slot.num, payload.get('x'), payload.get('y')):
+        return None, move_msg(room, seq)
+    return 'Stale move', None
+
+def validate_move(conn, slot, payload, premove=False):
+    # error text for an illegal move, or None; caller holds slot.room.lock. premove: a move made
+    # while the opponent is to move is fine, to be kept until it has moved.
+    room = slot.room
+    if room.closed or slot.conn is not conn:
+        return 'Room missing'
+    if not slot.opponent.taken():
+        # a dropped opponent's seat is held: it gets the moves it missed when it resumes
+        return 'Opponent missing'
+    if room.finished:
+        return 'Match finished'
+    if room.turn is not slot and not premove:
+        return 'Not your turn'
+    x = payload.get('x'); y = payload.get('y')
+    if type(x) is not int or type(y) is not int or not room.board.contains(x, y):
+        return 'Invalid move'
+    if not room.board.is_empty(x, y):
+        return 'Cell occupied'
+    return None
+
+def handle_sync(conn, payload):
+    # {'seq': N}: the moves of the current game after the first N, for a player or spectator whose
+    # board fell behind, at most SYNC_PAGE of them per reply ('more' asks for the next page). A seq
+    # the room doesn't have (from an earlier game) starts again from the first move, 'reset' set.
+    slot = conn.seat
+    room = slot.room if slot is not None else conn.watching
+    if room is None:
+        send(conn, {'code': Code.ERROR, 'payload': 'Not in a room'})
+        return
+    since = payload.get('seq')
+    with room.lock:
+        if room.closed:
+            reply = {'code': Code.ERROR, 'payload': 'Room not found'}
+        else:
+            moves = room.moves
+            reset = type(since) is not int or not 0 <= since <= len(moves)
+            if reset:
+                since = 0
+            end = min(len(moves), since + SYNC_PAGE)
+            sym_of = (None, room.seats[0].symbol, room.seats[1].symbol)
+            reply = {'code': Code.SYNC, 'payload': {
+                'room_id': room.id, 'from': since, 'seq': end, 'reset': reset, 'more': end < len(moves),
+                'moves': [[x, y, sym_of[n]] for n, x, y in moves[since:end]],
+                'turn': room.turn.name if room.turn else None, 'finished': room.finished, 'result': room.result}}
+    send(conn, reply)
+
+def handle_restart_request(conn, payload):
+    slot = conn.seat
+    if slot is None:
+        return
+    room = slot.room
+    out = []
+    restarted = False
+    with room.lock:
+        if room.closed or slot.conn is not conn:
+            return
+        if payload.get('agree', False):
+            if room.votes is None:
+                room.votes = set()
+            room.votes.add(slot.num)
+        else:
+            room.votes = None
+        if room.votes and len(room.votes) >= 2:
+            room.active = wheel.tick
+            p1, p2 = room.seats
+            if p1.conn is not None and p2.conn is not None:
+                # whoever played X plays X again
+                first = p2 if p2.symbol == 'X' else p1
+                room.start(first)
+                log_event(room, START, first.num)
+                start_clock(room)
+            else:
+                stop_clock(room)
+                room.reset()
+            for p in room.conns():
+                out.append((p, {'code': Code.MATCH_RESTART, 'payload': {}}))
+            restarted = True
+            notify_spectators(room)
+        else:
+            opponent = slot.opponent.conn
+            if opponent is not None:
+                out.append((opponent, {'code': Code.MATCH_RESTART, 'payload': {'request_from': slot.name}}))
+    deliver(out)
+    if restarted:
+        logger.info("room_restarted", room=room.id)
 
-def handle_draw_request(sock, payload):
-    info = clients.get(sock)
-    if not info:
+def handle_leave_room(conn, payload):
+    slot = conn.seat
+    if slot is None:
+        if stop_spectating(conn):
+            send(conn, {'code': Code.ROOM_LEAVE_SUCCESS, 'payload': {}})
         return
-    room_id = info['room_id']
-    player_id = info['player_id']
-    with LOCK:
-        room = rooms.get(room_id)
-        if not room:
+    room = slot.room
+    out = []
+    deleted = False
+    with room.lock:
+        if slot.conn is not conn:
+            # the room was closed (expired) under it
             return
-        for p_sock, _, p_id in room['players']:
-            if p_id != player_id:
-                send_msg(p_sock, {'code': Code.MATCH_DRAW_REQUEST, 'payload': {'from': player_id}})
+        out.extend(forfeit(room, slot))
+        slot.conn = None
+        slot.token = None
+        slot.premove = None
+        slot.user = None
+        conn.seat = None
+        log_event(room, LEAVE, slot.num)
+        stop_clock(room)
+        opponent = slot.opponent.conn
+        if opponent is not None:
+            out.append((opponent, {'code': Code.ROOM_LEAVE, 'payload': {'left_player': slot.name}}))
+            out.append((opponent, {'code': Code.MATCH_LEFT, 'payload': {'left_player': slot.name}}))
+        if not slot.opponent.taken():
+            close_room(room)
+            deleted = True
+        else:
+            notify_spectators(room)
+        with ROOMS_LOCK:
+            update_waiting(room)
+    out.append((conn, {'code': Code.ROOM_LEAVE_SUCCESS, 'payload': {}}))
+    deliver(out)
+    logger.info("room_left", room=room.id, player=slot.name, room_deleted=deleted)
 
-def handle_draw_accept(sock, payload):
-    info = clients.get(sock)
-    if not info:
+def handle_disconnect(conn):
+    leave_queue(conn)
+    slot = conn.seat
+    if slot is None:
+        stop_spectating(conn)
         return
-    room_id = info['room_id']
-    with LOCK:
-        room = rooms.get(room_id)
-        if not room:
+    room = slot.room
+    out = []
+    deleted = False
+    held = False
+    with room.lock:
+        if slot.conn is not conn:
             return
-        room['state']['finished'] = True
-        room['state']['result'] = {'draw': True}
-        for p_sock, _, _ in room['players']:
-            send_msg(p_sock, {'code': Code.MATCH_DRAW_ACCEPT, 'payload': {}})
-
-def handle_draw_reject(sock, payload):
-    info = clients.get(sock)
-    if not info:
+        slot.conn = None
+        slot.premove = None
+        conn.seat = None
+        opponent = slot.opponent.conn
+        if RESUME_GRACE > 0 and not room.closed and not isinstance(conn, LocalPeer):
+            # keep the seat and the game: the player may come back on a new connection with RESUME
+            hold_seat(slot, RESUME_GRACE)
+            held = True
+            if opponent is not None:
+                out.append((opponent, {'code': Code.MATCH_LEFT, 'payload': {'left_player': slot.name, 'grace': RESUME_GRACE}}))
+        else:
+            out.extend(forfeit(room, slot))
+            slot.token = None
+            slot.user = None
+            log_event(room, LEAVE, slot.num)
+            stop_clock(room)
+            if opponent is not None:
+                out.append((opponent, {'code': Code.MATCH_LEFT, 'payload': {'left_player': slot.name}}))
+                out.append((opponent, {'code': Code.ROOM_LEAVE, 'payload': {'left_player': slot.name}}))
+        if not room.closed:
+            if not slot.taken() and not slot.opponent.taken():
+                close_room(room)
+                deleted = True
+            else:
+                notify_spectators(room)
+            with ROOMS_LOCK:
+                update_waiting(room)
+    deliver(out)
+    if held:
+        logger.info("seat_held", room=room.id, player=slot.name, grace=RESUME_GRACE)
+    else:
+        logger.info("player_disconnected", room=room.id, player=slot.name, room_deleted=deleted)
+
+def handle_draw_request(conn, payload):
+    relay_to_opponent(conn, Code.MATCH_DRAW_REQUEST, offer=True)
+
+def handle_draw_accept(conn, payload):
+    slot = conn.seat
+    if slot is None:
         return
-    room_id = info['room_id']
-    player_id = info['player_id']
-    with LOCK:
-        room = rooms.get(room_id)
-        if not room:
+    room = slot.room
+    out = []
+    with room.lock:
+        if room.closed or slot.conn is not conn or room.finished:
             return
-        for p_sock, _, p_id in room['players']:
-            if p_id != player_id:
-                send_msg(p_sock, {'code': Code.MATCH_DRAW_REJECT, 'payload': {'from': player_id}})
-
-# helpers
-def make_new_state():
-    return {
-        'board': [['' for _ in range(10)] for __ in range(10)],
-        'turn': None,
-        'symbols': {},
-        'finished': False,
-        'result': None,
-    }
-
-def check_winner(board, x, y, sym):
-    directions = [(1,0),(0,1),(1,1),(1,-1)]
-    for dx, dy in directions:
-        cnt = 1
-        nx, ny = x+dx, y+dy
-        while 0 <= nx < 10 and 0 <= ny < 10 and board[ny][nx] == sym:
-            cnt += 1
-            nx += dx; ny += dy
-        nx, ny = x-dx, y-dy
-        while 0 <= nx < 10 and 0 <= ny < 10 and board[ny][nx] == sym:
-            cnt += 1
-            nx -= dx; ny -= dy
-        if cnt >= 5:
-            return True
-    return False
+        if room.draw_offer is not slot.opponent:
+            # only a standing offer of the opponent can be accepted
+            out.append((conn, {'code': Code.ERROR, 'payload': 'No draw offer'}))
+        else:
+            room.finished = True
+            room.result = {'draw': True}
+            room.draw_offer = None
+            log_event(room, DRAW)
+            stop_clock(room)
+            record_game(room)
+            for p in room.conns():
+                out.append((p, {'code': Code.MATCH_DRAW_ACCEPT, 'payload': {}}))
+            out.extend(rating_news(room))
+            notify_spectators(room)
+    deliver(out)
+
+def handle_draw_reject(conn, payload):
+    relay_to_opponent(conn, Code.MATCH_DRAW_REJECT, offer=False)
+
+def relay_to_opponent(conn, code, offer):
+    # a draw offer or refusal, passed on to the other player as {'from': player id}. An offer
+    # stands until the opponent answers it or the next move; a refusal withdraws the opponent's.
+    slot = conn.seat
+    if slot is None:
+        return
+    room = slot.room
+    with room.lock:
+        opponent = slot.opponent.conn if slot.conn is conn else None
+        if opponent is not None:
+            if offer:
+                room.draw_offer = slot if room.turn is not None and not room.finished else None
+            elif room.draw_offer is slot.opponent:
+                room.draw_offer = None
+    if opponent is not None:
+        send(opponent, {'code': code, 'payload': {'from': slot.name}})
+
+# journal and recovery
+def room_records(room):
+    # journal records that rebuild the room as it is now, all at its current seq; caller holds room.lock
+    seq = room.jseq
+    rules = room.rules
+    records = [encode_record(CREATE, room.id, seq, rules['size'], rules['win'],
+                             room.private * PRIVATE | room.rated * RATED)]
+    for slot in room.seats:
+        if slot.taken():
+            bot = isinstance(slot.conn, LocalPeer) if slot.conn is not None else slot.held
+            records.append(encode_record(SEAT, room.id, seq, slot.num, bot, slot.token.encode('ascii')))
+            if slot.user is not None:
+                records.append(encode_record(USER, room.id, seq, slot.num, slot.user.user.encode('ascii')))
+    first = next((slot for slot in room.seats if slot.symbol == 'X'), None)
+    if first:
+        records.append(encode_record(START, room.id, seq, first.num))
+        records.extend(encode_record(MOVE, room.id, seq, *move) for move in room.moves)
+        if room.result and room.result.get('draw'):
+            records.append(encode_record(DRAW, room.id, seq))
+        elif room.result and 'timeout' in room.result:
+            records.append(encode_record(FLAG, room.id, seq, player_num(room.result['timeout'])))
+        elif room.result and 'forfeit' in room.result:
+            records.append(encode_record(FORFEIT, room.id, seq, player_num(room.result['forfeit'])))
+    return records
+
+def journal_snapshot():
+    # every live room, for a journal snapshot; runs on the journal thread
+    with ROOMS_LOCK:
+        items = list(rooms.values())
+    records = []
+    for room in items:
+        with room.lock:
+            if not room.closed:
+                records.extend(room_records(room))
+    return records
+
+def restore_room(room_id, log):
+    # a room rebuilt from its journal log, every seat held for its player to rejoin
+    room = Room(room_id, shared_rules(log['size'], log['win']), log['private'], wheel.tick, log['rated'])
+    room.jseq = log['seq']
+    for n, (token, bot) in log['seats'].items():
+        slot = room.seats[n - 1]
+        slot.token = token
+        slot.held = bot
+        slot.user = players.players.get(log['users'].get(n))
+    if log['first']:
+        first = room.seats[log['first'] - 1]
+        room.start(first)
+        for n, x, y in log['moves']:
+            slot = room.seats[n - 1]
+            room.moves.append((n, x, y))
+            if room.board.place(x, y, slot.symbol):
+                room.finished = True
+                room.result = {'winner': slot.name}
+            room.turn = slot.opponent
+        if log['draw']:
+            room.finished = True
+            room.result = {'draw': True}
+        elif log['flag']:
+            loser = room.seats[log['flag'] - 1]
+            room.finished = True
+            room.result = {'winner': loser.opponent.name, 'timeout': loser.name}
+        elif log['forfeit']:
+            loser = room.seats[log['forfeit'] - 1]
+            room.finished = True
+            room.result = {'winner': loser.opponent.name, 'forfeit': loser.name}
+        if not room.finished:
+            # the clocks are not journaled: the game goes on with full clocks
+            start_clock(room)
+    return room
+
+def start_journal(directory, flush_interval=FLUSH_INTERVAL):
+    # recover the rooms journaled in `directory`, then journal from here on; call before serving
+    global journal
+    logs, gen = replay(directory)
+    recovered = []
+    for room_id, log in logs.items():
+        if log['seats']:
+            room = restore_room(room_id, log)
+            with room.lock:
+                for slot in room.held():
+                    slot.timer = wheel.schedule(RECOVERY_GRACE, release_seat, slot)
+            with ROOMS_LOCK:
+                rooms[room_id] = room
+            recovered.append(room)
+    for room in recovered:
+        watch_room(room)
+    journal = Journal(directory, journal_snapshot, gen, flush_interval).start()
+    # AI opponents take their seats back straight away
+    from bot import BotPlayer
+    for room in recovered:
+        for slot in room.held():
+            if slot.held:
+                rejoin_room(BotPlayer(('ai', room.id)), room.id, slot.token)
+    if recovered:
+        logger.info("rooms_recovered", rooms=len(recovered), directory=directory, grace=RECOVERY_GRACE)
+
+def start_records(path):
+    # append every game finished from now on to the records file at `path` (records.py)
+    global game_records
+    game_records = records.RecordWriter(path).start()
+
+def start_ratings(path):
+    # player identities and ratings from the file at `path`, and every change appended to it from now on
+    global players
+    players = ratings.PlayerStore(path).start()
+    logger.info("ratings_loaded", players=len(players), path=path)
@@ -0,0 +1,128 @@
+# tests/test_rated_games.py
+# Rated games end with a rating change however they end: a player who leaves, or drops and doesn't
+# come back, loses; a draw needs a standing offer of the opponent.
+#   python -m unittest discover -s tests     (from Caro_nhom8)
+import struct
+import unittest
+import logger
+import ratings
+import server
+from codec import decode_frame
+from common import Code
+
+class Sock:
+    # stands in for a client socket, keeping every message the server writes to it
+    def __init__(self):
+        self.msgs = []
+
+    def sendall(self, data):
+        pos = 0
+        while pos < len(data):
+            length = struct.unpack_from('!I', data, pos)[0]
+            self.msgs.append(decode_frame(data[pos + 4:pos + 4 + length]))
+            pos += 4 + length
+
+    def codes(self):
+        return [m['code'] for m in self.msgs]
+
+    def last(self, code):
+        return next(m['payload'] for m in reversed(self.msgs) if m['code'] == code)
+
+class RatedGameTest(unittest.TestCase):
+    def setUp(self):
+        logger.configure("warning")
+        server.players = ratings.PlayerStore()
+        server.match_queues.clear()
+        self.grace = server.RESUME_GRACE
+        # a rated room between two new players, Player 1 (who queued first) playing X
+        self.p1 = server.Connection(Sock(), ("test", 1))
+        self.p2 = server.Connection(Sock(), ("test", 2))
+        for conn in (self.p1, self.p2):
+            server.handle_matchmake(conn, {'action': 'JOIN'})
+        self.room = self.p1.seat.room
+        self.assertTrue(self.room.rated)
+        self.assertIs(self.p2.seat.room, self.room)
+        self.users = (self.p1.user, self.p2.user)
+
+    def tearDown(self):
+        server.RESUME_GRACE = self.grace
+        for conn in (self.p1, self.p2):
+            if conn.seat is not None:
+                server.handle_leave_room(conn, {})
+
+    def assert_lost(self, loser, winner):
+        self.assertEqual(self.room.result['winner'], winner.seat.name if winner.seat else None)
+        self.assertLess(loser.user.rating, ratings.INITIAL_RATING)
+        self.assertGreater(winner.user.rating, ratings.INITIAL_RATING)
+        self.assertEqual(loser.user.games, 1)
+        news = winner.sock.last(Code.RATING)['ratings']
+        self.assertLess(news[self.room.result['forfeit']]['change'], 0)
+
+    def test_leaving_loses(self):
+        server.handle_move(self.p1, {'x': 7, 'y': 7})
+        left = self.p2.seat.name
+        server.handle_leave_room(self.p2, {})
+        self.assertTrue(self.room.finished)
+        self.assertEqual(self.room.result['forfeit'], left)
+        self.assert_lost(self.p2, self.p1)
+        # the leaver hears about its rating too
+        self.assertIn(Code.RATING, self.p2.sock.codes())
+
+    def test_dropping_loses_once_the_seat_is_given_up(self):
+        server.RESUME_GRACE = 30.0
+        slot = self.p1.seat
+        server.handle_disconnect(self.p1)
+        # held: the player may still come back
+        self.assertFalse(self.room.finished)
+        self.assertEqual(self.p1.user.games, 0)
+        server.wheel.cancel(slot.timer)
+        server.release_seat(slot)
+        self.assertEqual(self.room.result['forfeit'], slot.name)
+        self.assert_lost(self.p1, self.p2)
+
+    def test_dropping_without_grace_loses(self):
+        server.RESUME_GRACE = 0
+        server.handle_disconnect(self.p2)
+        self.assert_lost(self.p2, self.p1)
+
+    def test_draw_needs_an_offer(self):
+        server.handle_draw_accept(self.p2, {})
+        self.assertFalse(self.room.finished)
+        self.assertEqual(self.p2.sock.last(Code.ERROR), 'No draw offer')
+        # an offer lapses with the next move
+        server.handle_draw_request(self.p1, {})
+        server.handle_move(self.p1, {'x': 7, 'y': 7})
+        server.handle_draw_accept(self.p2, {})
+        self.assertFalse(self.room.finished)
+        # the offering player can't accept its own offer
+        server.handle_draw_request(self.p2, {})
+        server.handle_draw_accept(self.p2, {})
+        self.assertFalse(self.room.finished)
+        server.handle_draw_accept(self.p1, {})
+        self.assertEqual(self.room.result['draw'], True)
+        self.assertEqual(self.p1.user.draws, 1)
+        self.assertIn(Code.RATING, self.p2.sock.codes())
+
+    def test_finished_game_is_not_rated_again_on_leave(self):
+        server.handle_draw_request(self.p1, {})
+        server.handle_draw_accept(self.p2, {})
+        server.handle_leave_room(self.p2, {})
+        self.assertEqual([u.games for u in self.users], [1, 1])
+
+    def test_spectating_leaves_the_queue(self):
+        watcher = server.Connection(Sock(), ("test", 3))
+        server.handle_matchmake(watcher, {'action': 'JOIN'})
+        self.assertIsNotNone(watcher.queued)
+        server.handle_spectate(watcher, {'room_id': self.room.id})
+        self.assertIsNone(watcher.queued)
+        self.assertIs(watcher.watching, self.room)
+        # a later player is not paired with the spectator
+        other = server.Connection(Sock(), ("test", 4))
+        server.handle_matchmake(other, {'action': 'JOIN'})
+        self.assertIsNone(watcher.seat)
+        self.assertIsNone(other.seat)
+        for conn in (watcher, other):
+            server.handle_leave_room(conn, {})
+
+if __name__ == "__main__":
+    unittest.main()
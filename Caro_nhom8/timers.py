@@ -0,0 +1,148 @@
+# timers.py
+# Hierarchical timer wheel for the server's many long, coarse deadlines (idle connections, inactive
+# rooms, held seats), so none of them needs a scan of `rooms` or `clients`:
+# - time advances in ticks of `tick` seconds; level 0 has one slot per tick for the next SLOTS
+#   ticks, level 1 one slot per SLOTS ticks, and so on (SLOTS ** LEVELS ticks in all, ~19 days at
+#   0.1 s); later deadlines wait in an overflow list that is re-filed once per full turn
+# - a timer goes in the lowest level whose span still reaches its deadline; when a higher-level slot
+#   comes round its timers are re-filed one level down (cascade). Scheduling, cancelling and an
+#   empty tick are O(1); each timer is moved at most LEVELS times before it fires.
+# - the level-1 slot due next is moved down a share at a time over the SLOTS ticks before it comes
+#   round, not all on its first tick, so many deadlines in the same 25.6 s (game clocks of thousands
+#   of rooms) cost a little every tick instead of one long tick; a level-0 slot can hold such timers
+#   for its next turn, and only fires those that are due.
+# Deadlines that keep moving (a connection's idle time) are not rescheduled on every message: the
+# owner stores `wheel.tick` as its last activity and the timer, when it fires, schedules itself
+# again from there if there was any.
+import threading
+
+BITS = 8
+SLOTS = 1 << BITS
+MASK = SLOTS - 1
+LEVELS = 3
+
+class Timer:
+    __slots__ = ('expires', 'fn', 'args', 'slot')
+
+    def __init__(self, expires, fn, args):
+        self.expires = expires   # tick
+        self.fn = fn
+        self.args = args
+        self.slot = None         # set (wheel slot) it is filed in, None once fired or cancelled
+
+class TimerWheel:
+    def __init__(self, tick=0.1, start=0.0):
+        self.resolution = tick
+        self.origin = start      # clock time of tick 0
+        self.tick = 0            # ticks that have passed; also a coarse clock for activity stamps
+        self.levels = [[set() for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self.overflow = set()
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def ticks(self, seconds):
+        # a duration in whole ticks, rounded up
+        return max(int(-(-seconds // self.resolution)), 0)
+
+    def seconds(self, ticks):
+        return ticks * self.resolution
+
+    def schedule(self, delay, fn, *args):
+        # fn(*args) once `delay` seconds from the current tick have passed
+        return self.schedule_at(self.tick + self.ticks(delay), fn, *args)
+
+    def schedule_at(self, tick, fn, *args):
+        timer = Timer(tick, fn, args)
+        with self.lock:
+            # a deadline already passed fires on the next tick
+            timer.expires = max(tick, self.tick + 1)
+            self._file(timer)
+            self.count += 1
+        return timer
+
+    def cancel(self, timer):
+        with self.lock:
+            if timer.slot is not None:
+                timer.slot.discard(timer)
+                timer.slot = None
+                self.count -= 1
+
+    def _file(self, timer):
+        # caller holds the lock; timer.expires > self.tick
+        expires = timer.expires
+        # the highest bit where the deadline and now differ picks the level
+        level = ((expires ^ self.tick).bit_length() - 1) // BITS
+        if level < LEVELS:
+            slot = self.levels[level][(expires >> (BITS * level)) & MASK]
+        else:
+            slot = self.overflow
+        slot.add(timer)
+        timer.slot = slot
+
+    def _cascade(self, level):
+        # caller holds the lock: re-file the timers of the slot of `level` that has just come round
+        slot = self.levels[level][(self.tick >> (BITS * level)) & MASK]
+        due = []
+        for timer in slot:
+            if timer.expires <= self.tick:
+                due.append(timer)
+            else:
+                self._file(timer)
+        slot.clear()
+        return due
+
+    def _drain(self):
+        # caller holds the lock: move this tick's share of the next level-1 slot to level 0
+        ahead = self.levels[1][((self.tick >> BITS) + 1) & MASK]
+        if not ahead:
+            return
+        level0 = self.levels[0]
+        for _ in range(-(-len(ahead) // (SLOTS - (self.tick & MASK)))):
+            timer = ahead.pop()
+            slot = level0[timer.expires & MASK]
+            slot.add(timer)
+            timer.slot = slot
+
+    def advance(self, now):
+        # move the wheel to clock time `now`; returns the timers that came due, to pass to run()
+        target = int((now - self.origin) / self.resolution)
+        due = []
+        with self.lock:
+            while self.tick < target:
+                self.tick += 1
+                if not self.tick & MASK:
+                    if not self.tick & ((1 << (BITS * LEVELS)) - 1) and self.overflow:
+                        pending = list(self.overflow)
+                        self.overflow.clear()
+                        for timer in pending:
+                            self._file(timer)
+                    for level in range(LEVELS - 1, 0, -1):
+                        if not self.tick & ((1 << (BITS * level)) - 1):
+                            due.extend(self._cascade(level))
+                slot = self.levels[0][self.tick & MASK]
+                if slot:
+                    ready = [timer for timer in slot if timer.expires <= self.tick]
+                    if len(ready) == len(slot):
+                        slot.clear()
+                    else:
+                        for timer in ready:
+                            slot.discard(timer)
+                    due.extend(ready)
+                self._drain()
+            for timer in due:
+                timer.slot = None
+            self.count -= len(due)
+        return due
+
+    def run(self, due, on_error=None):
+        # call the timers returned by advance(), outside the wheel's lock (they may schedule more)
+        for timer in due:
+            try:
+                timer.fn(*timer.args)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(e)